@@ -36,6 +36,9 @@ parser.add_argument('--nb_process', default=4, type=int,
 
 parser.add_argument('--tar_and_delete', action='store_true',
                     help='Will archive generated files and delete the non compressed version')
+parser.add_argument('--nested_scene_sets', action='store_true',
+                    help='Only the largest scene set is generated (With --nested_sets), questioned and rendered. The '
+                         'smaller versions are materialised as views of it (See scripts/materialize_nested_view.py)')
 
 
 def write_script(script, filepath):
@@ -98,6 +101,17 @@ def generate_question_commands(base_config_path, base_version_name, output_folde
     return cmds, names, log_paths
 
 
+def generate_nested_view_commands(source_names, view_names, nb_scene, output_folder, python_bin="python",
+                                  script_name='scripts.materialize_nested_view'):
+    cmds = []
+
+    for source_name, view_name in zip(source_names, view_names):
+        cmds.append(f"{python_bin} -m {script_name} --output_folder {output_folder} --source_version {source_name} "
+                    f"--output_version_nb {view_name} --nb_scene {nb_scene}\n")
+
+    return cmds
+
+
 def generate_consolidation_commands(output_folder, version_names, script_name='./scripts/consolidate_questions.py'):
     cmds = []
 
@@ -275,11 +289,20 @@ def generate_preparation_script(label, new_instance_names, output_folder, direct
 
 def generate_script_commands(base_config_paths, output_folder, scene_lengths, question_insts_per_scene,
                              spectrogram_window_lengths, spectrogram_window_overlap, background_noise_gains,
-                             total_nb_process, prefix='v3'):
+                             total_nb_process, prefix='v3', nested=False, python_bin="python"):
 
     scene_cmds, scene_names, scene_log_paths = generate_scene_commands(base_config_paths['scene'], prefix, output_folder,
                                                                        scene_lengths)
 
+    # With nested scene sets, only the largest version is generated. The other ones are views of it
+    largest_index = scene_lengths.index(max(scene_lengths))
+    largest_scene_name = scene_names[largest_index]
+    is_view = {scene_name: nested and scene_name != largest_scene_name for scene_name in scene_names}
+
+    if nested:
+        scene_cmds = [f"{scene_cmds[largest_index]} --nested_sets"]
+        scene_log_paths = [scene_log_paths[largest_index]]
+
     script = {
         'scene': {
             'cmds': scene_cmds,
@@ -302,6 +325,9 @@ def generate_script_commands(base_config_paths, output_folder, scene_lengths, qu
             'names': [],
             'log_paths': []
         },
+        "nested_view": {
+            'cmds': []
+        },
         "symlink": {
             'cmds': []
         },
@@ -310,19 +336,29 @@ def generate_script_commands(base_config_paths, output_folder, scene_lengths, qu
         }
     }
 
-    for scene_cmd, scene_name in zip(scene_cmds, scene_names):
+    # Versions based on the largest scene set (Source of the views)
+    _, largest_question_names, _ = generate_question_commands(base_config_paths['question'], largest_scene_name,
+                                                              output_folder, question_insts_per_scene)
+    _, largest_spectrogram_fft_names, _ = generate_spectrogram_fft_commands(base_config_paths['spectrogram'],
+                                                                            largest_scene_name, output_folder,
+                                                                            spectrogram_window_lengths,
+                                                                            spectrogram_window_overlap)
+
+    for scene_length, scene_name in zip(scene_lengths, scene_names):
         # Question Generation
         tmp_question_cmds, tmp_question_names, tmp_log_paths = generate_question_commands(base_config_paths['question'],
                                                                                           scene_name,
                                                                                           output_folder,
                                                                                           question_insts_per_scene)
 
-        script['question']['cmds'] += tmp_question_cmds
         script['question']['names'] += tmp_question_names
-        script['question']['log_paths'] += tmp_log_paths
 
-        # Question Consolidation
-        script['question']['consolidation'] += generate_consolidation_commands(output_folder, tmp_question_names)
+        if not is_view[scene_name]:
+            script['question']['cmds'] += tmp_question_cmds
+            script['question']['log_paths'] += tmp_log_paths
+
+            # Question Consolidation
+            script['question']['consolidation'] += generate_consolidation_commands(output_folder, tmp_question_names)
 
 
         # Spectrogram Generation -- FFT
@@ -333,9 +369,17 @@ def generate_script_commands(base_config_paths, output_folder, scene_lengths, qu
             spectrogram_window_lengths,
             spectrogram_window_overlap)
 
-        script['spectrogram_fft']['cmds'] += tmp_spectrogram_fft_cmds
         script['spectrogram_fft']['names'] += tmp_spectrogram_fft_names
-        script['spectrogram_fft']['log_paths'] += tmp_log_paths
+
+        if is_view[scene_name]:
+            # Scenes, questions and spectrograms are materialised from the versions of the largest scene set
+            script['nested_view']['cmds'] += generate_nested_view_commands(
+                [largest_scene_name] + largest_question_names + largest_spectrogram_fft_names,
+                [scene_name] + tmp_question_names + tmp_spectrogram_fft_names,
+                scene_length, output_folder, python_bin)
+        else:
+            script['spectrogram_fft']['cmds'] += tmp_spectrogram_fft_cmds
+            script['spectrogram_fft']['log_paths'] += tmp_log_paths
 
         # Spectrogram Generation -- Background Noise
         tmp_spectrogram_noise_cmds, tmp_spectrogram_noise_names, tmp_log_paths = generate_spectrogram_noise_commands(
@@ -549,7 +593,7 @@ def main(args):
     script = generate_script_commands(base_config_paths, args.generated_output_folder, scene_max_lengths,
                                       question_insts_per_scene, spectrogram_window_lengths,
                                       spectrogram_window_overlap, background_noise_gains, args.nb_process,
-                                      args.version_name_prefix)
+                                      args.version_name_prefix, args.nested_scene_sets, args.python_bin)
 
     # Scene Generation Script
     scene_preparation_script = generate_preparation_script("Scene Preparation", script['scene']['names'], args.generated_output_folder)
@@ -584,6 +628,11 @@ def main(args):
                                                  longer_set_type='train', multiple_process_per_gen=True,
                                                  python_bin=args.python_bin)
 
+    if args.nested_scene_sets:
+        nested_view_script = generate_simple_script("Nested Views Materialisation", script['nested_view']['cmds'])
+    else:
+        nested_view_script = ""
+
     symlink_script = generate_simple_script("Linking versions together", script['symlink']['cmds'])
 
     if args.tar_and_delete:
@@ -593,10 +642,11 @@ def main(args):
 
     full_script = scene_preparation_script + scene_gen_script + question_preparation_script + question_gen_script + \
                   question_consolidation_script + spectrogram_fft_preparation_script + spectrogram_fft_gen_script + \
-                  symlink_script + tar_and_delete_script
+                  nested_view_script + symlink_script + tar_and_delete_script
 
     comment_string = "\n# Parameters : \n"
     comment_string += f'## scene_max_lengths: {scene_max_lengths}\n'
+    comment_string += f'## nested_scene_sets: {args.nested_scene_sets}\n'
     comment_string += f'## question_insts_per_scene: {question_insts_per_scene}\n'
     comment_string += f'## spectrogram_window_lengths: {spectrogram_window_lengths}\n'
     comment_string += f'## spectrogram_window_overlap: {spectrogram_window_overlap}\n'
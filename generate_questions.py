@@ -63,6 +63,7 @@ from utils.question_helper import validate_constraints, create_reset_counts_fct,
 
 # Misc
 from utils.misc import init_random_seed, generate_info_section, get_max_scene_length, save_arguments
+from utils.scene_io import get_scenes_filepath
 
 
 # Arguments Definition
@@ -521,8 +522,8 @@ def main(args):
     tmp_output_folder = os.path.join(questions_output_folder, 'TMP_%s' % args.set_type)
     questions_filename = '%s_%s_questions.json' % (args.output_filename_prefix, args.set_type)
     questions_output_filepath = os.path.join(questions_output_folder, questions_filename)
-    scene_filepath = os.path.join(experiment_output_folder, 'scenes',
-                                  '%s_%s_scenes.json' % (args.output_filename_prefix, args.set_type))
+    scene_filepath = get_scenes_filepath(os.path.join(experiment_output_folder, 'scenes'),
+                                         args.output_filename_prefix, args.set_type)
 
     # Setting the random seed from arguments
     if args.random_nb_generator_seed is not None:
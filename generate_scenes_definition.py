@@ -7,16 +7,24 @@
 #               KTH Stockholm Royal Institute of Technology
 #               IGLU - CHIST-ERA
 
-import argparse, os, sys, random
+import argparse, os, sys, random, time
+from datetime import timedelta
+from math import factorial
 from shutil import rmtree as rm_dir
 from itertools import groupby
-from collections import defaultdict
+from collections import defaultdict, deque
+from multiprocessing import get_context
 
 import json
 import numpy as np
 
-from utils.misc import init_random_seed, generate_info_section, save_arguments
+from utils.misc import init_random_seed, derive_seed, generate_info_section, save_arguments
 from utils.elementary_sounds import Elementary_Sounds
+from utils.brightness_estimation import numpy_brightness_coefficients, load_brightness_coefficients
+from utils.scene_sampler import Constructive_Scene_Sampler
+from utils.scene_hashing import Scene_Hash_Set, hash_id_list
+from utils.scene_io import Scene_Writer, write_elementary_sounds_table, get_before_after_relationships
+from utils.scene_constraints import Scene_Validator, draw_candidate_batch, pad_id_lists
 
 # Arguments definition
 parser = argparse.ArgumentParser(fromfile_prefix_chars='@')
@@ -27,6 +35,20 @@ parser.add_argument('--elementary_sounds_folder', default='./elementary_sounds',
 parser.add_argument('--elementary_sounds_definition_filename', default='elementary_sounds.json',
                     help='Filename of the JSON file listing the attributes of the elementary sounds')
 
+parser.add_argument('--analysis_cache_filepath', default=None, type=str,
+                    help='JSON file keeping the analysis (duration, loudness, brightness) of the elementary sounds '
+                         'between runs. Default : {output_folder}/elementary_sounds_analysis_cache.json')
+parser.add_argument('--no_analysis_cache', action='store_true',
+                    help='If set, all the elementary sounds are analysed and the analysis cache is not used')
+parser.add_argument('--analysis_nb_process', default=1, type=int,
+                    help='Number of processes used to analyse the elementary sounds (Loudness & brightness)')
+parser.add_argument('--brightness_analyser', default='timbral', choices=['timbral', 'numpy'],
+                    help='"numpy" estimate the timbral_models brightness on the decoded samples (Batched, no file '
+                         're-read). "timbral" reproduce the previous versions exactly')
+parser.add_argument('--brightness_calibration_filepath', default=None, type=str,
+                    help='Regression coefficients of the numpy brightness estimator (See '
+                         'scripts/calibrate_brightness_estimator.py). Default : Coefficients fitted on the bundled '
+                         'elementary sounds')
 parser.add_argument('--metadata_file', default='templates/attributes.json',
                     help='File containing all the information related to the possible attributes of the objects')
 
@@ -38,8 +60,33 @@ parser.add_argument('--max_scene_length', default=10, type=int,
 parser.add_argument('--nb_scene', default=None, type=int,
                     help='Number of scenes that will be generated.')
 
+parser.add_argument('--sampler', default='rejection', choices=['rejection', 'constructive'],
+                    help='Sampling strategy of the candidate scenes. "rejection" draw uniform random scenes and discard '
+                         'the invalid ones. "constructive" draw scenes that satisfy the families constraints by '
+                         'construction (Same distribution of scenes, fewer candidates)')
+
+parser.add_argument('--validation_batch_size', default=0, type=int,
+                    help='If > 0, the candidate scenes are drawn and validated by batch of this size with vectorised '
+                         'constraints checks')
+
+parser.add_argument('--exact_duplicate_detection', action='store_true',
+                    help='If set, the accepted scenes are kept to resolve the collisions of the 64 bits hashes used to '
+                         'detect duplicate scenes')
+
+parser.add_argument('--nb_process', default=None, type=int,
+                    help='If set, the candidates are generated by blocks in {nb_process} processes. Each block has its own '
+                         'random stream derived from the seed, the output depends only on the seed and the block size '
+                         '(Not on the number of processes) but is different from the sequential generation')
+parser.add_argument('--generation_block_size', default=10000, type=int,
+                    help='Number of candidate scenes in each block (See --nb_process)')
+
 parser.add_argument('--silence_padding_per_object', default=100, type=int,
                     help='Silence length that will be introduced between the objects (in ms)')
+parser.add_argument('--silence_assignment', default='legacy', choices=['legacy', 'vectorised'],
+                    help='"vectorised" assign the silences of a batch of scenes at once with numpy random draws (Same '
+                         'distribution, different random stream). "legacy" reproduce the previous versions exactly')
+parser.add_argument('--silence_batch_size', default=1024, type=int,
+                    help='Number of scenes in each batch of the vectorised silence assignment')
 
 # Constraints
 parser.add_argument('--constraint_min_nb_families', default=3, type=int,
@@ -55,15 +102,38 @@ parser.add_argument('--constraint_min_ratio_for_attribute', default=0.15, type=f
 parser.add_argument('--training_set_ratio', default=0.7, type=float,
                     help='Percentage of generated scenes that are labeled as training.' +
                          'Validation and test sets will contain the rest of the scenes')
+parser.add_argument('--nested_sets', action='store_true',
+                    help='If set, the scenes are not shuffled and their set is chosen by a stable hash of the scene. '
+                         'The sets generated with a smaller --nb_scene (Same seed & arguments) are prefixes of the sets '
+                         'generated with a larger one (See scripts/materialize_nested_view.py)')
 parser.add_argument('--output_folder', default='./output',
                     help='Folder where the generated scenes will be saved')
 parser.add_argument('--output_filename_prefix', default='CLEAR', type=str,
                     help='Prefix used for generated scene file')
 parser.add_argument('--output_version_nb', default='0.1', type=str,
                     help='Version number that will be appended to the generated scene file')
+parser.add_argument('--output_format', default='json', choices=['json', 'jsonl'],
+                    help='Format of the scenes definition files. "jsonl" write one scene per line')
+parser.add_argument('--scene_format', default='full', choices=['full', 'compact'],
+                    help='"compact" store only the elementary sounds ids and the silences of each scene. The elementary '
+                         'sounds definition is written once beside the scenes files')
+parser.add_argument('--omit_relationships', action='store_true',
+                    help='If set, the before/after relationships are not written in the scenes. They are computed by '
+                         'the question engine from the order of the objects')
+parser.add_argument('--compact_json', action='store_true',
+                    help='If set, the JSON scenes definition files are written without indentation')
 parser.add_argument('--clear_existing_files', action='store_true',
                     help='If set, will delete all files in the output folder before starting the generation.')
 
+# Feasibility & progress
+parser.add_argument('--feasibility_samples', default=2000, type=int,
+                    help='Number of candidates drawn before the generation to estimate the acceptance rate and the '
+                         'generation time. 0 to disable')
+parser.add_argument('--max_generation_time', default=None, type=float,
+                    help='Abort if the estimated generation time (in minutes) exceed this budget')
+parser.add_argument('--progress_interval', default=30, type=float,
+                    help='Interval (in seconds) between the progress reports')
+
 # Misc
 parser.add_argument('--random_nb_generator_seed', default=None, type=int,
                     help='Set the random number generator seed to reproduce results')
@@ -89,14 +159,34 @@ class Scene_generator:
                  constraint_min_nb_families,
                  constraint_min_objects_per_family,
                  constraint_min_nb_families_subject_to_min_object_per_family,
-                 constraint_min_ratio_for_attribute):
+                 constraint_min_ratio_for_attribute,
+                 sampler='rejection',
+                 validation_batch_size=0,
+                 exact_duplicate_detection=False,
+                 nb_process=None,
+                 generation_block_size=10000,
+                 random_seed=None,
+                 progress_interval=30,
+                 omit_relationships=False,
+                 silence_assignment='legacy',
+                 silence_batch_size=1024,
+                 nested_sets=False,
+                 analysis_cache_filepath=None,
+                 analysis_nb_process=1,
+                 brightness_analyser='timbral',
+                 brightness_coefficients=numpy_brightness_coefficients):
 
         self.version_nb = version_nb
 
         with open(metadata_filepath) as metadata:
             self.attributes_values = {key: val['values'] for key, val in json.load(metadata)['attributes'].items()}
 
-        self.elementary_sounds = Elementary_Sounds(elementary_sounds_folderpath, elementary_sounds_definition_filename)
+        self.elementary_sounds = Elementary_Sounds(elementary_sounds_folderpath, elementary_sounds_definition_filename,
+                                                   attributes_values=self.attributes_values,
+                                                   analysis_cache_filepath=analysis_cache_filepath,
+                                                   analysis_nb_process=analysis_nb_process,
+                                                   brightness_analyser=brightness_analyser,
+                                                   brightness_coefficients=brightness_coefficients)
 
         self.nb_objects_per_scene = {
             'min': min_nb_objects_per_scene,
@@ -118,6 +208,12 @@ class Scene_generator:
         }
 
         self.silence_padding_per_object = silence_padding_per_object
+        self.silence_assignment = silence_assignment
+        self.silence_batch_size = silence_batch_size
+        self.nested_sets = nested_sets
+
+        # The before/after relationships can be computed by the question engine
+        self.omit_relationships = omit_relationships
 
         # Constraints
         self.constraints = {
@@ -130,19 +226,57 @@ class Scene_generator:
         # Attributes on which the 'min_ratio_for_attribute' constraint will be applied
         self.constrained_attributes = ['brightness', 'loudness']
 
+        if sampler == 'constructive':
+            self.constructive_sampler = Constructive_Scene_Sampler(
+                self.elementary_sounds,
+                min_nb_objects_per_scene,
+                max_nb_objects_per_scene,
+                constraint_min_nb_families,
+                constraint_min_objects_per_family,
+                constraint_min_nb_families_subject_to_min_object_per_family)
+        else:
+            self.constructive_sampler = None
+
+        # Vectorised validation of the candidates
+        self.validation_batch_size = validation_batch_size
+        # The int-coded attributes of the elementary sounds catalog
+        self.attribute_table = self.elementary_sounds.catalog.table
+        self.scene_validator = Scene_Validator(self.attribute_table, self._get_constraints_definition())
+
+        self.exact_duplicate_detection = exact_duplicate_detection
+
+        # Parallel generation by blocks of candidates
+        self.nb_process = nb_process
+        self.generation_block_size = generation_block_size
+        self.random_seed = random_seed
+
+        # Progress report
+        self.progress_interval = progress_interval
+        self.generation_start_time = None
+        self.last_progress_report = None
+
         # Stats
         self.stats = {
             'levels': {},
             'nbValid': 0,
             'nbMissingFamilies': 0,
             'nbMissingObjectPerFam': 0,
-            'attribute_constraint': {}
+            'attribute_constraint': {},
+            'nbCandidates': 0,
+            'nbDuplicates': 0,
+            'rejections': {},
+            'generationDuration': 0
         }
 
     def _scene_id_list_to_sound_list(self, scene_id_list):
         return [self.elementary_sounds.get(idx) for idx in scene_id_list]
 
     def _generate_scene_id_list(self):
+        self.stats['nbCandidates'] += 1
+
+        if self.constructive_sampler is not None:
+            return self.constructive_sampler.sample_id_list()
+
         # Shuffle all sounds and pick the first 'nb_objects_per_scene' as the scene
         np.random.shuffle(self.elementary_sounds.id_list_shuffled)
 
@@ -150,7 +284,65 @@ class Scene_generator:
 
         return self.elementary_sounds.id_list_shuffled[:nb_sound]
 
+    def _get_constraints_definition(self):
+        """
+        Declarative definition of the constraints verified by _validate_scene() (Same order)
+        See utils/scene_constraints.py
+        """
+        constraints = [
+            {
+                'name': 'duration',
+                'type': 'total_range',
+                'attribute': 'duration',
+                'min': self.scene_duration['min'],
+                'max': self.scene_duration['max']
+            },
+            {
+                'name': 'min_nb_families',
+                'type': 'min_nb_values',
+                'attribute': 'instrument',
+                'min_count': 1,
+                'min_nb': self.constraints['min_nb_families']
+            },
+            {
+                'name': 'min_objects_per_family',
+                'type': 'min_nb_values',
+                'attribute': 'instrument',
+                'min_count': self.constraints['min_objects_per_family'],
+                'min_nb': self.constraints['min_nb_families_subject_to_min_objects_per_family']
+            }
+        ]
+
+        for constrained_attribute in self.constrained_attributes:
+            constraints += [
+                {
+                    'name': '%s_all_values' % constrained_attribute,
+                    'type': 'min_nb_values',
+                    'attribute': constrained_attribute,
+                    'min_count': 1,
+                    'min_nb': len(self.attributes_values[constrained_attribute]),
+                    'exclude_none': True
+                },
+                {
+                    'name': '%s_min_ratio' % constrained_attribute,
+                    'type': 'min_ratio',
+                    'attribute': constrained_attribute,
+                    'ratio': self.constraints['min_ratio_for_attribute']
+                }
+            ]
+
+        return constraints
+
+    def _generate_candidate_batch(self):
+        if self.constructive_sampler is not None:
+            id_lists = [self.constructive_sampler.sample_id_list() for _ in range(self.validation_batch_size)]
+            return pad_id_lists(id_lists, self.nb_objects_per_scene['max'])
+
+        return draw_candidate_batch(self.elementary_sounds.nb_sounds, self.nb_objects_per_scene['min'],
+                                    self.nb_objects_per_scene['max'], self.validation_batch_size)
+
     def _validate_scene(self, scene_objects):
+        # Reference implementation of the constraints. The generation validate the id lists with self.scene_validator
         nb_object_in_scene = len(scene_objects)
 
         # Validate duration constraint
@@ -195,26 +387,238 @@ class Scene_generator:
         return True
 
     def _generate_scenes(self, nb_to_generate):
-        processed_ids = defaultdict(lambda: False)
-        valid_ids = defaultdict(lambda: False)
+        if self.validation_batch_size > 0:
+            return self._generate_scenes_by_batch(nb_to_generate)
+
+        # Only the accepted scenes are recorded. The validation is deterministic, a rejected candidate drawn again
+        # will be rejected again
+        accepted_scenes = Scene_Hash_Set(exact=self.exact_duplicate_detection)
         scenes = []
-        counter = 0
 
-        while counter < nb_to_generate:
+        while len(scenes) < nb_to_generate:
             scene_id_list = self._generate_scene_id_list()
-            hashmap_index = str(scene_id_list)
-            scene_objects = self._scene_id_list_to_sound_list(scene_id_list)
 
-            if not processed_ids[hashmap_index]:
-                processed_ids[hashmap_index] = True
-                if not valid_ids[hashmap_index]:
-                    if self._validate_scene(scene_objects):
-                        valid_ids[hashmap_index] = True
-                        scenes.append(scene_objects)
-                        counter += 1
+            if scene_id_list in accepted_scenes:
+                self.stats['nbDuplicates'] += 1
+            elif self.scene_validator.validate_id_list(scene_id_list):
+                accepted_scenes.add(scene_id_list)
+                scenes.append(scene_id_list)
+
+            if self.stats['nbCandidates'] % 1000 == 0:
+                self._report_progress(len(scenes), nb_to_generate)
+
+        return scenes
+
+    def _generate_scenes_by_batch(self, nb_to_generate):
+        """
+        Same as _generate_scenes() but the candidates are drawn and validated by batch (See utils/scene_constraints.py)
+        """
+        accepted_scenes = Scene_Hash_Set(exact=self.exact_duplicate_detection)
+        scenes = []
+
+        while len(scenes) < nb_to_generate:
+            ids, lengths = self._generate_candidate_batch()
+            valid = self.scene_validator.validate(ids, lengths)
+
+            for row in range(len(lengths)):
+                self.stats['nbCandidates'] += 1
+
+                if valid[row]:
+                    scene_id_list = ids[row, :lengths[row]].tolist()
+
+                    if accepted_scenes.add(scene_id_list):
+                        scenes.append(scene_id_list)
+
+                        if len(scenes) == nb_to_generate:
+                            break
+                    else:
+                        self.stats['nbDuplicates'] += 1
+
+            self._report_progress(len(scenes), nb_to_generate)
+
+        return scenes
+
+    def _generate_block(self, block_index):
+        """
+        Generate and validate {generation_block_size} candidates with the random stream of the block
+        The silences of the accepted scenes are assigned with the same stream
+        Return a list of (scene_id_list, scene_objects, silence_before) and the stats of the block
+        """
+        init_random_seed(derive_seed(self.random_seed, 'block', block_index))
+
+        for constraint_name in self.scene_validator.rejections:
+            self.scene_validator.rejections[constraint_name] = 0
+
+        # The rejection sampler shuffle this list in place, the block must not depend on the previous blocks
+        self.elementary_sounds.id_list_shuffled = self.elementary_sounds.id_list.copy()
+
+        id_lists = []
+        nb_candidates = 0
+
+        if self.validation_batch_size > 0:
+            while nb_candidates < self.generation_block_size:
+                ids, lengths = self._generate_candidate_batch()
+                valid = self.scene_validator.validate(ids, lengths)
+                nb_candidates += len(lengths)
+                id_lists += [ids[row, :lengths[row]].tolist() for row in np.nonzero(valid)[0]]
+        else:
+            for nb_candidates in range(1, self.generation_block_size + 1):
+                scene_id_list = self._generate_scene_id_list()
+                if self.scene_validator.validate_id_list(scene_id_list):
+                    id_lists.append(scene_id_list)
+
+        accepted_scenes = Scene_Hash_Set(exact=self.exact_duplicate_detection)
+        scenes = []
+
+        for scene_id_list in id_lists:
+            if accepted_scenes.add(scene_id_list):
+                scenes.append((scene_id_list, self._scene_id_list_to_sound_list(scene_id_list)))
+
+        if self.silence_assignment == 'vectorised' and len(scenes) > 0:
+            silences_before = self._assign_silence_informations_batch([scene_objects for _, scene_objects in scenes])
+        else:
+            silences_before = [self._assign_silence_informations(scene_objects) for _, scene_objects in scenes]
+
+        scenes = [(scene_id_list, scene_objects, silence_before)
+                  for (scene_id_list, scene_objects), silence_before in zip(scenes, silences_before)]
+
+        block_stats = {
+            'nb_candidates': nb_candidates,
+            'nb_duplicates': len(id_lists) - len(scenes),
+            'rejections': dict(self.scene_validator.rejections)
+        }
+
+        return scenes, block_stats
+
+    def _generate_scenes_in_parallel(self, nb_to_generate):
+        """
+        The blocks are generated by the worker processes and merged in block order. The duplicates across blocks are
+        discarded by the coordinator. The merge stop at the same block whatever the number of processes
+        Return a list of (scene_objects, silence_before)
+        """
+        accepted_scenes = Scene_Hash_Set(exact=self.exact_duplicate_detection)
+        scenes = []
+
+        pool = get_context('fork').Pool(self.nb_process, initializer=_init_block_worker, initargs=(self,))
+        pending_blocks = deque()
+        next_block_index = 0
+
+        while len(scenes) < nb_to_generate:
+            # Keep the workers busy while the coordinator merge the blocks
+            while len(pending_blocks) < 2 * self.nb_process:
+                pending_blocks.append(pool.apply_async(_generate_block_worker, (next_block_index,)))
+                next_block_index += 1
+
+            block_scenes, block_stats = pending_blocks.popleft().get()
+            self.stats['nbCandidates'] += block_stats['nb_candidates']
+            self.stats['nbDuplicates'] += block_stats['nb_duplicates']
+            for constraint_name, nb_rejected in block_stats['rejections'].items():
+                self.scene_validator.rejections[constraint_name] += nb_rejected
+
+            for scene_id_list, scene_objects, silence_before in block_scenes:
+                if accepted_scenes.add(scene_id_list):
+                    scenes.append((scene_objects, silence_before))
+
+                    if len(scenes) == nb_to_generate:
+                        break
+                else:
+                    self.stats['nbDuplicates'] += 1
+
+            self._report_progress(len(scenes), nb_to_generate)
+
+        pool.terminate()
+        pool.join()
 
         return scenes
 
+    def _report_progress(self, nb_generated, nb_to_generate):
+        """
+        Print the acceptance rate and the estimated remaining time every {progress_interval} seconds
+        """
+        now = time.time()
+        if now - self.last_progress_report < self.progress_interval:
+            return
+
+        self.last_progress_report = now
+        elapsed = now - self.generation_start_time
+        acceptance_rate = nb_generated / max(self.stats['nbCandidates'], 1)
+        eta = elapsed / nb_generated * (nb_to_generate - nb_generated) if nb_generated > 0 else None
+
+        print("Generated %d / %d scenes from %d candidates (%.2f%% accepted) - Elapsed %s - ETA %s" % (
+            nb_generated, nb_to_generate, self.stats['nbCandidates'], 100 * acceptance_rate,
+            timedelta(seconds=int(elapsed)), timedelta(seconds=int(eta)) if eta is not None else 'unknown'),
+            flush=True)
+
+    def estimate_feasibility(self, nb_to_generate, nb_samples):
+        """
+        Estimate the acceptance rate, the number of distinct valid scenes and the generation time from {nb_samples}
+        candidates. The random state is restored, the generated scenes are not affected
+        """
+        random_state = random.getstate()
+        np_random_state = np.random.get_state()
+        id_list_shuffled = list(self.elementary_sounds.id_list_shuffled)
+        nb_candidates = self.stats['nbCandidates']
+        rejections = dict(self.scene_validator.rejections)
+        nb_drawn = self.constructive_sampler.nb_drawn if self.constructive_sampler is not None else 0
+
+        nb_drawn_by_length = defaultdict(int)
+        nb_valid_by_length = defaultdict(int)
+
+        start_time = time.time()
+        for i in range(nb_samples):
+            scene_id_list = self._generate_scene_id_list()
+            nb_drawn_by_length[len(scene_id_list)] += 1
+            nb_valid_by_length[len(scene_id_list)] += self.scene_validator.validate_id_list(scene_id_list)
+        seconds_per_candidate = (time.time() - start_time) / nb_samples
+
+        sample_rejections = {constraint_name: nb_rejected - rejections[constraint_name]
+                             for constraint_name, nb_rejected in self.scene_validator.rejections.items()}
+
+        random.setstate(random_state)
+        np.random.set_state(np_random_state)
+        self.elementary_sounds.id_list_shuffled = id_list_shuffled
+        self.stats['nbCandidates'] = nb_candidates
+        self.scene_validator.rejections = rejections
+        if self.constructive_sampler is not None:
+            self.constructive_sampler.nb_drawn = nb_drawn
+
+        # Number of distinct valid scenes (Ordered lists of distinct sounds) of each length
+        nb_valid_scenes = 0
+        for nb_objects, nb_drawn_candidates in nb_drawn_by_length.items():
+            # Number of ordered lists of {nb_objects} distinct sounds (math.perm is only available from Python 3.8)
+            nb_sounds = self.elementary_sounds.nb_sounds
+            nb_scenes = factorial(nb_sounds) // factorial(nb_sounds - nb_objects) if nb_objects <= nb_sounds else 0
+            if self.constructive_sampler is not None:
+                # Only the scenes satisfying the families constraints are drawn
+                nb_scenes *= self.constructive_sampler.family_valid_probabilities[nb_objects -
+                                                                                 self.nb_objects_per_scene['min']]
+            nb_valid_scenes += nb_valid_by_length[nb_objects] / nb_drawn_candidates * nb_scenes
+
+        acceptance_rate = sum(nb_valid_by_length.values()) / nb_samples
+
+        return {
+            'nb_samples': nb_samples,
+            'acceptance_rate': acceptance_rate,
+            'rejections': sample_rejections,
+            'estimated_nb_valid_scenes': float(nb_valid_scenes),
+            'seconds_per_candidate': seconds_per_candidate,
+            'estimated_duration': nb_to_generate / acceptance_rate * seconds_per_candidate if acceptance_rate > 0
+                                  else None
+        }
+
+    def get_stats(self):
+        rejections = self.scene_validator.rejections
+
+        self.stats['rejections'] = dict(rejections)
+        self.stats['nbMissingFamilies'] = rejections['min_nb_families']
+        self.stats['nbMissingObjectPerFam'] = rejections['min_objects_per_family']
+        self.stats['attribute_constraint'] = {
+            attribute: rejections['%s_all_values' % attribute] + rejections['%s_min_ratio' % attribute]
+            for attribute in self.constrained_attributes
+        }
+
+        return self.stats
+
     def _assign_silence_informations(self, scene):
         nb_sound = len(scene)
         sounds_duration = sum(sound['duration'] for sound in scene)
@@ -254,39 +658,138 @@ class Scene_generator:
         return silence_before
 
     def _generate_relationships(self, scene_composition):
-        # TODO : Those relationships are trivial. Could be moved to question engine (Before & after)
-        relationships = [
-            {
-                'type': 'before',
-                'indexes': [
-                    []
-                ]
-            },
-            {
-                'type': 'after',
-                'indexes': []
-            }
-        ]
+        return get_before_after_relationships(len(scene_composition))
+
+    def _assign_silence_informations_batch(self, scenes):
+        """
+        Vectorised version of _assign_silence_informations() for a batch of scenes
+        Same algorithm and distribution but the random draws are done with numpy for the whole batch (Different random
+        stream than the legacy version). The silences are exchanged one object index at a time for all the scenes
+        Return the silence_before of each scene
+        """
+        nb_scenes = len(scenes)
+        nb_sounds = np.array([len(scene) for scene in scenes])
+        max_nb_sounds = nb_sounds.max()
+        rows = np.arange(nb_scenes)
+
+        is_sound = np.arange(max_nb_sounds)[None, :] < nb_sounds[:, None]
+        durations = np.zeros((nb_scenes, max_nb_sounds))
+        durations[is_sound] = [sound['duration'] for scene in scenes for sound in scene]
+        sounds_duration = durations.sum(axis=1)
+
+        if self.all_same_length:
+            # Duration is precalculated, we add silence accordingly
+            full_padding_duration = self.fixed_scene_duration - sounds_duration
+        else:
+            # Add between 5% and 20% of the sound duration as silence padding
+            full_padding_duration = self.silence_padding_per_object * nb_sounds + \
+                                    sounds_duration * np.random.randint(5, 21, nb_scenes) / 100
+
+        # Initialize equal silences
+        silence_intervals = np.trunc((full_padding_duration[:, None] *
+                                      np.random.randint(80, 100, (nb_scenes, max_nb_sounds)) / 100) / nb_sounds[:, None])
+        silence_intervals[~is_sound] = 0
+
+        # Randomly modify the silence intervals
+        for i in range(max_nb_sounds):
+            is_active = (i < nb_sounds) & (nb_sounds > 1)
+
+            # Randomly choose another sound
+            random_index = np.random.randint(0, np.maximum(nb_sounds - 1, 1))
+            random_index = np.minimum(random_index + (random_index >= i), max_nb_sounds - 1)
+
+            # Take between 10% and 50% of the silence portion of one sound and add it to another sound
+            silence_portion = np.trunc(silence_intervals[rows, random_index] * np.random.randint(1, 51, nb_scenes) / 100)
+            silence_portion[~is_active] = 0
+
+            silence_intervals[rows, i] += silence_portion
+            silence_intervals[rows, random_index] -= silence_portion
+
+        # Shuffle the silences of each scene (The padding is sorted at the end)
+        shuffle_keys = np.random.rand(nb_scenes, max_nb_sounds)
+        shuffle_keys[~is_sound] = 2
+        silence_intervals = silence_intervals[rows[:, None], np.argsort(shuffle_keys, axis=1)]
+
+        for scene, scene_silence_intervals in zip(scenes, silence_intervals.astype(int).tolist()):
+            for sound, silence_interval in zip(scene, scene_silence_intervals):
+                sound['silence_after'] = silence_interval
+
+        # The rest of the silence duration should be added in the beginning of the scene
+        return np.trunc(full_padding_duration - silence_intervals.sum(axis=1)).astype(int).tolist()
 
-        nb_object = len(scene_composition)
-        scene_indexes = list(range(0, nb_object))   # NOTE : Would not work with variable scene length
+    def _iter_prepared_scenes(self, generated_scenes):
+        """
+        Materialise the generated scenes and assign their silences
+        Yield the objects and the silence_before of each scene
+        """
+        if self.nb_process is not None:
+            # Silences were assigned by the worker processes
+            yield from generated_scenes
 
-        for i in range(0, nb_object):
-            if i - 1 >= 0:
-                relationships[0]['indexes'].append(relationships[0]['indexes'][i - 1] + [i - 1])
+        elif self.silence_assignment == 'vectorised':
+            for start in range(0, len(generated_scenes), self.silence_batch_size):
+                scenes = [self._scene_id_list_to_sound_list(scene_id_list)
+                          for scene_id_list in generated_scenes[start:start + self.silence_batch_size]]
 
-            scene_indexes.remove(i)
-            relationships[1]['indexes'].append(list(scene_indexes))
+                yield from zip(scenes, self._assign_silence_informations_batch(scenes))
 
-        return relationships
+        else:
+            for scene_id_list in generated_scenes:
+                # The elementary sounds are copied only for the accepted scenes
+                scene = self._scene_id_list_to_sound_list(scene_id_list)
+                yield scene, self._assign_silence_informations(scene)
+
+    @staticmethod
+    def _get_stable_set_type(scene_objects, training_set_ratio):
+        """
+        Set of a scene chosen from the hash of its elementary sounds ids (Doesn't depend on the other scenes)
+        """
+        position = hash_id_list([scene_object['id'] for scene_object in scene_objects]) / 2 ** 64
+
+        if position < training_set_ratio:
+            return 'train'
+        elif position < training_set_ratio + (1.0 - training_set_ratio) / 2:
+            return 'val'
+        else:
+            return 'test'
 
-    def generate(self, nb_to_generate, training_set_ratio=0.7, shuffle_scenes=True):
+    def generate(self, nb_to_generate, training_set_ratio=0.7, shuffle_scenes=True, scene_writer=None):
+        """
+        Return the scenes of each set
+        If a {scene_writer} is given (See utils/scene_io.py), the scenes are written as soon as their set and silences
+        are assigned instead of being kept in memory. The number of scenes written in each set is returned
+        """
 
         print("Starting Scenes Generation")
 
-        generated_scenes = self._generate_scenes(nb_to_generate)
+        self.generation_start_time = time.time()
+        self.last_progress_report = self.generation_start_time
+
+        if self.nb_process is not None:
+            generated_scenes = self._generate_scenes_in_parallel(nb_to_generate)
+        else:
+            generated_scenes = self._generate_scenes(nb_to_generate)
+
+        self.stats['nbValid'] = len(generated_scenes)
+        self.stats['generationDuration'] = time.time() - self.generation_start_time
+
+        print("Generated %d scenes from %d candidates" % (len(generated_scenes), self.stats['nbCandidates']))
+
+        if self.constructive_sampler is not None:
+            # Only a fraction of the rejection sampler candidates satisfy the families constraints
+            family_valid_ratio = self.constructive_sampler.family_valid_ratio
+            print("Constructive sampler : %.2f%% of random candidates satisfy the families constraints. "
+                  "Rejection sampling would have drawn ~%d candidates (%.1fx reduction)" % (
+                    100 * family_valid_ratio, self.stats['nbCandidates'] / family_valid_ratio,
+                    1 / family_valid_ratio))
+
+        if self.nested_sets:
+            # The generation order is kept, the first scenes are the same whatever the number of scenes generated
+            shuffle_scenes = False
 
-        print("Generated %d scenes" % len(generated_scenes))
+            if self.nb_process is None:
+                # The silences stream must not depend on the number of candidates drawn during the generation
+                init_random_seed(derive_seed(self.random_seed, 'silences'))
 
         if shuffle_scenes:
             np.random.shuffle(generated_scenes)
@@ -298,60 +801,86 @@ class Scene_generator:
         nb_valid = round(nb_scene*valid_and_test_ratio)
         nb_test = nb_scene - nb_training - nb_valid
 
-        training_scenes = []
-        valid_scenes = []
-        test_scenes = []
+        set_scenes = {
+            'train': [],
+            'val': [],
+            'test': []
+        }
+
+        set_indexes = {set_type: 0 for set_type in set_scenes}
 
-        training_index = 0
-        valid_index = 0
-        test_index = 0
+        if scene_writer is not None:
+            for set_type in ['train', 'val', 'test']:
+                scene_writer.open(set_type, generate_info_section(set_type, self.version_nb))
 
         scene_count = 0
-        for generated_scene in generated_scenes:
-            silence_before = self._assign_silence_informations(generated_scene)
+        for generated_scene, silence_before in self._iter_prepared_scenes(generated_scenes):
 
             scene = {
                 "silence_before": silence_before,
-                "objects": generated_scene,
-                "relationships": self._generate_relationships(generated_scene)
+                "objects": generated_scene
             }
 
-            if scene_count < nb_training:
-                scene['scene_index'] = '%.6d' % training_index
-                scene['scene_filename'] = "CLEAR_train_%06d.flac" % training_index
-                training_index += 1
-                training_scenes.append(scene)
+            if not self.omit_relationships:
+                scene['relationships'] = self._generate_relationships(generated_scene)
+
+            if self.nested_sets:
+                set_type = self._get_stable_set_type(generated_scene, training_set_ratio)
+
+                # Position in the generation order, the scenes of a smaller version are the ones below its size
+                scene['generation_index'] = scene_count
 
+            elif scene_count < nb_training:
+                set_type = 'train'
             elif scene_count < nb_training + nb_valid:
-                scene['scene_index'] = '%.6d' % valid_index
-                scene['scene_filename'] = "CLEAR_val_%06d.flac" % valid_index
-                valid_index += 1
-                valid_scenes.append(scene)
+                set_type = 'val'
+            else:
+                set_type = 'test'
+
+            scene['scene_index'] = '%.6d' % set_indexes[set_type]
+            scene['scene_filename'] = "CLEAR_%s_%06d.flac" % (set_type, set_indexes[set_type])
+            set_indexes[set_type] += 1
 
+            if scene_writer is not None:
+                scene_writer.write(set_type, scene)
             else:
-                scene['scene_index'] = '%.6d' % test_index
-                scene['scene_filename'] = "CLEAR_test_%06d.flac" % test_index
-                test_index += 1
-                test_scenes.append(scene)
+                set_scenes[set_type].append(scene)
 
             scene_count += 1
 
+        if scene_writer is not None:
+            scene_writer.close()
+            return scene_writer.nb_written
+
         return {
             "train" : {
                 "info": generate_info_section('train', self.version_nb),
-                "scenes": training_scenes
+                "scenes": set_scenes['train']
             },
             "val": {
                 "info": generate_info_section('val', self.version_nb),
-                "scenes": valid_scenes
+                "scenes": set_scenes['val']
             },
             "test": {
                 "info": generate_info_section('test', self.version_nb),
-                "scenes": test_scenes
+                "scenes": set_scenes['test']
             }
         }
 
 
+# Scene generator of the worker processes (Inherited when forking)
+_block_generator = None
+
+
+def _init_block_worker(scene_generator):
+    global _block_generator
+    _block_generator = scene_generator
+
+
+def _generate_block_worker(block_index):
+    return _block_generator._generate_block(block_index)
+
+
 if __name__ == '__main__':
     args = parser.parse_args()
 
@@ -381,6 +910,28 @@ if __name__ == '__main__':
         print("The seed must be specified in the arguments.", file=sys.stderr)
         exit(1)
 
+    if args.nested_sets and args.nb_process is None and args.silence_assignment == 'vectorised':
+        # The batches of silences would depend on the number of scenes
+        print("[ERROR] --nested_sets with --silence_assignment vectorised require --nb_process", file=sys.stderr)
+        exit(1)
+
+    if args.no_analysis_cache:
+        analysis_cache_filepath = None
+    elif args.analysis_cache_filepath is not None:
+        analysis_cache_filepath = args.analysis_cache_filepath
+    else:
+        analysis_cache_filepath = os.path.join(args.output_folder, 'elementary_sounds_analysis_cache.json')
+
+    if args.brightness_calibration_filepath is not None:
+        brightness_coefficients = load_brightness_coefficients(args.brightness_calibration_filepath)
+    else:
+        brightness_coefficients = numpy_brightness_coefficients
+
+        if args.brightness_analyser == 'numpy':
+            print("[WARNING] The numpy brightness coefficients were fitted on the bundled elementary sounds. "
+                  "Run 'python -m scripts.calibrate_brightness_estimator' for another elementary sounds bank",
+                  file=sys.stderr)
+
     scene_generator = Scene_generator(args.min_scene_length,
                                       args.max_scene_length,
                                       args.silence_padding_per_object,
@@ -391,17 +942,69 @@ if __name__ == '__main__':
                                       args.constraint_min_nb_families,
                                       args.constraint_min_object_per_family,
                                       args.constraint_min_nb_families_subject_to_min_object_per_family,
-                                      args.constraint_min_ratio_for_attribute)
+                                      args.constraint_min_ratio_for_attribute,
+                                      sampler=args.sampler,
+                                      validation_batch_size=args.validation_batch_size,
+                                      exact_duplicate_detection=args.exact_duplicate_detection,
+                                      nb_process=args.nb_process,
+                                      generation_block_size=args.generation_block_size,
+                                      random_seed=args.random_nb_generator_seed,
+                                      progress_interval=args.progress_interval,
+                                      omit_relationships=args.omit_relationships,
+                                      silence_assignment=args.silence_assignment,
+                                      silence_batch_size=args.silence_batch_size,
+                                      nested_sets=args.nested_sets,
+                                      analysis_cache_filepath=analysis_cache_filepath,
+                                      analysis_nb_process=args.analysis_nb_process,
+                                      brightness_analyser=args.brightness_analyser,
+                                      brightness_coefficients=brightness_coefficients)
+
+    if args.feasibility_samples > 0:
+        feasibility = scene_generator.estimate_feasibility(args.nb_scene, args.feasibility_samples)
+
+        print("Feasibility : %.3f%% of %d candidates accepted. ~%d distinct valid scenes" % (
+            100 * feasibility['acceptance_rate'], feasibility['nb_samples'], feasibility['estimated_nb_valid_scenes']))
+
+        if feasibility['acceptance_rate'] == 0:
+            print("[ERROR] No valid scene in %d candidates. The constraints can't be satisfied (Rejections : %s)" % (
+                feasibility['nb_samples'], feasibility['rejections']), file=sys.stderr)
+            exit(1)
+
+        if feasibility['estimated_nb_valid_scenes'] < args.nb_scene:
+            print("[ERROR] Only ~%d distinct valid scenes for the given constraints, %d scenes can't be generated" % (
+                feasibility['estimated_nb_valid_scenes'], args.nb_scene), file=sys.stderr)
+            exit(1)
+
+        estimated_minutes = feasibility['estimated_duration'] / 60
+        print("Estimated generation time (sequential) : %.1f minutes" % estimated_minutes)
+
+        if args.max_generation_time is not None and estimated_minutes > args.max_generation_time:
+            print("[ERROR] The estimated generation time (%.1f minutes) exceed the budget of %.1f minutes" % (
+                estimated_minutes, args.max_generation_time), file=sys.stderr)
+            exit(1)
+    else:
+        feasibility = None
+
+    # The scenes are written to file as they are generated
+    scene_writer = Scene_Writer(scenes_output_folder, args.output_filename_prefix, args.output_format,
+                                args.compact_json, args.scene_format)
 
-    scenes = scene_generator.generate(nb_to_generate=args.nb_scene, training_set_ratio=args.training_set_ratio)
+    if args.scene_format == 'compact':
+        write_elementary_sounds_table(scenes_output_folder, args.output_filename_prefix,
+                                      scene_generator.elementary_sounds.definition)
 
-    # Write to file
-    for set_type, scene_struct in scenes.items():
-        scenes_filename = '%s_%s_scenes.json' % (args.output_filename_prefix, set_type)
+    nb_written = scene_generator.generate(nb_to_generate=args.nb_scene, training_set_ratio=args.training_set_ratio,
+                                          scene_writer=scene_writer)
 
-        scenes_filepath = os.path.join(scenes_output_folder, scenes_filename)
+    for set_type, nb_scenes in nb_written.items():
+        print("Wrote %d scenes to %s" % (nb_scenes, scene_writer.get_filepath(set_type)))
 
-        with open(scenes_filepath, 'w') as f:
-            json.dump(scene_struct, f, indent=2, sort_keys=True)
+    # Generation stats
+    stats_filepath = os.path.join(scenes_output_folder, '%s_generation_stats.json' % args.output_filename_prefix)
+    with open(stats_filepath, 'w') as f:
+        json.dump({
+            'feasibility': feasibility,
+            'generation': scene_generator.get_stats()
+        }, f, indent=2, sort_keys=True)
 
     print('done')
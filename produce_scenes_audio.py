@@ -10,10 +10,11 @@
 
 import sys, os, argparse, random
 from multiprocessing import Process, Queue
+from threading import Thread, Lock
 from shutil import rmtree as rm_dir
 from datetime import datetime
 import time
-import gc
+import math
 
 import json
 from pydub import AudioSegment
@@ -24,11 +25,26 @@ import matplotlib
 # Matplotlib options to reduce memory usage
 matplotlib.interactive(False)
 matplotlib.use('agg')
-import matplotlib.pyplot as plt
+import matplotlib.mlab
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 from utils.audio_processing import add_reverberation, generate_random_noise
-from utils.misc import init_random_seed, pydub_audiosegment_to_float_array, float_array_to_pydub_audiosegment
-from utils.misc import save_arguments
+from utils.misc import init_random_seed, derive_seed, pydub_audiosegment_to_float_array, \
+    float_array_to_pydub_audiosegment
+from utils.misc import save_arguments, array_to_shared_memory, shared_memory_to_array, release_shared_memory, \
+    is_shared_memory_available
+from utils.sound_bank import Elementary_Sounds_Bank
+from utils.sound_catalog import Elementary_Sounds_Catalog
+from utils.render_records import Render_Records, build_render_records
+from utils.worker_pool import Recycling_Worker_Pool
+from utils.scene_io import get_scenes_filepath
+from utils.batch_rendering import Batch_Scene_Renderer, batch_specgram
+from utils.spectrogram_composition import Spectrogram_Composer
+from utils.spectrogram_processing import reduce_spectrogram, get_band_limited_frame_rate
+from utils.scene_events import get_scene_events, write_scene_events
+from utils.features import Welford_Accumulator, spectrogram_to_features, save_feature_stats, load_feature_stats, \
+    get_feature_stats_filepath, standardise_features, standardise_feature_files, unstandardised_suffix
 
 """
 Arguments definition
@@ -41,6 +57,9 @@ parser.add_argument('--elementary_sounds_folder', default='../elementary_sounds'
 
 parser.add_argument('--elementary_sounds_definition_filename', default='elementary_sounds.json', type=str,
                     help='Filename of the JSON file listing the attributes of the elementary sounds')
+parser.add_argument('--elementary_sounds_cache_size', default=0, type=int,
+                    help='Maximum number of decoded elementary sounds kept in memory by each process. '
+                         'Only the sounds referenced by the scenes to produce are loaded. 0 means no limit')
 
 # Options
 parser.add_argument('--with_background_noise', action='store_true',
@@ -60,18 +79,39 @@ parser.add_argument('--reverb_delay_range', default="0,500", type=str,
 parser.add_argument('--no_reverb', action='store_true',
                     help='Override the --with_reverb setting. If this is set, there will be no reverberation.')
 
+parser.add_argument('--variants_per_scene', default=0, type=int,
+                    help='If > 0, each scene is assembled once and K variants are produced by applying K independently '
+                         'seeded draws of the background noise gain, reverb room scale and reverb delay. '
+                         'Outputs are named {prefix}_{set}_{id}_v{k} and the drawn parameters are written to '
+                         '{output_folder}/{version}/variants/{set}')
+
 parser.add_argument('--no_audio_files', action='store_true',
                     help='If set, audio file won\'t be produced. '
                          'The --produce_spectrograms switch will also be activated')
 
+parser.add_argument('--produce_events', action='store_true',
+                    help='If set, write the onset and offset (in samples) of each elementary sound of the scenes. '
+                         'The events are the references of the stems (See utils/scene_events.py)')
 parser.add_argument('--produce_spectrograms', action='store_true',
                     help='If set, produce the spectrograms for each scenes')
+parser.add_argument('--produce_preprocessed', action='store_true',
+                    help='If set, produce the dB scaled spectrograms standardised per frequency as .npy features in the '
+                         'preprocessed folder. The mean and std are computed when producing the training set, the '
+                         'other sets are standardised with the statistics of the training set')
 parser.add_argument('--spectrogram_freq_resolution', default=21, type=int,
                     help='Resolution of the Y axis in Freq/px ')
 parser.add_argument('--spectrogram_time_resolution', default=3, type=int,
                     help='Resolution of the X axis in ms/px')
 parser.add_argument('--spectrogram_window_length', default=1024, type=int,
                     help='Number of samples used in the FFT window')
+parser.add_argument('--spectrogram_fmin', default=0, type=int,
+                    help='Lowest frequency (in Hz) represented in the spectrograms')
+parser.add_argument('--spectrogram_fmax', default=0, type=int,
+                    help='Highest frequency (in Hz) represented in the spectrograms. 0 means up to the Nyquist '
+                         'frequency. When no audio files are produced, the scenes are rendered at the lowest frame '
+                         'rate that can represent this frequency')
+parser.add_argument('--spectrogram_log_frequency_bins', default=0, type=int,
+                    help='If > 0, the frequencies are rebinned in this number of log spaced bands (One pixel each)')
 parser.add_argument('--spectrogram_window_overlap', default=512, type=int,
                     help='Number of samples that are overlapped in the FFT window')
 
@@ -98,6 +138,29 @@ parser.add_argument('--random_nb_generator_seed', default=None, type=int,
                     help='Set the random number generator seed to reproduce results')
 parser.add_argument('--nb_process', default=4, type=int,
                     help='Number of process allocated for the production')
+parser.add_argument('--worker_max_tasks', default=0, type=int,
+                    help='Number of scenes produced by a worker process before it is recycled. 0 means no limit')
+parser.add_argument('--worker_max_rss_mb', default=0, type=int,
+                    help='Resident memory (in MB) above which a worker process is recycled. 0 means no limit')
+
+parser.add_argument('--pipeline', action='store_true',
+                    help='If set, the production is split in stages (Assembly & effects processes, spectrogram '
+                         'processes and encoding threads) connected by bounded queues')
+parser.add_argument('--pipeline_stage_workers', default='auto', type=str,
+                    help='Number of workers for each pipeline stage written as assembly,spectrogram,encode '
+                         '(Ex : 3,2,2). If "auto", the --nb_process processes are distributed according to the '
+                         'throughput of each stage measured on the first scenes')
+parser.add_argument('--pipeline_queue_size', default=16, type=int,
+                    help='Maximum number of scenes waiting between two stages of the pipeline')
+
+parser.add_argument('--compose_spectrograms', action='store_true',
+                    help='If set, the spectrograms are composed from the STFT of the elementary sounds instead of '
+                         'rendering the audio. The silences are snapped to a multiple of the hop size. '
+                         'Require --no_reverb and --no_audio_files')
+
+parser.add_argument('--batch_size', default=0, type=int,
+                    help='If > 0, the scenes are assembled and their spectrograms computed by batch of this size. '
+                         'Each worker process task is then a batch of scenes')
 
 """
     Produce audio recording from scene JSON definition
@@ -109,6 +172,7 @@ parser.add_argument('--nb_process', default=4, type=int,
         - Generate random white noise and overlay on the scene
         - Apply reverberation effect
         - Write audio scene to file (Either as a WAV file, a spectrogram/PNG or both
+        - (Optional) Produce multiple variants of each scene by applying different effects to the same assembled scene
 
     The production is distributed across {nb_process} processes
 """
@@ -131,7 +195,12 @@ class AudioSceneProducer:
                  setType,
                  outputPrefix,
                  outputFrameRate,
-                 randomSeed):
+                 randomSeed,
+                 variantsPerScene=0,
+                 elementarySoundsCacheSize=0,
+                 composeSpectrograms=False,
+                 produce_preprocessed=False,
+                 produce_events=False):
 
         # Paths
         self.outputFolder = outputFolder
@@ -143,6 +212,9 @@ class AudioSceneProducer:
 
         self.produce_audio_files = produce_audio_files
         self.produce_spectrograms = produce_spectrograms
+        self.produce_preprocessed = produce_preprocessed
+        self.produce_events = produce_events
+        self.compute_spectrograms = self.produce_spectrograms or self.produce_preprocessed
 
         experiment_output_folder = os.path.join(self.outputFolder, self.version_nb)
 
@@ -150,50 +222,108 @@ class AudioSceneProducer:
         with open(os.path.join(self.elementarySoundFolderPath, elementarySoundsJsonFilename)) as file:
             self.elementarySounds = json.load(file)
 
-        # Loading scenes definition
-        sceneFilename = '%s_%s_scenes.json' % (self.outputPrefix, self.setType)
-        sceneFilepath = os.path.join(experiment_output_folder, 'scenes', sceneFilename)
-        with open(sceneFilepath) as scenesJson:
-            self.scenes = json.load(scenesJson)['scenes']
+        # Elementary sounds catalog (See utils/sound_catalog.py), the sound bank looks the sounds up in it
+        self.elementarySoundsCatalog = Elementary_Sounds_Catalog(self.elementarySounds, categorical_attributes=())
+
+        self.outputFrameRate = outputFrameRate
+        self.loadedSounds = Elementary_Sounds_Bank(self.elementarySoundFolderPath, self.elementarySoundsCatalog,
+                                                   frame_rate=self.outputFrameRate,
+                                                   max_cached_sounds=elementarySoundsCacheSize)
 
         self.spectrogramSettings = spectrogramSettings
+        self.composeSpectrograms = composeSpectrograms
+
+        if not self.produce_audio_files and spectrogramSettings.get('fmax', 0) > 0:
+            # Only spectrograms are produced, render the scenes at the lowest frame rate covering the frequency band
+            frameRate = self.outputFrameRate or self.loadedSounds[self.elementarySounds[0]['filename']].frame_rate
+            bandLimitedFrameRate = get_band_limited_frame_rate(spectrogramSettings['fmax'], frameRate)
+
+            if bandLimitedFrameRate < frameRate:
+                print("Rendering the scenes at %d Hz (Spectrogram up to %d Hz)" % (bandLimitedFrameRate,
+                                                                                   spectrogramSettings['fmax']))
+                self.outputFrameRate = bandLimitedFrameRate
+                self.loadedSounds.set_frame_rate(bandLimitedFrameRate)
+
+        if self.composeSpectrograms:
+            # The silences are snapped to the hop size of the spectrogram at the frame rate of the elementary sounds
+            frameRate = self.outputFrameRate or self.loadedSounds[self.elementarySounds[0]['filename']].frame_rate
+            hopAlignment = (frameRate, spectrogramSettings['window_length'] - spectrogramSettings['window_overlap'])
+        else:
+            hopAlignment = None
+
+        # Loading scenes definition
+        # The scenes are converted to compact render records that are read on demand by the worker processes
+        sceneFilepath = get_scenes_filepath(os.path.join(experiment_output_folder, 'scenes'), self.outputPrefix,
+                                            self.setType)
+
+        renderRecordsFolder = os.path.join(experiment_output_folder, 'render_records')
+        if not os.path.isdir(renderRecordsFolder):
+            os.mkdir(renderRecordsFolder)
+
+        renderRecordsFilepath = os.path.join(renderRecordsFolder,
+                                             '%s_%s_render_records.jsonl' % (self.outputPrefix, self.setType))
+        build_render_records(sceneFilepath, renderRecordsFilepath, randomSeed, hopAlignment)
+        self.scenes = Render_Records(renderRecordsFilepath)
+
         self.withBackgroundNoise = withBackgroundNoise
         self.backgroundNoiseGainSetting = backgroundNoiseGainSetting
         self.withReverb = withReverb
         self.reverbSettings = reverbSettings
-        self.outputFrameRate = outputFrameRate
+
+        self.variantsPerScene = variantsPerScene
 
         root_images_output_folder = os.path.join(experiment_output_folder, 'images')
         root_audio_output_folder = os.path.join(experiment_output_folder, 'audio')
+        root_variants_output_folder = os.path.join(experiment_output_folder, 'variants')
+        root_events_output_folder = os.path.join(experiment_output_folder, 'events')
 
         if not os.path.isdir(experiment_output_folder):
             # This is impossible, if the experiment folder doesn't exist we won't be able to retrieve the scenes
             os.mkdir(experiment_output_folder)
 
         self.images_output_folder = os.path.join(root_images_output_folder, self.setType)
+        self.root_preprocessed_output_folder = os.path.join(experiment_output_folder, 'preprocessed')
+        self.preprocessed_output_folder = os.path.join(self.root_preprocessed_output_folder, self.setType)
         self.audio_output_folder = os.path.join(root_audio_output_folder, self.setType)
+        self.variants_output_folder = os.path.join(root_variants_output_folder, self.setType)
+        self.events_output_folder = os.path.join(root_events_output_folder, self.setType)
 
         if self.produce_audio_files:
-            if not os.path.isdir(root_audio_output_folder):
-                os.mkdir(root_audio_output_folder)
-                os.mkdir(self.audio_output_folder)
-            else:
-                if not os.path.isdir(self.audio_output_folder):
-                    os.mkdir(self.audio_output_folder)
-                elif clear_existing_files:
-                    rm_dir(self.audio_output_folder)
-                    os.mkdir(self.audio_output_folder)
+            AudioSceneProducer._prepareOutputFolder(root_audio_output_folder, self.audio_output_folder,
+                                                    clear_existing_files)
 
         if self.produce_spectrograms:
-            if not os.path.isdir(root_images_output_folder):
-                os.mkdir(root_images_output_folder)
-                os.mkdir(self.images_output_folder)
-            else:
-                if not os.path.isdir(self.images_output_folder):
-                    os.mkdir(self.images_output_folder)
-                elif clear_existing_files:
-                    rm_dir(self.images_output_folder)
-                    os.mkdir(self.images_output_folder)
+            AudioSceneProducer._prepareOutputFolder(root_images_output_folder, self.images_output_folder,
+                                                    clear_existing_files)
+
+        if self.produce_events:
+            AudioSceneProducer._prepareOutputFolder(root_events_output_folder, self.events_output_folder,
+                                                    clear_existing_files)
+
+        if self.produce_preprocessed:
+            AudioSceneProducer._prepareOutputFolder(self.root_preprocessed_output_folder,
+                                                    self.preprocessed_output_folder, clear_existing_files)
+
+        # Normalisation statistics of the features are computed on the training set
+        # Each worker process accumulate its own statistics (See getFeatureStatsReport())
+        self.featureStats = Welford_Accumulator() if self.produce_preprocessed and self.setType == 'train' else None
+        self.featureStatsLock = Lock()
+
+        # The features of the other sets are standardised with the statistics of the training set
+        self.trainFeatureStats = None
+        if self.produce_preprocessed and self.setType != 'train':
+            statsFilepath = get_feature_stats_filepath(self.root_preprocessed_output_folder, self.outputPrefix)
+
+            if not os.path.isfile(statsFilepath):
+                print("[ERROR] The features are standardised with the statistics of the training set. "
+                      "The training set must be produced first ('%s' not found)" % statsFilepath, file=sys.stderr)
+                exit(1)
+
+            self.trainFeatureStats = load_feature_stats(statsFilepath)
+
+        if self.variantsPerScene > 0:
+            AudioSceneProducer._prepareOutputFolder(root_variants_output_folder, self.variants_output_folder,
+                                                    clear_existing_files)
 
         self.currentSceneIndex = -1  # We start at -1 since nextScene() will increment idx at the start of the fct
         self.nbOfLoadedScenes = len(self.scenes)
@@ -205,109 +335,448 @@ class AudioSceneProducer:
         self.show_status_every = int(self.nbOfLoadedScenes / 10)
         self.show_status_every = self.show_status_every if self.show_status_every > 0 else 1
 
-        self.loadedSounds = []
         self.randomSeed = randomSeed
 
+        # Created on first use by each worker process (See produceSceneBatch() and produceComposedScene())
+        self.batchRenderer = None
+        self.spectrogramComposer = None
+
+    @staticmethod
+    def _prepareOutputFolder(rootFolder, setFolder, clear_existing_files):
+        if not os.path.isdir(rootFolder):
+            os.mkdir(rootFolder)
+            os.mkdir(setFolder)
+        else:
+            if not os.path.isdir(setFolder):
+                os.mkdir(setFolder)
+            elif clear_existing_files:
+                rm_dir(setFolder)
+                os.mkdir(setFolder)
+
     def loadAllElementarySounds(self):
         print("Loading elementary sounds")
-        for sound in self.elementarySounds:
-            # Creating the audio segment (Suppose WAV format)
-            soundFilepath = os.path.join(self.elementarySoundFolderPath, sound['filename'])
-            soundAudioSegment = AudioSegment.from_wav(soundFilepath)
+        self.loadedSounds.preload(self.loadedSounds.get_filenames())
+        print("Done loading elementary sounds")
 
-            if self.outputFrameRate and soundAudioSegment.frame_rate != self.outputFrameRate:
-                soundAudioSegment = soundAudioSegment.set_frame_rate(self.outputFrameRate)
+    def getReferencedSoundFilenames(self, idList):
+        # Set of elementary sounds used by the scenes in {idList}
+        referencedFilenames = set()
+        for sceneId in idList:
+            referencedFilenames.update(self.scenes[sceneId]['sounds'])
 
-            self.loadedSounds.append({
-                'name': sound['filename'],
-                'audioSegment': soundAudioSegment
-            })
+        return referencedFilenames
 
-        print("Done loading elementary sounds")
+    def loadReferencedElementarySounds(self, idList):
+        # Only the sounds referenced by the scenes assigned to this invocation are loaded.
+        # Sounds that doesn't fit in the cache will be loaded on demand by the worker processes
+        referencedFilenames = self.getReferencedSoundFilenames(idList)
+        print("Loading elementary sounds (%d referenced out of %d)" % (len(referencedFilenames),
+                                                                       len(self.loadedSounds)))
+        nbPreloaded = self.loadedSounds.preload(referencedFilenames)
+        print("Done loading elementary sounds (%d preloaded)" % nbPreloaded)
 
     def _getLoadedAudioSegmentByName(self, name):
-        filterResult = list(filter(lambda sound: sound['name'] == name, self.loadedSounds))
-        if len(filterResult) == 1:
-            return filterResult[0]['audioSegment']
+        if name in self.loadedSounds:
+            return self.loadedSounds[name]
         else:
             print('[ERROR] Could not retrieve loaded audio segment \'' + name + '\' from memory.')
             exit(1)
 
-    def produceSceneProcess(self, queue, emptyQueueTimeout=5):
-        # Wait 1 sec for the main thread to fillup the queue
-        time.sleep(1)
+    def produceScene(self, sceneId):
+        for outputName, sceneAudioSegment in self.renderScene(sceneId):
+            self.writeSceneOutputs(sceneAudioSegment, outputName)
+
+    def renderScene(self, sceneId):
+        """
+        Assemble the scene and apply the effects
+        Yield (outputName, sceneAudioSegment) for each output of the scene (Multiple outputs when producing variants)
+        """
+        outputs = self.getSceneOutputs(sceneId)
+
+        if len(outputs) == 0:
+            return
+
+        # The elementary sounds are assembled only once, the effects are applied on a copy for each variant
+        dryAudioSegment = self.assembleDryAudioScene(outputs[0][1], writeEvents=self.produce_events)
+
+        for outputName, scene, effectParameters, seed in outputs:
+            # Since this function is run by different process, we must set the seed of the output in every process
+            # (The background noise is drawn with the seed of the output)
+            init_random_seed(seed)
+
+            yield outputName, self.applyEffects(dryAudioSegment, effectParameters)
+
+    def writeVariantsSidecar(self, sceneId, variants):
+        sidecarFilename = '%s_%s_%06d_variants.json' % (self.outputPrefix, self.setType, sceneId)
+        with open(os.path.join(self.variants_output_folder, sidecarFilename), 'w') as f:
+            json.dump({
+                'scene_index': sceneId,
+                'variants': variants
+            }, f, indent=2, sort_keys=True)
+
+    def getSceneOutputs(self, sceneId):
+        """
+        Draw the effect parameters of each output of the scene (Multiple outputs when producing variants)
+        Return a list of (outputName, scene, effectParameters, seed)
+        """
+        if sceneId >= self.nbOfLoadedScenes:
+            print("[ERROR] The scene specified by id '%d' couln't be found" % sceneId)
+            return []
 
-        emptyQueueCount = 0
-        while emptyQueueCount < emptyQueueTimeout:
-            if not queue.empty():
-                # Reset empty queue count
-                emptyQueueCount = 0
+        scene = self.scenes[sceneId]
 
-                # Retrieve Id and produce scene
-                idToProcess = queue.get()
-                self.produceScene(idToProcess)
-            else:
-                emptyQueueCount += 1
-                time.sleep(random.random())
+        if sceneId % self.show_status_every == 0:
+            print('Producing scene ' + str(sceneId), flush=True)
 
-        return
+        outputs = []
+        if self.variantsPerScene > 0:
+            variants = []
+            for variantIndex in range(self.variantsPerScene):
+                variantSeed = derive_seed(self.randomSeed, sceneId, variantIndex)
+                init_random_seed(variantSeed)
 
+                effectParameters = self.drawEffectParameters()
+                outputName = '%s_%s_%06d_v%d' % (self.outputPrefix, self.setType, sceneId, variantIndex)
+                outputs.append((outputName, scene, effectParameters, variantSeed))
 
-    def produceScene(self, sceneId):
-        # Since this function is run by different process, we must set the same seed for every process
-        init_random_seed(self.randomSeed)
+                variants.append({
+                    'name': outputName,
+                    'variant_index': variantIndex,
+                    'seed': variantSeed,
+                    'effects': effectParameters
+                })
+
+            self.writeVariantsSidecar(sceneId, variants)
+        else:
+            init_random_seed(scene['seed'])
 
-        if sceneId < self.nbOfLoadedScenes:
+            outputName = '%s_%s_%06d' % (self.outputPrefix, self.setType, sceneId)
+            outputs.append((outputName, scene, self.drawEffectParameters(), scene['seed']))
 
-            scene = self.scenes[sceneId]
-            if sceneId % self.show_status_every == 0:
-                print('Producing scene ' + str(sceneId), flush=True)
+        return outputs
 
-            sceneAudioSegment = self.assembleAudioScene(scene)
+    def produceComposedScene(self, sceneId):
+        """
+        Produce the spectrograms of the scene without rendering the audio (See utils/spectrogram_composition.py)
+        """
+        if self.spectrogramComposer is None:
+            self.spectrogramComposer = Spectrogram_Composer(self.loadedSounds,
+                                                            self.spectrogramSettings['window_length'],
+                                                            self.spectrogramSettings['window_overlap'])
 
-            if self.outputFrameRate and sceneAudioSegment.frame_rate != self.outputFrameRate:
-                sceneAudioSegment = sceneAudioSegment.set_frame_rate(self.outputFrameRate)
+        outputs = self.getSceneOutputs(sceneId)
 
-            if self.produce_audio_files:
-                audioFilename = '%s_%s_%06d.flac' % (self.outputPrefix, self.setType, sceneId)
-                sceneAudioSegment.export(os.path.join(self.audio_output_folder, audioFilename), format='flac')
+        if self.produce_events and len(outputs) > 0:
+            scene = outputs[0][1]
+            onsets, lengths, sceneLength = self.spectrogramComposer.get_placements(scene)
+            self.writeSceneEvents(sceneId, scene['sound_ids'], scene['sounds'], onsets, lengths,
+                                  self.spectrogramComposer.frame_rate, sceneLength)
 
-            if self.produce_spectrograms:
-                spectrogram = AudioSceneProducer.createSpectrogram(sceneAudioSegment,
-                                                                   self.spectrogramSettings['freqResolution'],
-                                                                   self.spectrogramSettings['timeResolution'],
-                                                                   self.spectrogramSettings['window_length'],
-                                                                   self.spectrogramSettings['window_overlap'])
+        for outputName, scene, effectParameters, seed in outputs:
+            Pxx, freqs, bins, sceneLength = self.spectrogramComposer.compose(scene,
+                                                                             effectParameters['background_noise_gain'],
+                                                                             seed)
 
-                imageFilename = '%s_%s_%06d.png' % (self.outputPrefix, self.setType, sceneId)
-                spectrogram.savefig(os.path.join(self.images_output_folder, imageFilename), dpi=100)
+            frameRate = self.spectrogramComposer.frame_rate
+            self.writeSpectrogramOutputs(Pxx, freqs, bins, frameRate, sceneLength / frameRate, outputName)
 
-                AudioSceneProducer.clearSpectrogram(spectrogram)
+    def produceSceneBatch(self, sceneIds):
+        """
+        Produce the scenes in {sceneIds} as a batch (See utils/batch_rendering.py)
+        The effect parameters and the background noise are drawn with the same seeds as in produceScene()
+        """
+        if self.batchRenderer is None:
+            self.batchRenderer = Batch_Scene_Renderer(self.loadedSounds)
+
+        outputs = []
+        for sceneId in sceneIds:
+            outputs += self.getSceneOutputs(sceneId)
+
+        if len(outputs) == 0:
+            return
+
+        outputNames, scenes, effectParameters, seeds = zip(*outputs)
+
+        batch, sceneLengths, placements = self.batchRenderer.assemble(scenes, return_placements=True)
+
+        if self.produce_events:
+            self.writeBatchEvents(scenes, placements)
+
+        if self.withBackgroundNoise:
+            batch, sceneLengths = self.batchRenderer.add_background_noise(batch, sceneLengths,
+                                                                          [p['background_noise_gain']
+                                                                           for p in effectParameters],
+                                                                          seeds)
+
+        if self.withReverb:
+            # The reverberation is applied by sox, one scene at a time
+            sceneAudioSegments = []
+            for sceneIndex, parameters in enumerate(effectParameters):
+                sceneAudioSegment = self.batchRenderer.to_audio_segment(batch, sceneLengths, sceneIndex)
+                sceneAudioSegments.append(AudioSceneProducer.applyReverberation(sceneAudioSegment,
+                                                                                parameters['reverb_room_scale'],
+                                                                                parameters['reverb_delay']))
 
+            batch, sceneLengths = self.batchRenderer.from_audio_segments(sceneAudioSegments)
+
+        frameRate = self.batchRenderer.frame_rate
+
+        if self.produce_audio_files:
+            for sceneIndex, outputName in enumerate(outputNames):
+                self.writeAudioFile(self.batchRenderer.to_audio_segment(batch, sceneLengths, sceneIndex), outputName)
+
+        if self.compute_spectrograms:
+            spectrograms = batch_specgram(batch, sceneLengths, frameRate,
+                                          self.spectrogramSettings['window_length'],
+                                          self.spectrogramSettings['window_overlap'])
+
+            for (Pxx, freqs, bins), sceneLength, outputName in zip(spectrograms, sceneLengths, outputNames):
+                self.writeSpectrogramOutputs(Pxx, freqs, bins, frameRate, sceneLength / frameRate, outputName)
+
+    def writeBatchEvents(self, scenes, placements):
+        sceneIndexes, _, offsets, lengths, sceneLengths = placements
+
+        writtenSceneIds = set()
+        for sceneIndex, scene in enumerate(scenes):
+            # The variants of a scene share the same events
+            if scene['id'] in writtenSceneIds:
+                continue
+
+            soundIndexes = np.nonzero(sceneIndexes == sceneIndex)[0]
+            self.writeSceneEvents(scene['id'], scene['sound_ids'], scene['sounds'], offsets[soundIndexes],
+                                  lengths[soundIndexes], self.batchRenderer.frame_rate, sceneLengths[sceneIndex])
+            writtenSceneIds.add(scene['id'])
+
+    def writeSceneOutputs(self, sceneAudioSegment, outputName):
+        sceneAudioSegment = self.resampleOutput(sceneAudioSegment)
+
+        if self.produce_audio_files:
+            self.writeAudioFile(sceneAudioSegment, outputName)
+
+        if self.compute_spectrograms:
+            Pxx, freqs, bins = AudioSceneProducer.computeSpectrogram(AudioSceneProducer.getSamples(sceneAudioSegment),
+                                                                     sceneAudioSegment.frame_rate,
+                                                                     self.spectrogramSettings['window_length'],
+                                                                     self.spectrogramSettings['window_overlap'])
+
+            self.writeSpectrogramOutputs(Pxx, freqs, bins, sceneAudioSegment.frame_rate,
+                                       sceneAudioSegment.duration_seconds, outputName)
+
+    def resampleOutput(self, sceneAudioSegment):
+        if self.outputFrameRate and sceneAudioSegment.frame_rate != self.outputFrameRate:
+            sceneAudioSegment = sceneAudioSegment.set_frame_rate(self.outputFrameRate)
+
+        return sceneAudioSegment
+
+    def writeAudioFile(self, sceneAudioSegment, outputName):
+        audioFilename = '%s.flac' % outputName
+        sceneAudioSegment.export(os.path.join(self.audio_output_folder, audioFilename), format='flac')
+
+    def writeSpectrogramOutputs(self, Pxx, freqs, bins, frameRate, durationSeconds, outputName):
+        # Band limiting and log-frequency binning
+        fmin = self.spectrogramSettings.get('fmin', 0)
+        fmax = min(self.spectrogramSettings['fmax'], frameRate/2) if self.spectrogramSettings.get('fmax', 0) > 0 \
+            else None
+        nbLogBins = self.spectrogramSettings.get('log_frequency_bins', 0)
+
+        Pxx, freqs = reduce_spectrogram(Pxx, freqs, fmin, fmax, nbLogBins)
+
+        if self.produce_preprocessed:
+            self.writeFeatures(Pxx, outputName)
+
+        if not self.produce_spectrograms:
+            return
+
+        spectrogram = AudioSceneProducer.createSpectrogramFigure(Pxx, freqs, bins, frameRate, durationSeconds,
+                                                                 self.spectrogramSettings['freqResolution'],
+                                                                 self.spectrogramSettings['timeResolution'],
+                                                                 self.spectrogramSettings['window_length'],
+                                                                 self.spectrogramSettings['window_overlap'],
+                                                                 frequencyRange=(fmin, fmax or frameRate/2),
+                                                                 height=nbLogBins if nbLogBins > 0 else None)
+
+        imageFilename = '%s.png' % outputName
+        spectrogram.savefig(os.path.join(self.images_output_folder, imageFilename), dpi=100)
+
+        AudioSceneProducer.clearSpectrogram(spectrogram)
+
+    def writeFeatures(self, Pxx, outputName):
+        features = spectrogram_to_features(Pxx)
+
+        if self.featureStats is not None:
+            # The training features are standardised once all the statistics are accumulated (See mainPool())
+            np.save(os.path.join(self.preprocessed_output_folder, outputName + unstandardised_suffix), features)
+
+            # The encoding stage of the pipeline run in multiple threads
+            with self.featureStatsLock:
+                self.featureStats.update(features)
         else:
-            print("[ERROR] The scene specified by id '%d' couln't be found" % sceneId)
+            features = standardise_features(features, self.trainFeatureStats)
+            np.save(os.path.join(self.preprocessed_output_folder, '%s.npy' % outputName), features)
+
+    def getFeatureStatsReport(self):
+        """
+        Statistics accumulated by a worker process since the previous report (The accumulator of the worker is reset)
+        Sent to the main process after each task (See Recycling_Worker_Pool)
+        """
+        if self.featureStats is None or self.featureStats.count == 0:
+            return None
+
+        report = self.featureStats.to_dict()
+        self.featureStats = Welford_Accumulator()
+
+        return report
+
+    def mergeFeatureStatsReport(self, report):
+        self.featureStats.merge(Welford_Accumulator.from_dict(report))
+
+    def saveFeatureStats(self):
+        """
+        Write the statistics accumulated by the main process (Merged reports of the worker processes) to the
+        preprocessed folder
+        """
+        if self.featureStats.count == 0:
+            print("[ERROR] No features statistics were accumulated", file=sys.stderr)
+            return False
+
+        statsFilepath = get_feature_stats_filepath(self.root_preprocessed_output_folder, self.outputPrefix)
+        save_feature_stats(statsFilepath, self.featureStats, settings=self.spectrogramSettings)
+
+        print(">>> Features statistics computed on %d frames written to '%s'" % (self.featureStats.count,
+                                                                                 statsFilepath))
+
+        return True
+
+    def standardiseTrainingFeatures(self, nbProcess):
+        nbStandardised = standardise_feature_files(self.preprocessed_output_folder,
+                                                   (self.featureStats.mean, self.featureStats.std), nbProcess)
+
+        print(">>> Standardised %d training features" % nbStandardised)
+
+    # Pipeline stages (See AudioScenePipeline)
+    def pipelineAssemblyStage(self, sceneId):
+        messages = []
+        try:
+            for outputName, sceneAudioSegment in self.renderScene(sceneId):
+                sceneAudioSegment = self.resampleOutput(sceneAudioSegment)
+
+                messages.append({
+                    'sceneId': sceneId,
+                    'outputName': outputName,
+                    'audio': array_to_shared_memory(AudioSceneProducer.getSamples(sceneAudioSegment)),
+                    'frameRate': sceneAudioSegment.frame_rate,
+                    'sampleWidth': sceneAudioSegment.sample_width,
+                    'channels': sceneAudioSegment.channels
+                })
+        except Exception:
+            # The outputs already assembled won't reach the other stages
+            for message in messages:
+                AudioScenePipeline.releaseItem(message)
+            raise
+
+        return messages
+
+    def pipelineSpectrogramStage(self, message):
+        if self.compute_spectrograms:
+            samples = shared_memory_to_array(message['audio'])
+
+            Pxx, freqs, bins = AudioSceneProducer.computeSpectrogram(samples,
+                                                                     message['frameRate'],
+                                                                     self.spectrogramSettings['window_length'],
+                                                                     self.spectrogramSettings['window_overlap'])
+
+            message['spectrogram'] = array_to_shared_memory(Pxx)
+            message['freqs'] = freqs
+            message['bins'] = bins
+            message['durationSeconds'] = len(samples) / (message['frameRate'] * message['channels'])
+
+        return [message]
+
+    def pipelineEncodeStage(self, message):
+        # This is the last stage, the shared memory blocks are released
+        samples = shared_memory_to_array(message['audio'], unlink=True)
 
-    def assembleAudioScene(self, scene):
+        if self.produce_audio_files:
+            sceneAudioSegment = AudioSegment(samples.tobytes(),
+                                             frame_rate=message['frameRate'],
+                                             sample_width=message['sampleWidth'],
+                                             channels=message['channels'])
+
+            self.writeAudioFile(sceneAudioSegment, message['outputName'])
+
+        if 'spectrogram' in message:
+            Pxx = shared_memory_to_array(message['spectrogram'], unlink=True)
+
+            self.writeSpectrogramOutputs(Pxx, message['freqs'], message['bins'], message['frameRate'],
+                                       message['durationSeconds'], message['outputName'])
+
+        return []
+
+    def assembleAudioScene(self, scene, writeEvents=False):
+        sceneAudioSegment = self.assembleDryAudioScene(scene, writeEvents)
+
+        return self.applyEffects(sceneAudioSegment, self.drawEffectParameters())
+
+    def assembleDryAudioScene(self, scene, writeEvents=False):
         sceneAudioSegment = AudioSegment.empty()
+        onsets = []
+        lengths = []
 
         sceneAudioSegment += AudioSegment.silent(duration=scene['silence_before'])
-        for sound in scene['objects']:
-            newAudioSegment = self._getLoadedAudioSegmentByName(sound['filename'])
+        for soundFilename, silenceAfter in zip(scene['sounds'], scene['silences_after']):
+            newAudioSegment = self._getLoadedAudioSegmentByName(soundFilename)
 
             sceneAudioSegment += newAudioSegment
 
+            # The sound is at the end of the scene
+            lengths.append(int(newAudioSegment.frame_count()))
+            onsets.append(int(sceneAudioSegment.frame_count()) - lengths[-1])
+
             # Insert a silence padding after the sound
-            sceneAudioSegment += AudioSegment.silent(duration=sound['silence_after'])
+            sceneAudioSegment += AudioSegment.silent(duration=silenceAfter)
+
+        if writeEvents:
+            self.writeSceneEvents(scene['id'], scene['sound_ids'], scene['sounds'], onsets, lengths,
+                                  sceneAudioSegment.frame_rate, int(sceneAudioSegment.frame_count()))
 
+        return sceneAudioSegment
+
+    def writeSceneEvents(self, sceneId, soundIds, filenames, onsets, lengths, frameRate, sceneLength):
+        # The sound ids are the ids of the scene objects (See utils/render_records.py)
+        events = get_scene_events(sceneId, frameRate, sceneLength, soundIds, filenames, onsets, lengths)
+
+        eventsFilename = '%s_%s_%06d_events.json' % (self.outputPrefix, self.setType, sceneId)
+        write_scene_events(os.path.join(self.events_output_folder, eventsFilename), events)
+
+    def drawEffectParameters(self):
+        # The parameters are drawn in the same order as they are applied (Background noise, then reverb)
+        effectParameters = {
+            'background_noise_gain': None,
+            'reverb_room_scale': None,
+            'reverb_delay': None
+        }
+
+        if self.withBackgroundNoise:
+            effectParameters['background_noise_gain'] = random.randrange(self.backgroundNoiseGainSetting['min'],
+                                                                         self.backgroundNoiseGainSetting['max'])
+
+        if self.withReverb:
+            effectParameters['reverb_room_scale'] = random.randrange(self.reverbSettings['roomScale']['min'],
+                                                                     self.reverbSettings['roomScale']['max'])
+            effectParameters['reverb_delay'] = random.randrange(self.reverbSettings['delay']['min'],
+                                                                self.reverbSettings['delay']['max'])
+
+        return effectParameters
+
+    def applyEffects(self, sceneAudioSegment, effectParameters):
         if self.withBackgroundNoise:
-            gain = random.randrange(self.backgroundNoiseGainSetting['min'], self.backgroundNoiseGainSetting['max'])
-            sceneAudioSegment = AudioSceneProducer.overlayBackgroundNoise(sceneAudioSegment, gain)
+            sceneAudioSegment = AudioSceneProducer.overlayBackgroundNoise(sceneAudioSegment,
+                                                                          effectParameters['background_noise_gain'])
 
         if self.withReverb:
-            roomScale = random.randrange(self.reverbSettings['roomScale']['min'],
-                                         self.reverbSettings['roomScale']['max'])
-            delay = random.randrange(self.reverbSettings['delay']['min'], self.reverbSettings['delay']['max'])
-            sceneAudioSegment = AudioSceneProducer.applyReverberation(sceneAudioSegment, roomScale, delay)
+            sceneAudioSegment = AudioSceneProducer.applyReverberation(sceneAudioSegment,
+                                                                      effectParameters['reverb_room_scale'],
+                                                                      effectParameters['reverb_delay'])
 
         # Make sure the everything is in Mono (If stereo, will convert to mono)
         sceneAudioSegment.set_channels(1)
@@ -334,37 +803,249 @@ class AudioSceneProducer:
 
         return sceneAudioSegment
 
+    @staticmethod
+    def getSamples(sceneAudioSegment):
+        return np.frombuffer(sceneAudioSegment._data, dtype=get_array_type(8*sceneAudioSegment.frame_width))
+
+    @staticmethod
+    def computeSpectrogram(samples, frameRate, windowLength, windowOverlap):
+        # Power spectral density, same computation as matplotlib Axes.specgram()
+        # See https://matplotlib.org/api/_as_gen/matplotlib.pyplot.specgram.html?highlight=matplotlib%20pyplot%20specgram#matplotlib.pyplot.specgram
+        Pxx, freqs, bins = matplotlib.mlab.specgram(x=samples,
+                                                    Fs=frameRate,
+                                                    window=matplotlib.mlab.window_hanning,
+                                                    NFFT=windowLength,
+                                                    noverlap=windowOverlap)
+
+        return Pxx, freqs, bins
+
     @staticmethod
     def createSpectrogram(sceneAudioSegment, freqResolution, timeResolution, windowLength, windowOverlap):
-        highestFreq = sceneAudioSegment.frame_rate/2
-        height = highestFreq // freqResolution
-        width = sceneAudioSegment.duration_seconds * 1000 // timeResolution
+        Pxx, freqs, bins = AudioSceneProducer.computeSpectrogram(AudioSceneProducer.getSamples(sceneAudioSegment),
+                                                                 sceneAudioSegment.frame_rate,
+                                                                 windowLength,
+                                                                 windowOverlap)
+
+        return AudioSceneProducer.createSpectrogramFigure(Pxx, freqs, bins, sceneAudioSegment.frame_rate,
+                                                          sceneAudioSegment.duration_seconds, freqResolution,
+                                                          timeResolution, windowLength, windowOverlap)
+
+    @staticmethod
+    def createSpectrogramFigure(Pxx, freqs, bins, frameRate, durationSeconds, freqResolution, timeResolution,
+                                windowLength, windowOverlap, frequencyRange=None, height=None):
+        # The frequency range default to 0 Hz up to the Nyquist frequency
+        lowestFreq, highestFreq = frequencyRange if frequencyRange is not None else (0, frameRate/2)
+
+        if height is None:
+            height = (highestFreq - lowestFreq) // freqResolution
+        width = durationSeconds * 1000 // timeResolution
 
         # Set figure settings to remove all axis
-        spectrogram = plt.figure(frameon=False)
+        # The figure is not registered in pyplot, it is thread safe and can be garbage collected once cleared
+        spectrogram = Figure(frameon=False)
+        FigureCanvasAgg(spectrogram)
         spectrogram.set_size_inches(width/100, height/100)
-        ax = plt.Axes(spectrogram, [0., 0., 1., 1.])
+        ax = spectrogram.add_axes([0., 0., 1., 1.])
         ax.set_axis_off()
-        spectrogram.add_axes(ax)
 
-        # Generate the spectrogram
-        # See https://matplotlib.org/api/_as_gen/matplotlib.pyplot.specgram.html?highlight=matplotlib%20pyplot%20specgram#matplotlib.pyplot.specgram
-        Pxx, freqs, bins, im = ax.specgram(x=np.frombuffer(sceneAudioSegment._data,
-                                                            dtype=get_array_type(8*sceneAudioSegment.frame_width)),
-                                            Fs=sceneAudioSegment.frame_rate,
-                                            window=matplotlib.mlab.window_hanning,
-                                            NFFT=windowLength,
-                                            noverlap=windowOverlap,
-                                            scale='dB')
+        # Render the spectrogram in dB (Same rendering as matplotlib Axes.specgram(scale='dB'))
+        Z = np.flipud(10. * np.log10(Pxx))
+        padXExtent = (windowLength - windowOverlap) / frameRate / 2
+        extent = np.min(bins) - padXExtent, np.max(bins) + padXExtent, freqs[0], freqs[-1]
+
+        ax.imshow(Z, extent=extent, origin='upper')
+        ax.axis('auto')
 
         return spectrogram
 
     @staticmethod
     def clearSpectrogram(spectrogram):
-        # Close and Clear the figure
-        plt.close(spectrogram)
+        # Clear the figure
+        # Memory that is not released is bounded by the worker recycling (See --worker_max_tasks, --worker_max_rss_mb)
         spectrogram.clear()
-        gc.collect()
+
+
+class AudioScenePipeline:
+    """
+    Staged production of the scenes
+        - Assembly & effects stage              (Processes)
+        - Spectrogram (STFT) stage              (Processes)
+        - Encoding & writing to file stage      (Threads of the main process)
+
+    The stages are connected by bounded queues. Audio buffers and spectrograms are passed between stages through
+    shared memory, only small descriptors are sent through the queues.
+    The number of workers per stage is either specified or balanced according to the measured duration of each stage
+    """
+
+    stageNames = ['assembly', 'spectrogram', 'encode']
+
+    def __init__(self, producer, stageWorkers, queueSize):
+        self.producer = producer
+        self.stageWorkers = stageWorkers
+
+        self.stageFcts = {
+            'assembly': producer.pipelineAssemblyStage,
+            'spectrogram': producer.pipelineSpectrogramStage,
+            'encode': producer.pipelineEncodeStage
+        }
+
+        # Input queue of each stage
+        self.queues = {stageName: Queue(maxsize=queueSize) for stageName in self.stageNames}
+        self.statsQueue = Queue()
+
+    @staticmethod
+    def releaseItem(item):
+        # Release the shared memory blocks of an item that won't reach the last stage
+        if isinstance(item, dict):
+            for key in ['audio', 'spectrogram']:
+                if key in item:
+                    release_shared_memory(item[key])
+
+    @staticmethod
+    def getItemSceneId(item):
+        # The items of the assembly stage are scene ids, the following stages receive messages
+        return item['sceneId'] if isinstance(item, dict) else item
+
+    @staticmethod
+    def _stageLoop(stageName, stageFct, inputQueue, outputQueue, statsQueue):
+        nbProcessed = 0
+        busyTime = 0.
+        failedSceneIds = []
+
+        while True:
+            item = inputQueue.get()
+
+            if item is None:
+                # No more items
+                break
+
+            startTime = time.perf_counter()
+            try:
+                outputs = stageFct(item)
+            except Exception as e:
+                sceneId = AudioScenePipeline.getItemSceneId(item)
+                print("[ERROR] Pipeline stage '%s' failed on scene %d : %s" % (stageName, sceneId, repr(e)),
+                      file=sys.stderr, flush=True)
+
+                AudioScenePipeline.releaseItem(item)
+                failedSceneIds.append(sceneId)
+                outputs = []
+
+            busyTime += time.perf_counter() - startTime
+            nbProcessed += 1
+
+            if outputQueue is not None:
+                for output in outputs:
+                    outputQueue.put(output)
+
+        statsQueue.put({
+            'stage': stageName,
+            'nbProcessed': nbProcessed,
+            'busyTime': busyTime,
+            'failedSceneIds': failedSceneIds
+        })
+
+    @staticmethod
+    def measureStageDurations(producer, sceneIds):
+        """
+        Produce the scenes sequentially and measure the time spent in each stage
+        """
+        durations = {stageName: 0. for stageName in AudioScenePipeline.stageNames}
+
+        for sceneId in sceneIds:
+            startTime = time.perf_counter()
+            assemblyOutputs = producer.pipelineAssemblyStage(sceneId)
+            durations['assembly'] += time.perf_counter() - startTime
+
+            for assemblyOutput in assemblyOutputs:
+                startTime = time.perf_counter()
+                spectrogramOutputs = producer.pipelineSpectrogramStage(assemblyOutput)
+                durations['spectrogram'] += time.perf_counter() - startTime
+
+                for spectrogramOutput in spectrogramOutputs:
+                    startTime = time.perf_counter()
+                    producer.pipelineEncodeStage(spectrogramOutput)
+                    durations['encode'] += time.perf_counter() - startTime
+
+        return durations
+
+    @staticmethod
+    def balanceStageWorkers(durations, nbProcess):
+        """
+        Distribute {nbProcess} processes between the assembly and spectrogram stages according to their duration
+        The number of encoding threads is chosen so the encoding stage keep up with the slowest process stage
+        (Bounded by {nbProcess} since the threads share the main process)
+        """
+        processStagesDuration = durations['assembly'] + durations['spectrogram']
+
+        if nbProcess < 2 or processStagesDuration == 0:
+            nbAssembly = 1
+        else:
+            nbAssembly = int(round(nbProcess * durations['assembly'] / processStagesDuration))
+            nbAssembly = min(max(nbAssembly, 1), nbProcess - 1)
+
+        nbSpectrogram = max(nbProcess - nbAssembly, 1)
+
+        slowestStageDuration = max(durations['assembly'] / nbAssembly, durations['spectrogram'] / nbSpectrogram)
+        if slowestStageDuration > 0:
+            nbEncode = min(max(int(math.ceil(durations['encode'] / slowestStageDuration)), 1), max(nbProcess, 1))
+        else:
+            nbEncode = 1
+
+        return {
+            'assembly': nbAssembly,
+            'spectrogram': nbSpectrogram,
+            'encode': nbEncode
+        }
+
+    def run(self, sceneIds):
+        # The shared memory blocks are created and released in different processes.
+        # The resource tracker must be started before forking so that all processes share it
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+
+        stageOutputQueues = {
+            'assembly': self.queues['spectrogram'],
+            'spectrogram': self.queues['encode'],
+            'encode': None
+        }
+
+        workers = {}
+        for stageName in self.stageNames:
+            # The encoding stage run in threads of the main process
+            workerClass = Thread if stageName == 'encode' else Process
+            workers[stageName] = [workerClass(target=AudioScenePipeline._stageLoop,
+                                              args=(stageName, self.stageFcts[stageName], self.queues[stageName],
+                                                    stageOutputQueues[stageName], self.statsQueue))
+                                  for i in range(self.stageWorkers[stageName])]
+
+            for worker in workers[stageName]:
+                worker.start()
+
+        for sceneId in sceneIds:
+            self.queues['assembly'].put(sceneId)
+
+        print("Done filling worker processes queue", flush=True)
+
+        # Stop the stages one after the other once the previous stage is done
+        for stageName in self.stageNames:
+            for i in range(len(workers[stageName])):
+                self.queues[stageName].put(None)
+
+            for worker in workers[stageName]:
+                worker.join()
+
+        summary = {stageName: {'workers': self.stageWorkers[stageName], 'nbProcessed': 0, 'busyTime': 0.,
+                               'failedSceneIds': []}
+                   for stageName in self.stageNames}
+
+        for i in range(sum(self.stageWorkers.values())):
+            stats = self.statsQueue.get()
+            summary[stats['stage']]['nbProcessed'] += stats['nbProcessed']
+            summary[stats['stage']]['busyTime'] += stats['busyTime']
+            summary[stats['stage']]['failedSceneIds'] += stats['failedSceneIds']
+
+        return summary
 
 
 def mainPool():
@@ -374,8 +1055,8 @@ def mainPool():
     assert args.random_nb_generator_seed is not None, "The seed must be specified in the arguments."
     init_random_seed(args.random_nb_generator_seed)
 
-    # If not producing audio, we will produce spectrograms
-    if args.no_audio_files and not args.produce_spectrograms:
+    # If not producing audio (Or features), we will produce spectrograms
+    if args.no_audio_files and not args.produce_spectrograms and not args.produce_preprocessed:
         args.produce_spectrograms = True
 
     # Preparing settings
@@ -401,6 +1082,14 @@ def mainPool():
     args.with_background_noise = args.with_background_noise and not args.no_background_noise
     args.with_reverb = args.with_reverb and not args.no_reverb
 
+    if args.compose_spectrograms and (args.with_reverb or not args.no_audio_files):
+        print("[ERROR] --compose_spectrograms require --no_reverb and --no_audio_files.", file=sys.stderr)
+        exit(1)
+
+    if args.compose_spectrograms and (args.pipeline or args.batch_size > 0):
+        print("[ERROR] --compose_spectrograms can't be used with --pipeline or --batch_size.", file=sys.stderr)
+        exit(1)
+
     # Creating the producer
     producer = AudioSceneProducer(outputFolder=args.output_folder,
                                   version_nb=args.output_version_nb,
@@ -408,6 +1097,11 @@ def mainPool():
                                   elementarySoundFolderPath=args.elementary_sounds_folder,
                                   setType=args.set_type,
                                   randomSeed=args.random_nb_generator_seed,
+                                  variantsPerScene=args.variants_per_scene,
+                                  elementarySoundsCacheSize=args.elementary_sounds_cache_size,
+                                  composeSpectrograms=args.compose_spectrograms,
+                                  produce_preprocessed=args.produce_preprocessed,
+                                  produce_events=args.produce_events,
                                   outputFrameRate=args.output_frame_rate if args.do_resample else None ,
                                   outputPrefix=args.output_filename_prefix,
                                   produce_audio_files=not args.no_audio_files,
@@ -422,6 +1116,9 @@ def mainPool():
                                       'timeResolution': args.spectrogram_time_resolution,
                                       'window_length': args.spectrogram_window_length,
                                       'window_overlap': args.spectrogram_window_overlap,
+                                      'fmin': args.spectrogram_fmin,
+                                      'fmax': args.spectrogram_fmax,
+                                      'log_frequency_bins': args.spectrogram_log_frequency_bins
                                   })
 
     # Save arguments
@@ -443,46 +1140,126 @@ def mainPool():
         idList = range(bounds[0], bounds[1])
         nb_generated = bounds[1] - bounds[0]
 
-    idList = iter(idList)
-
-    # Load and preprocess all elementary sounds into memory
-    producer.loadAllElementarySounds()
+    # Load and preprocess the elementary sounds referenced by the scenes to produce
+    producer.loadReferencedElementarySounds(idList)
 
     startTime = datetime.now()
 
-    id_queue = Queue(maxsize=1000)
-    worker_processes = [Process(target=producer.produceSceneProcess, args=(id_queue,)) for i in range(args.nb_process)]
-
-    for p in worker_processes:
-        p.start()
+    if args.pipeline and args.batch_size > 0:
+        print("[ERROR] --pipeline and --batch_size can't be used together.", file=sys.stderr)
+        exit(1)
 
-    done = False
-    while not done:
-        if not id_queue.full():
-            try:
-                id_queue.put(next(idList))
-            except StopIteration:
-                # Reached the end of the iterator
-                done = True
-        else:
-            # Producing the scenes take quite some time.
-            # We wait for 30 seconds in order to reduce context switch between main process and worker processes
-            time.sleep(30)
+    if args.pipeline and not is_shared_memory_available():
+        print("[ERROR] --pipeline require Python >= 3.8 (multiprocessing.shared_memory). "
+              "The scenes will be produced by the worker processes pool.", file=sys.stderr)
+        args.pipeline = False
 
-    print("Done filling worker processes queue")
+    if args.pipeline:
+        idList = iter(idList)
 
-    # Wait for all processes to finish
-    for p in worker_processes:
-        p.join()
+        if args.pipeline_stage_workers == 'auto':
+            # Measure the duration of each stage on the first scenes (Those scenes are produced)
+            calibrationIds = [sceneId for _, sceneId in zip(range(2), idList)]
+            stageDurations = AudioScenePipeline.measureStageDurations(producer, calibrationIds)
+            stageWorkers = AudioScenePipeline.balanceStageWorkers(stageDurations, args.nb_process)
+        else:
+            stageWorkers = dict(zip(AudioScenePipeline.stageNames,
+                                    [int(x) for x in args.pipeline_stage_workers.split(',')]))
+
+            if len(stageWorkers) != 3 or min(stageWorkers.values()) < 1:
+                print("Invalid pipeline stage workers. Must be specified as A,S,E where each stage have at least "
+                      "one worker.", file=sys.stderr)
+                exit(1)
+
+        print("Pipeline workers : %d assembly, %d spectrogram, %d encode" % (stageWorkers['assembly'],
+                                                                           stageWorkers['spectrogram'],
+                                                                           stageWorkers['encode']))
+
+        pipeline = AudioScenePipeline(producer, stageWorkers, args.pipeline_queue_size)
+
+        # Wait for all stages to finish
+        pipeline_summary = pipeline.run(idList)
+
+        print("Job Done !")
+        print(f"Took {str(datetime.now() - startTime)}")
+        for stageName, stageSummary in pipeline_summary.items():
+            busyTime = stageSummary['busyTime']
+            print(">>> Stage %s : %d workers, %d processed, %.2f sec per item, %.2f items/sec" % (
+                stageName, stageSummary['workers'], stageSummary['nbProcessed'],
+                busyTime / stageSummary['nbProcessed'] if stageSummary['nbProcessed'] > 0 else 0,
+                stageSummary['workers'] * stageSummary['nbProcessed'] / busyTime if busyTime > 0 else 0))
+
+        failedSceneIds = sorted(set(sceneId for stageSummary in pipeline_summary.values()
+                                    for sceneId in stageSummary['failedSceneIds']))
+        if len(failedSceneIds) > 0:
+            print("[ERROR] %d scenes were not produced (A pipeline stage failed) : %s" % (
+                len(failedSceneIds), ','.join(str(sceneId) for sceneId in failedSceneIds)), file=sys.stderr)
+            nb_generated -= len(failedSceneIds)
+    else:
+        if args.batch_size > 0:
+            # Each task is a batch of scenes
+            task_fct = producer.produceSceneBatch
+            tasks = (list(idList[i:i + args.batch_size]) for i in range(0, len(idList), args.batch_size))
+            task_name = 'batches'
+        elif args.compose_spectrograms:
+            task_fct = producer.produceComposedScene
+            tasks = idList
+            task_name = 'scenes'
+        else:
+            task_fct = producer.produceScene
+            tasks = idList
+            task_name = 'scenes'
+
+        worker_pool = Recycling_Worker_Pool(task_fct, args.nb_process,
+                                            max_tasks_per_worker=args.worker_max_tasks,
+                                            max_rss_mb=args.worker_max_rss_mb,
+                                            task_report_fct=producer.getFeatureStatsReport,
+                                            merge_report_fct=producer.mergeFeatureStatsReport)
+
+        # Wait for all processes to finish
+        pool_summary = worker_pool.run(tasks)
+
+        print("Job Done !")
+        print(f"Took {str(datetime.now() - startTime)}")
+        print(">>> Worker processes : %d spawned, %d recycled (%d task limit, %d memory limit), %d crashed" % (
+            pool_summary['nb_workers_spawned'],
+            pool_summary['nb_workers_recycled']['max_tasks'] + pool_summary['nb_workers_recycled']['max_rss'],
+            pool_summary['nb_workers_recycled']['max_tasks'],
+            pool_summary['nb_workers_recycled']['max_rss'],
+            pool_summary['nb_workers_crashed']))
+        print(">>> %.1f %s per worker process. Peak resident memory of a worker : %.1f MB" % (
+            pool_summary['mean_tasks_per_worker'], task_name, pool_summary['max_peak_rss_mb']))
+
+        if pool_summary['nb_retried_tasks'] > 0:
+            print(">>> %d %s of crashed workers were produced again" % (pool_summary['nb_retried_tasks'], task_name))
+
+        if len(pool_summary['lost_tasks']) > 0:
+            # The tasks are either scene ids or batches of scene ids
+            lostSceneIds = sorted(sceneId for task in pool_summary['lost_tasks']
+                                  for sceneId in (task if isinstance(task, list) else [task]))
+            print("[ERROR] %d scenes were not produced (Their worker crashed) : %s" % (
+                len(lostSceneIds), ','.join(str(sceneId) for sceneId in lostSceneIds)), file=sys.stderr)
+            nb_generated -= len(lostSceneIds)
+
+    if producer.featureStats is not None:
+        # The reports of the worker processes are merged as the tasks are completed
+        # With the pipeline, the features are written by the main process
+        if producer.saveFeatureStats():
+            producer.standardiseTrainingFeatures(args.nb_process)
+
+    if args.variants_per_scene > 0:
+        print(">>> Produced %d variants for each scene." % args.variants_per_scene)
+        nb_generated *= args.variants_per_scene
 
-    print("Job Done !")
-    print(f"Took {str(datetime.now() - startTime)}")
     if args.produce_spectrograms:
         print(">>> Produced %d spectrograms." % nb_generated)
 
     if not args.no_audio_files:
         print(">>> Produced %d audio files." % nb_generated)
 
+    if args.produce_preprocessed:
+        print(">>> Produced %d preprocessed features." % nb_generated)
+
 
 if __name__ == '__main__':
     mainPool()
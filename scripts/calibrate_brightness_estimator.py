@@ -0,0 +1,85 @@
+# CLEAR Dataset
+# >> Brightness estimator calibration
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+"""
+Fit the regression coefficients of the NumPy brightness estimator (utils/brightness_estimation.py) on the
+timbral_models brightness of an elementary sounds bank (timbral_models must be installed).
+The brightness labels of both analysers are compared with the thresholds of Elementary_Sounds.
+The coefficients are written to a JSON file that can be given to generate_scenes_definition.py :
+    --brightness_analyser numpy --brightness_calibration_filepath {output_filepath}
+
+Run from the root of the repository : python -m scripts.calibrate_brightness_estimator
+"""
+
+import os
+import json
+import argparse
+
+import numpy as np
+from pydub import AudioSegment
+from timbral_models import timbral_brightness
+
+from utils.brightness_estimation import estimate_brightness, calibrate_brightness_coefficients, \
+    save_brightness_coefficients, timbral_brightness_coefficients, numpy_brightness_coefficients
+
+
+parser = argparse.ArgumentParser(fromfile_prefix_chars='@')
+parser.add_argument('--elementary_sounds_folder', default='./elementary_sounds',
+                    help='Folder containing all the elementary sounds and the JSON listing them')
+parser.add_argument('--elementary_sounds_definition_filename', default='elementary_sounds.json',
+                    help='Filename of the JSON file listing the attributes of the elementary sounds')
+parser.add_argument('--output_filepath', default='./output/brightness_calibration.json',
+                    help='Where the fitted coefficients will be written')
+
+
+def get_brightness_labels(brightness):
+    # Same normalisation and thresholds as Elementary_Sounds._preprocess_sounds()
+    normalized_brightness = (brightness - brightness.min()) / (brightness.max() - brightness.min())
+
+    return np.where(normalized_brightness > 0.47, 'bright', np.where(normalized_brightness < 0.42, 'dark', 'none'))
+
+
+def main(args):
+    with open(os.path.join(args.elementary_sounds_folder, args.elementary_sounds_definition_filename)) as f:
+        filepaths = [os.path.join(args.elementary_sounds_folder, sound['filename']) for sound in json.load(f)]
+
+    print("Analysing %d elementary sounds" % len(filepaths))
+
+    samples = []
+    frame_rates = set()
+    for filepath in filepaths:
+        audio_segment = AudioSegment.from_wav(filepath)
+        samples.append(np.array(audio_segment.get_array_of_samples(), dtype=np.float64).reshape(
+            -1, audio_segment.channels).sum(axis=1))
+        frame_rates.add(audio_segment.frame_rate)
+
+    assert len(frame_rates) == 1, "The elementary sounds must have the same frame rate"
+    frame_rate = frame_rates.pop()
+
+    reference_brightness = np.array([timbral_brightness(filepath) for filepath in filepaths])
+    reference_labels = get_brightness_labels(reference_brightness)
+
+    coefficients, correlation = calibrate_brightness_coefficients(samples, frame_rate, reference_brightness)
+
+    for label, label_coefficients in [('timbral_models coefficients', timbral_brightness_coefficients),
+                                      ('Default coefficients', numpy_brightness_coefficients),
+                                      ('Calibrated coefficients', coefficients)]:
+        estimated_brightness = estimate_brightness(samples, frame_rate, label_coefficients)
+
+        print("%s : Max difference %.3f, labels agreement %.2f%%" % (
+            label, np.abs(estimated_brightness - reference_brightness).max(),
+            100 * np.mean(get_brightness_labels(estimated_brightness) == reference_labels)))
+
+    save_brightness_coefficients(args.output_filepath, coefficients, correlation)
+    print("Coefficients %s (Correlation %.5f) written to '%s'" % (coefficients, correlation, args.output_filepath))
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
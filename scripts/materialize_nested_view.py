@@ -0,0 +1,162 @@
+# CLEAR Dataset
+# >> Nested dataset views
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+"""
+The scenes generated with --nested_sets keep their generation order and their set is chosen by a stable hash.
+The version generated with --nb_scene N is therefore the prefix (generation_index < N) of each set of a larger version.
+This script materialise the smaller version from the larger one instead of generating, questioning and rendering it :
+    scenes          The scenes with generation_index < nb_scene are written in the same format
+    questions       The questions about those scenes are kept (question_index is renumbered)
+    audio, images,  Symlinked to the larger version, the files of the kept scenes have the same names.
+    preprocessed    (The features stats of the preprocessed folder are the ones of the larger training set)
+Only the components present in the source version and missing (or empty) in the view are materialised.
+
+Run from the root of the repository : python -m scripts.materialize_nested_view --source_version ... --nb_scene ...
+"""
+
+import os
+import sys
+import json
+import argparse
+from shutil import copy2 as copyfile
+
+from utils.scene_io import Scene_Writer, get_scenes_filepath, iter_scenes, is_compact
+
+
+parser = argparse.ArgumentParser(fromfile_prefix_chars='@')
+parser.add_argument('--output_folder', default='./output',
+                    help='Folder containing the versions')
+parser.add_argument('--source_version', required=True, type=str,
+                    help='Version generated with --nested_sets (Or a question/audio version based on it)')
+parser.add_argument('--output_version_nb', required=True, type=str,
+                    help='Name of the smaller version')
+parser.add_argument('--nb_scene', required=True, type=int,
+                    help='Number of scenes of the smaller version (All sets)')
+parser.add_argument('--set_types', default='train,val,test', type=str,
+                    help='Sets to materialise')
+parser.add_argument('--output_filename_prefix', default='CLEAR', type=str,
+                    help='Prefix of the scenes and questions files')
+
+linked_components = ['audio', 'images', 'preprocessed', 'attributes.json']
+
+
+def is_missing(path):
+    return not os.path.lexists(path) or (os.path.isdir(path) and not os.path.islink(path) and len(os.listdir(path)) == 0)
+
+
+def get_nested_set_sizes(scenes_folder, prefix, set_types, nb_scene):
+    """
+    Number of scenes of each set with a generation_index lower than {nb_scene}
+    """
+    set_sizes = {}
+
+    for set_type in set_types:
+        set_sizes[set_type] = 0
+
+        for scene in iter_scenes(get_scenes_filepath(scenes_folder, prefix, set_type)):
+            if 'generation_index' not in scene:
+                print("[ERROR] The scenes of '%s' were not generated with --nested_sets" % scenes_folder,
+                      file=sys.stderr)
+                exit(1)
+
+            if scene['generation_index'] >= nb_scene:
+                # The scenes of each set are in generation order
+                break
+
+            set_sizes[set_type] += 1
+
+    return set_sizes
+
+
+def write_scenes_view(source_scenes_folder, output_scenes_folder, prefix, set_sizes, output_version_nb):
+    os.makedirs(output_scenes_folder, exist_ok=True)
+
+    for set_type, set_size in set_sizes.items():
+        source_filepath = get_scenes_filepath(source_scenes_folder, prefix, set_type)
+
+        with open(source_filepath, 'r') as f:
+            info = json.loads(f.readline())['info'] if source_filepath.endswith('.jsonl') else json.load(f)['info']
+
+        scene_writer = Scene_Writer(output_scenes_folder, prefix, os.path.splitext(source_filepath)[1][1:],
+                                    scene_format='compact' if is_compact(info) else 'full')
+
+        if is_compact(info):
+            copyfile(os.path.join(source_scenes_folder, info['elementary_sounds']), output_scenes_folder)
+
+        scene_writer.open(set_type, dict(info, version=output_version_nb))
+
+        for scene_count, scene in enumerate(iter_scenes(source_filepath)):
+            if scene_count >= set_size:
+                break
+
+            scene_writer.write(set_type, scene)
+
+        scene_writer.close()
+
+
+def write_questions_view(source_questions_folder, output_questions_folder, prefix, set_sizes, output_version_nb):
+    os.makedirs(output_questions_folder, exist_ok=True)
+
+    for set_type, set_size in set_sizes.items():
+        questions_filename = '%s_%s_questions.json' % (prefix, set_type)
+
+        with open(os.path.join(source_questions_folder, questions_filename), 'r') as f:
+            questions_data = json.load(f)
+
+        questions = [question for question in questions_data['questions'] if int(question['scene_index']) < set_size]
+
+        for question_index, question in enumerate(questions):
+            question['question_index'] = question_index
+
+        with open(os.path.join(output_questions_folder, questions_filename), 'w') as f:
+            json.dump({
+                'info': dict(questions_data['info'], version=output_version_nb),
+                'questions': questions
+            }, f, indent=2)
+
+
+def main(args):
+    source_folder = os.path.join(args.output_folder, args.source_version)
+    output_folder = os.path.join(args.output_folder, args.output_version_nb)
+    set_types = args.set_types.split(',')
+
+    if not os.path.isdir(source_folder):
+        print("[ERROR] The source version '%s' doesn't exist" % source_folder, file=sys.stderr)
+        exit(1)
+
+    os.makedirs(output_folder, exist_ok=True)
+
+    set_sizes = get_nested_set_sizes(os.path.join(source_folder, 'scenes'), args.output_filename_prefix, set_types,
+                                     args.nb_scene)
+
+    print("Nested view '%s' of '%s' : %s" % (args.output_version_nb, args.source_version, set_sizes))
+
+    if is_missing(os.path.join(output_folder, 'scenes')):
+        write_scenes_view(os.path.join(source_folder, 'scenes'), os.path.join(output_folder, 'scenes'),
+                          args.output_filename_prefix, set_sizes, args.output_version_nb)
+
+    source_questions_folder = os.path.join(source_folder, 'questions')
+    if os.path.isdir(source_questions_folder) and is_missing(os.path.join(output_folder, 'questions')):
+        write_questions_view(source_questions_folder, os.path.join(output_folder, 'questions'),
+                             args.output_filename_prefix, set_sizes, args.output_version_nb)
+
+    for component in linked_components:
+        output_path = os.path.join(output_folder, component)
+
+        if os.path.lexists(os.path.join(source_folder, component)) and is_missing(output_path):
+            if os.path.isdir(output_path):
+                # Empty folder created by the preparation script
+                os.rmdir(output_path)
+
+            os.symlink(os.path.join('..', args.source_version, component), output_path)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(args)
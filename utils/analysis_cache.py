@@ -0,0 +1,89 @@
+# CLEAR Dataset
+# >> Elementary sounds analysis cache
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import os
+import json
+from hashlib import blake2b
+
+"""
+    The analysis of the elementary sounds (Duration, loudness, brightness) only depends on the content of the file and
+    on the analysers. The raw values are kept in a JSON file keyed by '{analyser_version}:{content_hash}' :
+        {"entries": {"<analyser_version>:<content_hash>": {"duration": ..., "raw_loudness": ..., ...}}}
+    A sound is analysed again only if its file changed or if the analysers changed (New analyser version).
+    The entries of the other versions are kept, multiple analysers can share the same cache file.
+"""
+
+
+def hash_file_content(filepath, chunk_size=1 << 20):
+    digest = blake2b(digest_size=16)
+
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class Analysis_Cache:
+    """
+    Persistent cache of the elementary sounds analysis
+      - get() return the cached analysis of a file or None
+      - set() add the analysis of a file
+      - save() write the cache if new entries were added (Atomic replace)
+    """
+
+    def __init__(self, filepath, analyser_version):
+        self.filepath = filepath
+        self.analyser_version = analyser_version
+        self.entries = {}
+        self.modified = False
+
+        # Stats
+        self.nb_hits = 0
+        self.nb_misses = 0
+
+        if os.path.isfile(filepath):
+            try:
+                with open(filepath, 'r') as f:
+                    self.entries = json.load(f)['entries']
+            except (ValueError, KeyError):
+                print("[ERROR] Could not read the analysis cache '%s'. It will be rebuilt" % filepath)
+
+    def _get_key(self, content_hash):
+        return '%s:%s' % (self.analyser_version, content_hash)
+
+    def get(self, content_hash):
+        analysis = self.entries.get(self._get_key(content_hash))
+
+        if analysis is None:
+            self.nb_misses += 1
+        else:
+            self.nb_hits += 1
+
+        return analysis
+
+    def set(self, content_hash, analysis):
+        self.entries[self._get_key(content_hash)] = analysis
+        self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+
+        folder = os.path.dirname(self.filepath)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        tmp_filepath = '%s.%d.tmp' % (self.filepath, os.getpid())
+        with open(tmp_filepath, 'w') as f:
+            json.dump({'entries': self.entries}, f, sort_keys=True)
+
+        # Concurrent generations can't read a partially written cache
+        os.replace(tmp_filepath, self.filepath)
+        self.modified = False
@@ -0,0 +1,236 @@
+# CLEAR Dataset
+# >> Batched scene rendering
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.utils import get_min_max_value, get_array_type, db_to_float
+
+
+class Batch_Scene_Renderer:
+    """
+    Render a batch of scenes (render records) in a [B, max_len] float32 matrix
+      - The placement of every elementary sound (scene, sound, sample offset) is computed as arrays
+      - The sounds are copied in the matrix with a single scatter-add (The placements never overlap)
+      - Background noise is added as whole-matrix operations
+      - The length of each scene is tracked, samples past the end of a scene are zeros
+
+    The samples are kept in the integer scale of the elementary sounds (Ex : [-32768, 32767] for 16 bits) so the
+    result is the same as the one produced by pydub in AudioSceneProducer.assembleAudioScene()
+    """
+
+    def __init__(self, sounds_bank):
+        self.sounds_bank = sounds_bank
+
+        self.samples = {}
+        self.silence_lengths = {}
+
+        self.frame_rate = None
+        self.sample_width = None
+
+    def _get_samples(self, filename):
+        if filename not in self.samples:
+            audio_segment = self.sounds_bank[filename]
+
+            if self.frame_rate is None:
+                self.frame_rate = audio_segment.frame_rate
+                self.sample_width = audio_segment.sample_width
+
+            assert audio_segment.frame_rate == self.frame_rate and audio_segment.sample_width == self.sample_width \
+                and audio_segment.channels == 1, "All elementary sounds must be mono with the same format"
+
+            self.samples[filename] = np.frombuffer(audio_segment.raw_data,
+                                                   dtype=get_array_type(8 * self.sample_width)).astype(np.float32)
+
+        return self.samples[filename]
+
+    def get_silence_length(self, duration_ms):
+        """
+        Number of samples of a silence of {duration_ms} ms once appended to the scene.
+        pydub create silences at 11025 Hz and resample them to the frame rate of the scene, the conversion is done
+        by pydub so the lengths are exactly the same
+        """
+        if duration_ms not in self.silence_lengths:
+            silence = AudioSegment.silent(duration=duration_ms)
+
+            assert self.frame_rate >= silence.frame_rate, "The elementary sounds frame rate must be >= %d Hz" % \
+                                                          silence.frame_rate
+
+            self.silence_lengths[duration_ms] = int(silence.set_frame_rate(self.frame_rate).frame_count())
+
+        return self.silence_lengths[duration_ms]
+
+    def compute_placements(self, scenes):
+        """
+        Return the placements of the elementary sounds as arrays :
+            - scene_indexes     Index of the scene in the batch
+            - sound_filenames   Filename of each placed sound
+            - offsets           Position of the first sample of the sound in the scene
+            - lengths           Number of samples of the sound
+        And the length of each scene (in samples)
+        """
+        scene_indexes = []
+        sound_filenames = []
+        for scene_index, scene in enumerate(scenes):
+            scene_indexes += [scene_index] * len(scene['sounds'])
+            sound_filenames += scene['sounds']
+
+        # The sounds must be loaded first, they define the frame rate of the scenes
+        lengths = np.array([len(self._get_samples(filename)) for filename in sound_filenames], dtype=np.int64)
+        scene_indexes = np.array(scene_indexes, dtype=np.int64)
+
+        silences_before = np.array([self.get_silence_length(scene['silence_before']) for scene in scenes],
+                                   dtype=np.int64)
+        silences_after = np.array([self.get_silence_length(silence)
+                                   for scene in scenes for silence in scene['silences_after']], dtype=np.int64)
+
+        # Offset of each sound : Silence before + cumulative length of the previous sounds (and silences) of the scene
+        span_ends = np.cumsum(lengths + silences_after)
+        span_starts = span_ends - lengths - silences_after
+        first_span_of_scene = np.searchsorted(scene_indexes, np.arange(len(scenes)))
+        scene_span_start = np.append(span_starts, 0)[first_span_of_scene]
+        offsets = silences_before[scene_indexes] + span_starts - scene_span_start[scene_indexes]
+
+        scene_lengths = silences_before + np.bincount(scene_indexes, weights=lengths + silences_after,
+                                                      minlength=len(scenes)).astype(np.int64)
+
+        return scene_indexes, sound_filenames, offsets, lengths, scene_lengths
+
+    def assemble(self, scenes, return_placements=False):
+        """
+        Assemble the dry scenes (Without effects)
+        Return the [B, max_len] float32 matrix and the length of each scene
+        If {return_placements}, the placements are also returned (See compute_placements())
+        """
+        placements = self.compute_placements(scenes)
+        scene_indexes, sound_filenames, offsets, lengths, scene_lengths = placements
+
+        max_length = int(scene_lengths.max()) if len(scenes) > 0 else 0
+        batch = np.zeros((len(scenes), max_length), dtype=np.float32)
+
+        if len(sound_filenames) == 0:
+            return (batch, scene_lengths, placements) if return_placements else (batch, scene_lengths)
+
+        # Flat index of the first sample of each placement in the matrix
+        destination_starts = scene_indexes * max_length + offsets
+
+        unique_filenames = sorted(set(sound_filenames))
+        source = np.concatenate([self._get_samples(filename) for filename in unique_filenames])
+        source_offsets = dict(zip(unique_filenames, np.cumsum([0] + [len(self.samples[filename])
+                                                                   for filename in unique_filenames[:-1]])))
+        source_starts = np.array([source_offsets[filename] for filename in sound_filenames], dtype=np.int64)
+
+        # Expand every placement to the index of each of its samples
+        sample_positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        destination = np.repeat(destination_starts, lengths) + sample_positions
+        source = source[np.repeat(source_starts, lengths) + sample_positions]
+
+        # The placements never overlap, a buffered add is equivalent to np.add.at()
+        batch.reshape(-1)[destination] += source
+
+        return (batch, scene_lengths, placements) if return_placements else (batch, scene_lengths)
+
+    def add_background_noise(self, batch, scene_lengths, noise_gains, seeds):
+        """
+        Add white noise to every scene of the batch
+        The noise of each scene is drawn with the seed of the scene, it is the same noise as
+        utils.audio_processing.generate_random_noise() would produce after init_random_seed(seed)
+        Return the batch (Padded if needed) and the new length of each scene
+        """
+        bit_depth = 8 * self.sample_width
+        min_value, max_value = get_min_max_value(bit_depth)
+
+        # Same computations as pydub : The noise can be one sample shorter than the scene and the overlay is
+        # truncated or padded with silence to the closest millisecond
+        noise_lengths = np.array([int(self.frame_rate * (length / self.frame_rate * 1000 / 1000.0))
+                                  for length in scene_lengths], dtype=np.int64)
+        output_lengths = np.array([int(round(1000 * (length / self.frame_rate)) * (self.frame_rate / 1000.0))
+                                   for length in noise_lengths], dtype=np.int64)
+
+        if len(batch) > 0 and output_lengths.max() > batch.shape[1]:
+            batch = np.pad(batch, ((0, 0), (0, output_lengths.max() - batch.shape[1])), 'constant')
+
+        noise = np.zeros(batch.shape, dtype=np.float64)
+        for scene_index, (noise_length, seed) in enumerate(zip(noise_lengths, seeds)):
+            noise[scene_index, :noise_length] = np.random.RandomState(seed).rand(noise_length)
+
+        gains = np.array([db_to_float(gain) for gain in noise_gains], dtype=np.float64)
+
+        noise *= 2
+        noise -= 1.0
+        noise *= max_value * gains[:, None]
+
+        # Truncate to integer samples and add to the scenes (Saturating, as audioop.add())
+        batch += np.trunc(noise).astype(np.float32)
+        np.clip(batch, min_value, max_value, out=batch)
+
+        batch[np.arange(batch.shape[1])[None, :] >= noise_lengths[:, None]] = 0
+
+        return batch, output_lengths
+
+    def from_audio_segments(self, audio_segments):
+        """
+        Stack audio segments in a [B, max_len] float32 matrix
+        Return the matrix and the length of each segment
+        """
+        scene_lengths = np.array([int(audio_segment.frame_count()) for audio_segment in audio_segments],
+                                 dtype=np.int64)
+        batch = np.zeros((len(audio_segments), int(scene_lengths.max()) if len(audio_segments) > 0 else 0),
+                         dtype=np.float32)
+
+        for scene_index, audio_segment in enumerate(audio_segments):
+            batch[scene_index, :scene_lengths[scene_index]] = np.frombuffer(audio_segment.raw_data,
+                                                                            dtype=get_array_type(8 * self.sample_width))
+
+        return batch, scene_lengths
+
+    def to_audio_segment(self, batch, scene_lengths, scene_index):
+        samples = batch[scene_index, :scene_lengths[scene_index]].astype(get_array_type(8 * self.sample_width))
+
+        return AudioSegment(samples.tobytes(), frame_rate=self.frame_rate, sample_width=self.sample_width, channels=1)
+
+
+def batch_specgram(batch, scene_lengths, frame_rate, window_length, window_overlap):
+    """
+    Power spectral density of every scene of the batch
+    Same computation as matplotlib.mlab.specgram() with a hanning window (See AudioSceneProducer.computeSpectrogram())
+    Return a list of (Pxx, freqs, bins), one per scene
+    """
+    step = window_length - window_overlap
+    nb_freqs = window_length // 2 + 1
+
+    # mlab pad the signals shorter than a window
+    padded_lengths = np.maximum(scene_lengths, window_length)
+    if batch.shape[1] < window_length:
+        batch = np.pad(batch, ((0, 0), (0, window_length - batch.shape[1])), 'constant')
+
+    window = np.hanning(window_length)
+
+    # Overlapping frames of every scene [nb_scenes, nb_frames, window_length] as a strided view of the batch
+    nb_batch_frames = (batch.shape[1] - window_length) // step + 1
+    frames = np.lib.stride_tricks.as_strided(batch, shape=(batch.shape[0], nb_batch_frames, window_length),
+                                             strides=(batch.strides[0], step * batch.strides[1], batch.strides[1]),
+                                             writeable=False)
+    spectrum = np.fft.rfft(frames * window, axis=2)
+
+    Pxx = (spectrum.real ** 2 + spectrum.imag ** 2).transpose(0, 2, 1)
+
+    # One sided density : Scale everything except the DC component (and the NFFT/2 component if NFFT is even)
+    Pxx[:, 1:-1 if window_length % 2 == 0 else None] *= 2.
+    Pxx /= frame_rate * (window ** 2).sum()
+
+    freqs = np.arange(nb_freqs) * frame_rate / window_length
+
+    spectrograms = []
+    for scene_index, length in enumerate(padded_lengths):
+        nb_frames = (length - window_length) // step + 1
+        bins = np.arange(window_length / 2, length - window_length / 2 + 1, step) / frame_rate
+
+        spectrograms.append((Pxx[scene_index, :, :nb_frames], freqs, bins))
+
+    return spectrograms
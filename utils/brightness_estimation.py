@@ -0,0 +1,172 @@
+# CLEAR Dataset
+# >> In-memory brightness estimator
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import json
+
+import numpy as np
+
+"""
+    NumPy implementation of the brightness metric of timbral_models (timbral_brightness, version 0.4) working on
+    already decoded samples. The metric is a linear regression over 2 features :
+        - log10 of the ratio of the energy above 2000 Hz over the total energy
+        - log10 of the spectral centroid above 100 Hz
+    Both features are computed from the power spectrogram (Hamming window of 2048 samples, hop of 512 samples, constant
+    detrend) of the sound high-passed at 20 Hz. The features are independent of the sound level.
+
+    timbral_models filter the audio with 2nd order Butterworth high-pass filters (3 times at each crossover). Here the
+    squared magnitude responses of those filters are applied to the power spectrum of each frame, which need only one
+    FFT per frame and can be evaluated for a batch of sounds at once. The approximation differs from the time domain
+    filtering for the low frequencies (Long filter responses compared to the window), the regression coefficients are
+    fitted on reference values with calibrate_brightness_coefficients() (See scripts/calibrate_brightness_estimator.py).
+"""
+
+# Coefficients of the timbral_models regression : [log10(hf_ratio), log10(hf_centroid), 1]
+timbral_brightness_coefficients = (4.613128018020465, 17.378889309312974, 17.434733750553022)
+
+# Coefficients fitted for this estimator on the timbral_models 0.4 brightness of the bundled elementary sounds
+# (Correlation 0.99999, max difference 0.13, same brightness labels)
+numpy_brightness_coefficients = (4.627754273651942, 17.419252780012275, 17.325621016070226)
+
+window_length = 2048
+hop_length = 512
+
+# Maximum number of frames transformed together (Bound the memory used for large batches of sounds)
+max_block_frames = 8192
+
+
+def _highpass_squared_response(frequencies, crossover, frame_rate, nb_filters=3):
+    """
+    Squared magnitude response of {nb_filters} cascaded 2nd order Butterworth high-pass filters (Bilinear transform)
+    """
+    k = np.tan(np.pi * crossover / frame_rate)
+    norm = 1 / (1 + np.sqrt(2) * k + k ** 2)
+    b = np.array([1, -2, 1]) * norm
+    a = np.array([1, 2 * (k ** 2 - 1) * norm, (1 - np.sqrt(2) * k + k ** 2) * norm])
+
+    z = np.exp(-2j * np.pi * frequencies / frame_rate)
+    response = (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+
+    return np.abs(response) ** (2 * nb_filters)
+
+
+def _get_nb_frames(nb_samples):
+    return (nb_samples - window_length) // hop_length + 1 if nb_samples >= window_length else 1
+
+
+def _get_frames(samples):
+    """
+    Detrended & windowed frames of a sound [nb_frames, window_length]
+    Sounds shorter than the window are analysed as a single zero-padded frame
+    """
+    if len(samples) >= window_length:
+        starts = np.arange(0, len(samples) - window_length + 1, hop_length)
+        frames = samples[starts[:, None] + np.arange(window_length)]
+        window = np.hamming(window_length + 1)[:-1]
+    else:
+        frames = samples[None, :]
+        window = np.hamming(len(samples) + 1)[:-1]
+
+    frames = (frames - frames.mean(axis=1, keepdims=True)) * window
+
+    if frames.shape[1] < window_length:
+        frames = np.pad(frames, ((0, 0), (0, window_length - frames.shape[1])), 'constant')
+
+    return frames
+
+
+def _get_block_features(sounds_samples, responses, frequencies):
+    """
+    Brightness features of a block of sounds, the frames of all the sounds are transformed together
+    """
+    frames = [_get_frames(samples) for samples in sounds_samples]
+    nb_frames = [len(sound_frames) for sound_frames in frames]
+
+    power = np.abs(np.fft.rfft(np.concatenate(frames), axis=1)) ** 2
+    power[:, 1:-1] *= 2
+
+    all_power = power * responses['min_freq']
+
+    # Energy of each sound, split by sound after summing the bins
+    sound_starts = np.cumsum([0] + nb_frames[:-1])
+    total_energy = np.add.reduceat(all_power.sum(axis=1), sound_starts)
+
+    ratio_energy = np.add.reduceat(all_power @ responses['ratio'], sound_starts)
+
+    centroid_energy = np.add.reduceat(all_power @ responses['centroid'], sound_starts)
+    centroid_moment = np.add.reduceat(all_power @ (responses['centroid'] * frequencies), sound_starts)
+
+    return np.stack([np.log10(ratio_energy / total_energy), np.log10(centroid_moment / centroid_energy)], axis=1)
+
+
+def get_brightness_features(sounds_samples, frame_rate, ratio_crossover=2000, centroid_crossover=100, min_freq=20):
+    """
+    Brightness features [nb_sounds, 2] (log10 of the high frequency energy ratio and of the high-passed spectral
+    centroid) of a batch of mono sounds ({sounds_samples} : list of 1D arrays of any scale)
+    The sounds are transformed in blocks of at most {max_block_frames} frames (A longer sound is a block by itself)
+    """
+    sounds_samples = [np.asarray(samples, dtype=np.float64) for samples in sounds_samples]
+
+    frequencies = np.fft.rfftfreq(window_length, 1 / frame_rate)
+    responses = {
+        'min_freq': _highpass_squared_response(frequencies, min_freq, frame_rate),
+        'ratio': _highpass_squared_response(frequencies, ratio_crossover, frame_rate),
+        'centroid': _highpass_squared_response(frequencies, centroid_crossover, frame_rate)
+    }
+
+    features = []
+    block = []
+    block_nb_frames = 0
+    for samples in sounds_samples:
+        nb_frames = _get_nb_frames(len(samples))
+
+        if block and block_nb_frames + nb_frames > max_block_frames:
+            features.append(_get_block_features(block, responses, frequencies))
+            block = []
+            block_nb_frames = 0
+
+        block.append(samples)
+        block_nb_frames += nb_frames
+
+    if block:
+        features.append(_get_block_features(block, responses, frequencies))
+
+    return np.concatenate(features) if features else np.zeros((0, 2))
+
+
+def estimate_brightness(sounds_samples, frame_rate, coefficients=numpy_brightness_coefficients):
+    """
+    Brightness of a batch of mono sounds (Same scale as timbral_models.timbral_brightness)
+    """
+    features = get_brightness_features(sounds_samples, frame_rate)
+
+    return features @ np.array(coefficients[:2]) + coefficients[2]
+
+
+def calibrate_brightness_coefficients(sounds_samples, frame_rate, reference_brightness):
+    """
+    Least square fit of the regression coefficients on {reference_brightness} (Ex : timbral_brightness values of the
+    same sounds). Return the coefficients and the correlation between the estimated and reference values
+    """
+    features = get_brightness_features(sounds_samples, frame_rate)
+    design = np.concatenate([features, np.ones((len(features), 1))], axis=1)
+
+    coefficients = np.linalg.lstsq(design, np.asarray(reference_brightness, dtype=np.float64), rcond=None)[0]
+    correlation = np.corrcoef(design @ coefficients, reference_brightness)[0, 1]
+
+    return tuple(float(coefficient) for coefficient in coefficients), float(correlation)
+
+
+def save_brightness_coefficients(filepath, coefficients, correlation=None):
+    with open(filepath, 'w') as f:
+        json.dump({'coefficients': list(coefficients), 'correlation': correlation}, f, indent=2)
+
+
+def load_brightness_coefficients(filepath):
+    with open(filepath, 'r') as f:
+        return tuple(json.load(f)['coefficients'])
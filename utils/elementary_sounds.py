@@ -13,9 +13,13 @@ import numpy as np
 from pydub import AudioSegment
 from collections import defaultdict
 from copy import deepcopy
+from functools import partial
+from multiprocessing import get_context
 
-from timbral_models import timbral_brightness
 from utils.audio_processing import get_perceptual_loudness
+from utils.brightness_estimation import estimate_brightness, numpy_brightness_coefficients
+from utils.sound_catalog import Elementary_Sounds_Catalog
+from utils.analysis_cache import Analysis_Cache, hash_file_content
 
 
 class Elementary_Sounds:
@@ -25,11 +29,37 @@ class Elementary_Sounds:
       - Preprocess the sounds
         - Analyse sounds and add new attributes to the definition
       - Give an interface to retrieve sounds
+      - Columnar catalog of the analysed sounds (See utils/sound_catalog.py)
     """
 
-    def __init__(self, folder_path, definition_filename, save_raw_values=False):
+    catalog_attributes = ['instrument', 'note', 'octave', 'brightness', 'loudness']
+
+    # Must be changed when the analysis (Duration, loudness or brightness) change, the cached values are then ignored
+    analyser_versions = {
+        'timbral': 'duration_ms-bs1770_loudness-timbral_brightness-1',
+        'numpy': 'duration_ms-bs1770_loudness-numpy_brightness-1'
+    }
+
+    def __init__(self, folder_path, definition_filename, save_raw_values=False, attributes_values=None,
+                 analysis_cache_filepath=None, analysis_nb_process=1, brightness_analyser='timbral',
+                 brightness_coefficients=numpy_brightness_coefficients):
         print("Loading Elementary sounds")
         self.folderpath = folder_path
+        self.analysis_nb_process = analysis_nb_process
+
+        # "timbral" reproduce the previous versions, "numpy" estimate the same metric on the decoded samples
+        assert brightness_analyser in self.analyser_versions, "Unknown brightness analyser '%s'" % brightness_analyser
+        self.brightness_analyser = brightness_analyser
+        self.brightness_coefficients = tuple(brightness_coefficients)
+
+        self.analyser_version = self.analyser_versions[brightness_analyser]
+        if brightness_analyser == 'numpy':
+            # The estimated brightness depend on the regression coefficients
+            self.analyser_version += '-' + ','.join('%r' % coefficient for coefficient in self.brightness_coefficients)
+
+        # Raw analysis values of the previous runs (See utils/analysis_cache.py)
+        self.analysis_cache = Analysis_Cache(analysis_cache_filepath, self.analyser_version) \
+            if analysis_cache_filepath else None
 
         with open(os.path.join(self.folderpath, definition_filename)) as file:
             self.definition = json.load(file)
@@ -37,22 +67,21 @@ class Elementary_Sounds:
         self.notes = ['C', 'Db', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B']
 
         self.sorted_durations = []
+        self.nb_samples = []
 
         self.nb_sounds = len(self.definition)
 
         self._preprocess_sounds(save_raw_values)
 
-        self.families_count = {}
+        self.catalog = Elementary_Sounds_Catalog(self.definition, self.catalog_attributes, attributes_values,
+                                                 columns={'nb_samples': self.nb_samples})
 
         self.id_list = [sound['id'] for sound in self.definition]
 
         self.id_list_shuffled = self.id_list.copy()
 
-        for sound in self.definition:
-            if sound['instrument'] not in self.families_count:
-                self.families_count[sound['instrument']] = 1
-            else:
-                self.families_count[sound['instrument']] += 1
+        self.families_count = {family: len(ids) for family, ids in self.catalog.ids_by_value['instrument'].items()
+                               if family is not None and len(ids) > 0}
 
         self.families = self.families_count.keys()
         self.nb_families = len(self.families)
@@ -76,32 +105,34 @@ class Elementary_Sounds:
         Apply some preprocessing on the loaded sounds
           - Calculate the perceptual loudness (ITU-R BS.1770-4 specification) and assign "Loud" or "Quiet" label
           - Calculate perceptual brightness and assign "Bright", "Dark" or None label
+            (timbral_models or its NumPy estimation, see utils/brightness_estimation.py)
           - Retrieve the sound duration
           - Packup the info in the sound dict
+        The raw values are read from the analysis cache when the file was already analysed
+        The labels are assigned once all the sounds are analysed (Normalized by the min & max of the bank)
         """
 
         if shuffle_sounds:
             np.random.shuffle(self.definition)
 
+        analyses = self._get_analyses([os.path.join(self.folderpath, elementary_sound['filename'])
+                                       for elementary_sound in self.definition])
+
         max_brightness = -9999
         min_brightness = 9999
         max_loudness = -9999
         min_loudness = 9999
 
-        for id, elementary_sound in enumerate(self.definition):
-            elementary_sound_filename = os.path.join(self.folderpath, elementary_sound['filename'])
-            elementary_sound_audiosegment = AudioSegment.from_wav(elementary_sound_filename)
-
+        for id, (elementary_sound, analysis) in enumerate(zip(self.definition, analyses)):
             elementary_sound['id'] = id
 
-            elementary_sound['duration'] = int(elementary_sound_audiosegment.duration_seconds * 1000)
-
-            perceptual_loudness = get_perceptual_loudness(elementary_sound_audiosegment)
-            elementary_sound['raw_loudness'] = perceptual_loudness
+            elementary_sound['duration'] = analysis['duration']
+            elementary_sound['raw_loudness'] = analysis['raw_loudness']
 
             self.sorted_durations.append(elementary_sound['duration'])
+            self.nb_samples.append(analysis['nb_samples'])
 
-            elementary_sound['raw_brightness'] = timbral_brightness(elementary_sound_filename)
+            elementary_sound['raw_brightness'] = analysis['raw_brightness']
 
             if min_brightness > elementary_sound['raw_brightness']:
                 min_brightness = elementary_sound['raw_brightness']
@@ -145,24 +176,94 @@ class Elementary_Sounds:
         self.sorted_durations = sorted(self.sorted_durations)
         self.half_longest_durations_mean = np.mean(self.sorted_durations[-int(self.nb_sounds/2):])
 
-    def sounds_to_families_count(self, sound_list):
+        if self.analysis_cache is not None:
+            print("Analysis cache : %d sounds analysed, %d cached" % (self.analysis_cache.nb_misses,
+                                                                      self.analysis_cache.nb_hits))
+            self.analysis_cache.save()
+
+    @staticmethod
+    def analyse_sounds(filepaths, brightness_analyser='timbral', brightness_coefficients=numpy_brightness_coefficients):
         """
-        Return the frequence of each instrument family
+        Raw analysis of elementary sounds : duration (ms), number of samples, loudness and brightness
+        The NumPy brightness of all the sounds is estimated in one batch once they are decoded
+        """
+        audio_segments = [AudioSegment.from_wav(filepath) for filepath in filepaths]
+
+        if brightness_analyser == 'numpy':
+            # Channels summed to mono, the brightness doesn't depend on the scale of the samples
+            sounds_samples = [np.array(audio_segment.get_array_of_samples(), dtype=np.float64).reshape(
+                -1, audio_segment.channels).sum(axis=1) for audio_segment in audio_segments]
+
+            frame_rates = set(audio_segment.frame_rate for audio_segment in audio_segments)
+            assert len(frame_rates) <= 1, "The elementary sounds must have the same frame rate"
+
+            raw_brightness = [float(brightness) for brightness in
+                              estimate_brightness(sounds_samples, audio_segments[0].frame_rate, brightness_coefficients)]
+        else:
+            # timbral_models read and decode the files again
+            from timbral_models import timbral_brightness
+            raw_brightness = [timbral_brightness(filepath) for filepath in filepaths]
+
+        return [{
+            'duration': int(audio_segment.duration_seconds * 1000),
+            'nb_samples': int(audio_segment.frame_count()),
+            'raw_loudness': get_perceptual_loudness(audio_segment),
+            'raw_brightness': brightness
+        } for audio_segment, brightness in zip(audio_segments, raw_brightness)]
+
+    def _get_analyses(self, filepaths):
+        """
+        Raw analysis of each file (Same order as {filepaths})
+        The files missing from the analysis cache are analysed in {analysis_nb_process} processes
+        With the NumPy analyser, each process estimate the brightness of its share of the files in one batch
         """
-        count = {}
+        analyses = [None] * len(filepaths)
 
-        for sound in sound_list:
-            family = sound['instrument']
-            if family in count:
-                count[family] += 1
-            else:
-                count[family] = 1
+        if self.analysis_cache is not None:
+            content_hashes = [hash_file_content(filepath) for filepath in filepaths]
+            analyses = [self.analysis_cache.get(content_hash) for content_hash in content_hashes]
+
+        to_analyse = [index for index, analysis in enumerate(analyses) if analysis is None]
+        to_analyse_filepaths = [filepaths[index] for index in to_analyse]
+
+        analyse_sounds = partial(Elementary_Sounds.analyse_sounds, brightness_analyser=self.brightness_analyser,
+                                 brightness_coefficients=self.brightness_coefficients)
+
+        nb_process = max(min(self.analysis_nb_process, len(to_analyse)), 1)
+        if self.brightness_analyser == 'numpy':
+            # One contiguous chunk of files per process
+            chunk_size = max(-(-len(to_analyse) // nb_process), 1)
+        else:
+            chunk_size = 1
+
+        chunks = [to_analyse_filepaths[start:start + chunk_size] for start in range(0, len(to_analyse), chunk_size)]
+
+        if nb_process > 1:
+            print("Analysing %d elementary sounds in %d processes" % (len(to_analyse), nb_process))
+
+            # The results are returned in the order of the chunks
+            with get_context('fork').Pool(nb_process) as pool:
+                chunks_results = pool.map(analyse_sounds, chunks)
+        else:
+            chunks_results = [analyse_sounds(chunk) for chunk in chunks]
+
+        results = [analysis for chunk_results in chunks_results for analysis in chunk_results]
 
-        non_empty_families = count.keys()
-        non_empty_families_count = len(non_empty_families)
+        for index, analysis in zip(to_analyse, results):
+            analyses[index] = analysis
+
+            if self.analysis_cache is not None:
+                self.analysis_cache.set(content_hashes[index], analysis)
+
+        return analyses
+
+    def sounds_to_families_count(self, sound_list):
+        """
+        Return the frequence of each instrument family
+        """
+        values_count = self.catalog.count_values('instrument', [sound['id'] for sound in sound_list])
+        count = {family: values_count[family] for family in self.families}
 
-        empty_families = set(self.families) - set(non_empty_families)
-        for family in empty_families:
-            count[family] = 0
+        non_empty_families_count = sum(1 for family_count in count.values() if family_count > 0)
 
         return count, non_empty_families_count
@@ -0,0 +1,158 @@
+# CLEAR Dataset
+# >> Preprocessed features & normalisation statistics
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import os
+import json
+from glob import glob
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+"""
+    The preprocessed features are the dB scaled spectrograms (Frequency x Time) standardised per frequency bin with the
+    statistics of the training set, saved as float32 .npy files.
+    While producing the training set, the mean and variance of each frequency bin are accumulated with a streaming
+    (Welford) accumulator. Each worker process has its own accumulator, it is merged in the main process after each
+    task. The training features are written in dB ({name}_db.npy) and standardised once the statistics are known
+    (See standardise_feature_files()). The other sets are standardised with the statistics of the training set when
+    they are written, the training set must be produced first.
+"""
+
+# Suffix of the training features waiting for the statistics of the training set
+unstandardised_suffix = '_db.npy'
+
+
+def spectrogram_to_features(Pxx):
+    # Same dB scaling as the spectrogram images. Empty bins are floored to avoid -inf
+    return (10. * np.log10(np.maximum(Pxx, 1e-20))).astype(np.float32)
+
+
+class Welford_Accumulator:
+    """
+    Streaming mean and variance of each feature
+      - update() accumulate a batch of observations [nb_features, nb_observations]
+      - merge() combine two accumulators (Chan et al. parallel algorithm)
+    """
+
+    def __init__(self, nb_features=None):
+        self.count = 0
+        self.mean = None if nb_features is None else np.zeros(nb_features, dtype=np.float64)
+        self.m2 = None if nb_features is None else np.zeros(nb_features, dtype=np.float64)
+
+    def _combine(self, count, mean, m2):
+        if count == 0:
+            return
+
+        if self.count == 0:
+            self.count, self.mean, self.m2 = count, mean.copy(), m2.copy()
+            return
+
+        assert len(mean) == len(self.mean), "Can't combine statistics of different number of features"
+
+        total = self.count + count
+        delta = mean - self.mean
+
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def update(self, observations):
+        observations = np.asarray(observations, dtype=np.float64)
+
+        count = observations.shape[1]
+        if count == 0:
+            return
+
+        mean = observations.mean(axis=1)
+        m2 = ((observations - mean[:, None]) ** 2).sum(axis=1)
+
+        self._combine(count, mean, m2)
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2)
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count > 0 else None
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance) if self.count > 0 else None
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean.tolist() if self.mean is not None else None,
+            'm2': self.m2.tolist() if self.m2 is not None else None
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        accumulator = cls()
+
+        if state['count'] > 0:
+            accumulator._combine(state['count'], np.array(state['mean']), np.array(state['m2']))
+
+        return accumulator
+
+
+def save_feature_stats(filepath, accumulator, settings=None):
+    stats = {
+        'count': accumulator.count,
+        'mean': accumulator.mean.tolist(),
+        'std': accumulator.std.tolist(),
+        'accumulator': accumulator.to_dict(),
+        'settings': settings
+    }
+
+    with open(filepath, 'w') as f:
+        json.dump(stats, f)
+
+
+def load_feature_stats(filepath):
+    with open(filepath, 'r') as f:
+        stats = json.load(f)
+
+    return np.array(stats['mean'], dtype=np.float32), np.array(stats['std'], dtype=np.float32)
+
+
+def standardise_features(features, stats):
+    """
+    Standardise the {features} per frequency bin with {stats} (mean, std)
+    """
+    mean, std = stats
+
+    return ((features - mean[:, None]) / np.maximum(std[:, None], 1e-8)).astype(np.float32)
+
+
+def _standardise_feature_file(filepath, stats):
+    features = standardise_features(np.load(filepath), stats)
+
+    np.save(filepath[:-len(unstandardised_suffix)] + '.npy', features)
+    os.remove(filepath)
+
+
+def standardise_feature_files(folder, stats, nb_process=1):
+    """
+    Standardise the features of {folder} written in dB ({name}_db.npy) and write them as {name}.npy
+    Return the number of standardised files
+    """
+    filepaths = glob(os.path.join(folder, '*' + unstandardised_suffix))
+
+    with Pool(max(nb_process, 1)) as pool:
+        for _ in pool.imap_unordered(partial(_standardise_feature_file, stats=stats), filepaths, chunksize=64):
+            pass
+
+    return len(filepaths)
+
+
+def get_feature_stats_filepath(preprocessed_folder, output_prefix):
+    # Statistics are always computed on the training set
+    return os.path.join(preprocessed_folder, '%s_train_features_stats.json' % output_prefix)
@@ -15,6 +15,13 @@ from pydub.utils import get_array_type
 import random
 import time
 import json
+import hashlib
+
+try:
+    # Used to pass buffers between the stages of the pipelined production (Python >= 3.8)
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
 
 
 def init_random_seed(seed):
@@ -25,6 +32,18 @@ def init_random_seed(seed):
     np.random.seed(seed)
 
 
+def derive_seed(seed, *keys):
+    """
+    Derive a deterministic seed from a base seed and a list of keys (Ex : scene id, variant index)
+    The derived seed doesn't depend on the process or on PYTHONHASHSEED
+    """
+    seed_str = '_'.join(str(key) for key in (seed,) + keys)
+    digest = hashlib.sha256(seed_str.encode('utf-8')).digest()
+
+    # numpy only accept seeds in the [0, 2**32) range
+    return int.from_bytes(digest[:4], 'little')
+
+
 def save_arguments(args, folder_path, filename):
     """
     Arguments saving
@@ -89,6 +108,63 @@ def float_array_to_pydub_audiosegment(float_array, frame_rate, n_bytes):
                         channels=1)
 
 
+'''
+Shared memory buffers
+'''
+def is_shared_memory_available():
+    return shared_memory is not None
+
+
+def array_to_shared_memory(array):
+    """
+    Copy {array} to a new shared memory block. Return a descriptor that can be sent to other processes.
+    The block must be released by the consumer (See shared_memory_to_array())
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared_array[...] = array
+
+    descriptor = {
+        'name': shm.name,
+        'shape': array.shape,
+        'dtype': array.dtype.str
+    }
+
+    # The block stay alive until it is unlinked
+    del shared_array
+    shm.close()
+
+    return descriptor
+
+
+def shared_memory_to_array(descriptor, unlink=False):
+    """
+    Retrieve a copy of the array stored in shared memory. If {unlink}, the shared memory block is released
+    """
+    shm = shared_memory.SharedMemory(name=descriptor['name'])
+    array = np.ndarray(descriptor['shape'], dtype=np.dtype(descriptor['dtype']), buffer=shm.buf).copy()
+    shm.close()
+
+    if unlink:
+        shm.unlink()
+
+    return array
+
+
+def release_shared_memory(descriptor):
+    """
+    Release the shared memory block of {descriptor} without reading it (Ex : When the consumer failed)
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=descriptor['name'])
+    except FileNotFoundError:
+        # Already released
+        return
+
+    shm.close()
+    shm.unlink()
+
+
 def get_max_scene_length(scenes):
   return np.max([len(scene['objects']) for scene in scenes])
 
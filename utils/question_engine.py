@@ -27,6 +27,7 @@
 
 import math
 import random
+from collections import OrderedDict
 
 # Handlers for answering questions. Each handler receives the scene structure
 # that was output from Blender, the node, and a list of values that were output
@@ -75,12 +76,46 @@ def not_unique_handler(scene_struct, inputs, value_inputs):
     return inputs[0]
 
 
+# Temporal relations. Each relation function return the indexes of the objects related to {object_idx}
+# The relations are computed from the order of the objects when the scenes don't contain materialised relationships
+def before_relation(scene_struct, object_idx):
+    return list(range(0, object_idx))
+
+
+def after_relation(scene_struct, object_idx):
+    return list(range(object_idx + 1, len(scene_struct['objects'])))
+
+
+relation_functions = OrderedDict([
+    ('before', before_relation),
+    ('after', after_relation)
+])
+
+
+def register_relation(relation, relation_function):
+    relation_functions[relation] = relation_function
+
+
+def get_relation_types(scene_struct):
+    if 'relationships' in scene_struct:
+        return [relationship['type'] for relationship in scene_struct['relationships']]
+
+    return list(relation_functions.keys())
+
+
+def get_related_objects(scene_struct, relation, object_idx):
+    if 'relationships' in scene_struct:
+        relation_index = scene_struct['_relationships_indexes'][relation]
+        return scene_struct['relationships'][relation_index]['indexes'][object_idx]
+
+    return relation_functions[relation](scene_struct, object_idx)
+
+
 def relate_handler(scene_struct, inputs, value_inputs):
     assert len(inputs) == 1
     assert len(value_inputs) == 1
     relation = value_inputs[0]
-    relation_index = scene_struct['_relationships_indexes'][relation]
-    return scene_struct['relationships'][relation_index]['indexes'][inputs[0]]
+    return get_related_objects(scene_struct, relation, inputs[0])
 
 
 def union_handler(scene_struct, inputs, value_inputs):
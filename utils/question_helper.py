@@ -27,6 +27,7 @@ from itertools import groupby
 import json
 import numpy as np
 import utils.question_engine as qeng
+from utils.scene_io import load_scenes_file
 
 """
     Helper functions for the Question Generator
@@ -128,12 +129,9 @@ def load_and_prepare_templates(template_dir, metadata):
 
 
 def load_scenes(scene_filepath, start_idx, nb_scenes_to_gen):
-    # Read file containing input scenes
-    with open(scene_filepath, 'r') as f:
-        scene_data = json.load(f)
-        scenes = scene_data['scenes']
-        nb_scenes_loaded = len(scenes)
-        scene_info = scene_data['info']
+    # Read file containing input scenes (json or jsonl)
+    scenes, scene_info = load_scenes_file(scene_filepath)
+    nb_scenes_loaded = len(scenes)
 
     if nb_scenes_to_gen > 0:
         end = start_idx + nb_scenes_to_gen
@@ -187,9 +185,11 @@ def load_and_prepare_metadata(metadata_filepath, scenes):
 
         # Insert reference from relation label (Ex: before, after, ..) to index in scene['relationships']
         # Again for performance. Faster than searching in the dict every time
-        scene['_relationships_indexes'] = {}
-        for i, relation_data in enumerate(scene['relationships']):
-            scene['_relationships_indexes'][relation_data['type']] = i
+        # Scenes without materialised relationships are related on the fly (See question_engine.relation_functions)
+        if 'relationships' in scene:
+            scene['_relationships_indexes'] = {}
+            for i, relation_data in enumerate(scene['relationships']):
+                scene['_relationships_indexes'][relation_data['type']] = i
 
 
     # Limit the position values according to the max scene length
@@ -323,7 +323,9 @@ def find_relate_filter_options(object_idx, scene_struct, attr, can_be_null_attri
     if '_filter_options' not in scene_struct or filter_key not in scene_struct['_filter_options']:
         precompute_filter_options(scene_struct, attr, can_be_null_attributes)
 
-    nb_filters = len(scene_struct['_filter_options'][filter_key].keys()) * len(scene_struct['relationships'])
+    relation_types = qeng.get_relation_types(scene_struct)
+
+    nb_filters = len(scene_struct['_filter_options'][filter_key].keys()) * len(relation_types)
     nb_trivial = int(round(nb_filters * trivial_frac / (1 - trivial_frac)))
 
     # TODO: Right now this is only looking for nontrivial combinations; in some cases I may want to add trivial
@@ -333,9 +335,8 @@ def find_relate_filter_options(object_idx, scene_struct, attr, can_be_null_attri
     non_trivial_options_keys = []
     all_options = {}
 
-    for relationship in scene_struct['relationships']:
-        relationship_index = scene_struct['_relationships_indexes'][relationship['type']]
-        related = set(scene_struct['relationships'][relationship_index]['indexes'][object_idx])
+    for relation in relation_types:
+        related = set(qeng.get_related_objects(scene_struct, relation, object_idx))
         if len(related) == 0:
             # If no relation, the object is the first (No before relations) or the last (No after relations)
             continue
@@ -349,7 +350,7 @@ def find_relate_filter_options(object_idx, scene_struct, attr, can_be_null_attri
             if not include_zero and len(intersection) == 0:
                 continue
 
-            key = (relationship['type'], filters)
+            key = (relation, filters)
             if trivial:
                 trivial_options_keys.append(key)
             else:
@@ -361,9 +362,9 @@ def find_relate_filter_options(object_idx, scene_struct, attr, can_be_null_attri
 
     # NOTE : Looping a second time is really ineficient..
     #        We do it to make sure that we keep the same order in the dict to ensure reproducibility
-    for relationship in scene_struct['relationships']:
+    for relation in relation_types:
         for filters, filtered in scene_struct['_filter_options'][filter_key].items():
-            key = (relationship['type'], filters)
+            key = (relation, filters)
             if key in options_to_keep:
                 options[key] = all_options[key]
 
@@ -0,0 +1,183 @@
+# CLEAR Dataset
+# >> Render Records (Compact scene definitions for the audio producer)
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import os
+import json
+from array import array
+from multiprocessing import Process
+
+import numpy as np
+
+from utils.scene_io import iter_scenes
+
+"""
+    The audio producer doesn't need the whole scene definition (Full sound attributes, relationships, etc)
+    A render record only contains what is needed to produce the scene :
+        - Filename and id of each elementary sound (In order)
+        - Silence before the first sound and silence after each sound (in ms)
+        - Seed used for the random effects
+        - Optionally, the silences snapped to a multiple of the spectrogram hop size (in samples) so the spectrogram of the
+          scene can be composed from the spectrograms of the elementary sounds (See utils/spectrogram_composition.py)
+
+    The records are written to a JSON Lines file (One record per line) alongside an index of the byte offset of each
+    line (The number of records is the length of the index). Processes only read the records they are producing,
+    memory usage is independent of the number of scenes.
+"""
+
+
+# Records written by a previous version (With different fields) are rebuilt
+records_version = 2
+
+
+def snap_silence_to_hop(duration_ms, frame_rate, hop_length):
+    # Closest multiple of {hop_length} samples
+    return int(round(duration_ms * frame_rate / 1000 / hop_length)) * hop_length
+
+
+def scene_to_render_record(scene, scene_id, seed, hop_alignment=None):
+    record = {
+        'id': scene_id,
+        'seed': seed,
+        'silence_before': scene['silence_before'],
+        'sounds': [sound['filename'] for sound in scene['objects']],
+        'sound_ids': [sound['id'] for sound in scene['objects']],
+        'silences_after': [sound['silence_after'] for sound in scene['objects']]
+    }
+
+    if hop_alignment is not None:
+        frame_rate, hop_length = hop_alignment
+        record['aligned_silence_before'] = snap_silence_to_hop(record['silence_before'], frame_rate, hop_length)
+        record['aligned_silences_after'] = [snap_silence_to_hop(silence, frame_rate, hop_length)
+                                            for silence in record['silences_after']]
+
+    return record
+
+
+def get_offsets_filepath(records_filepath):
+    return records_filepath.replace('.jsonl', '_offsets.npy')
+
+
+def _get_source_header(scenes_filepath, seed, hop_alignment=None):
+    scenes_file_stat = os.stat(scenes_filepath)
+
+    return {
+        'version': records_version,
+        'source': os.path.abspath(scenes_filepath),
+        'source_size': scenes_file_stat.st_size,
+        'source_mtime': scenes_file_stat.st_mtime,
+        'seed': seed,
+        'hop_alignment': list(hop_alignment) if hop_alignment is not None else None
+    }
+
+
+def is_render_records_up_to_date(scenes_filepath, records_filepath, seed, hop_alignment=None):
+    offsets_filepath = get_offsets_filepath(records_filepath)
+    if not os.path.isfile(records_filepath) or not os.path.isfile(offsets_filepath):
+        return False
+
+    with open(records_filepath, 'r') as f:
+        header = json.loads(f.readline())
+
+    expected_header = _get_source_header(scenes_filepath, seed, hop_alignment)
+
+    return all(header.get(key) == val for key, val in expected_header.items())
+
+
+def write_render_records(scenes_filepath, records_filepath, seed, hop_alignment=None):
+    """
+    Convert a scenes definition file to render records
+    Should be run in a short lived process (See build_render_records()) so the memory used to parse the
+    scenes definition is released before the worker processes are started
+    """
+    header = _get_source_header(scenes_filepath, seed, hop_alignment)
+
+    # Concurrent producers of the same set write to their own temporary files
+    tmp_records_filepath = '%s.%d.tmp' % (records_filepath, os.getpid())
+
+    # The scenes are streamed, only the offsets are kept in memory (8 bytes per scene)
+    offsets = array('q')
+
+    with open(tmp_records_filepath, 'wb') as f:
+        f.write((json.dumps(header) + '\n').encode('utf-8'))
+
+        for scene_id, scene in enumerate(iter_scenes(scenes_filepath)):
+            offsets.append(f.tell())
+            record = scene_to_render_record(scene, scene_id, seed, hop_alignment)
+            f.write((json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8'))
+
+    offsets_filepath = get_offsets_filepath(records_filepath)
+    tmp_offsets_filepath = '%s.%d.tmp' % (offsets_filepath, os.getpid())
+    with open(tmp_offsets_filepath, 'wb') as f:
+        np.save(f, np.frombuffer(offsets, dtype=np.int64))
+
+    # Records are moved in place only when complete
+    os.replace(tmp_offsets_filepath, offsets_filepath)
+    os.replace(tmp_records_filepath, records_filepath)
+
+
+def build_render_records(scenes_filepath, records_filepath, seed, hop_alignment=None):
+    """
+    {hop_alignment} : (frame_rate, hop_length) used to snap the silences. None to skip the snapping
+    """
+    if is_render_records_up_to_date(scenes_filepath, records_filepath, seed, hop_alignment):
+        print("Render records '%s' are up to date" % records_filepath)
+        return
+
+    print("Building render records '%s'" % records_filepath)
+
+    # Parse the scenes in a child process. The parsed scenes are never part of the parent (and workers) memory
+    process = Process(target=write_render_records, args=(scenes_filepath, records_filepath, seed, hop_alignment))
+    process.start()
+    process.join()
+
+    assert process.exitcode == 0, "Failed to build the render records from '%s'" % scenes_filepath
+
+
+class Render_Records:
+    """
+    Random access reader for the render records
+    The file handle is opened lazily in each process (Safe to use after a fork or when pickled to a spawned process)
+    """
+
+    def __init__(self, records_filepath):
+        self.filepath = records_filepath
+        self.offsets = np.load(get_offsets_filepath(records_filepath), mmap_mode='r')
+
+        self._file = None
+        self._file_pid = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _get_file(self):
+        if self._file is None or self._file_pid != os.getpid():
+            self._file = open(self.filepath, 'rb')
+            self._file_pid = os.getpid()
+
+        return self._file
+
+    def __getitem__(self, index):
+        f = self._get_file()
+        f.seek(int(self.offsets[index]))
+
+        return json.loads(f.readline().decode('utf-8'))
+
+    def __iter__(self):
+        with open(self.filepath, 'rb') as f:
+            # Skip header
+            f.readline()
+            for line in f:
+                yield json.loads(line.decode('utf-8'))
+
+    def __getstate__(self):
+        # File handles and memory maps can't be pickled
+        return {'filepath': self.filepath}
+
+    def __setstate__(self, state):
+        self.__init__(state['filepath'])
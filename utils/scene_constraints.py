@@ -0,0 +1,231 @@
+# CLEAR Dataset
+# >> Declarative scene constraints & vectorised validation
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import numpy as np
+
+"""
+    The attributes of the elementary sounds are int-coded in arrays indexed by the sound id (See build_attribute_table())
+    A batch of candidate scenes is a matrix of sound ids [nb_candidates, max_nb_objects] (Padded with -1) and the
+    number of objects of each candidate. The value counts of an attribute for the whole batch are computed with a
+    single bincount, every constraint is then a boolean reduction over those counts.
+    Single candidates (Python list of ids) are validated with the equivalent checks on Python lists, numpy overhead
+    would dominate for a few objects.
+
+    The constraints are defined declaratively as dicts :
+        {'type': 'total_range', 'attribute': 'duration', 'min': X, 'max': Y}
+            The total of the attribute must be lower than Y (Rejected when min <= total >= max, see _validate_scene())
+        {'type': 'min_nb_values', 'attribute': A, 'min_count': C, 'min_nb': K, 'exclude_none': bool}
+            At least K distinct values of A must appear at least C times in the scene
+        {'type': 'min_ratio', 'attribute': A, 'ratio': R}
+            Every value of A present in the scene (Including None) must represent more than R of the objects
+"""
+
+
+def build_attribute_table(definition, attributes_values, categorical_attributes, numerical_attributes=('duration',)):
+    """
+    Int-code the {categorical_attributes} of the elementary sounds of {definition} (The sound id is the index)
+    The codes of the values listed in {attributes_values} come first, None is always the last code
+    Return a dict with the codes, the decoded values of each attribute and the numerical attributes arrays
+    """
+    table = {
+        'nb_sounds': len(definition),
+        'codes': {},
+        'codes_list': {},
+        'values': {}
+    }
+
+    for attribute in categorical_attributes:
+        values = list(attributes_values.get(attribute, []))
+        for sound in definition:
+            if sound[attribute] is not None and sound[attribute] not in values:
+                values.append(sound[attribute])
+        values.append(None)
+
+        value_to_code = {value: code for code, value in enumerate(values)}
+        codes = [value_to_code[sound[attribute]] for sound in definition]
+        table['codes'][attribute] = np.array(codes, dtype=np.int64)
+        table['codes_list'][attribute] = codes
+        table['values'][attribute] = values
+
+    for attribute in numerical_attributes:
+        table[attribute] = np.array([sound[attribute] for sound in definition], dtype=np.int64)
+        table['%s_list' % attribute] = [sound[attribute] for sound in definition]
+
+    return table
+
+
+def pad_id_lists(id_lists, max_nb_objects):
+    """
+    Stack variable length id lists in a [nb_lists, max_nb_objects] matrix padded with -1
+    """
+    ids = np.full((len(id_lists), max_nb_objects), -1, dtype=np.int64)
+    lengths = np.array([len(id_list) for id_list in id_lists], dtype=np.int64)
+
+    for row, id_list in enumerate(id_lists):
+        ids[row, :len(id_list)] = id_list
+
+    return ids, lengths
+
+
+def draw_candidate_batch(nb_sounds, min_nb_objects, max_nb_objects, batch_size):
+    """
+    Draw {batch_size} candidates at once. Same distribution as the scene by scene draw (Uniform number of objects,
+    then a uniformly random ordered selection of distinct sounds)
+    The sounds of each row are ordered by random keys, the first {nb_objects} are kept
+    """
+    keys = np.random.rand(batch_size, nb_sounds)
+    ids = np.argpartition(keys, max_nb_objects - 1, axis=1)[:, :max_nb_objects] if max_nb_objects < nb_sounds \
+        else np.tile(np.arange(nb_sounds), (batch_size, 1))
+    rows = np.arange(batch_size)[:, None]
+    ids = ids[rows, np.argsort(keys[rows, ids], axis=1)]
+
+    lengths = np.random.randint(min_nb_objects, max_nb_objects + 1, size=batch_size)
+    ids[np.arange(max_nb_objects)[None, :] >= lengths[:, None]] = -1
+
+    return ids, lengths
+
+
+class Scene_Validator:
+    """
+    Compile a list of declarative constraints into vectorised checks over batches of candidates
+      - validate() return a boolean mask of the valid candidates
+      - validate_id_list() validate a single candidate
+      - rejections count the candidates rejected by each constraint (First failing constraint, in definition order)
+    """
+
+    def __init__(self, attribute_table, constraints):
+        self.attribute_table = attribute_table
+        self.constraints = constraints
+
+        self.checks = [self._compile(constraint) for constraint in constraints]
+        self.scalar_checks = [self._compile_scalar(constraint) for constraint in constraints]
+
+        self.rejections = {self.get_constraint_name(constraint): 0 for constraint in constraints}
+
+    @staticmethod
+    def get_constraint_name(constraint):
+        return constraint.get('name', '%s_%s' % (constraint['type'], constraint['attribute']))
+
+    def _compile(self, constraint):
+        attribute = constraint['attribute']
+        constraint_type = constraint['type']
+
+        if constraint_type == 'total_range':
+            def check(batch):
+                total = batch.get_total(attribute)
+                return ~((constraint['min'] <= total) & (total >= constraint['max']))
+
+        elif constraint_type == 'min_nb_values':
+            def check(batch):
+                counts = batch.get_counts(attribute)
+                if constraint.get('exclude_none', False):
+                    counts = counts[:, :-1]
+                return (counts >= constraint['min_count']).sum(axis=1) >= constraint['min_nb']
+
+        elif constraint_type == 'min_ratio':
+            def check(batch):
+                counts = batch.get_counts(attribute)
+                ratios = counts / batch.lengths[:, None]
+                return ~((counts > 0) & (ratios <= constraint['ratio'])).any(axis=1)
+
+        else:
+            raise ValueError("Unknown constraint type '%s'" % constraint_type)
+
+        return check
+
+    def _compile_scalar(self, constraint):
+        attribute = constraint['attribute']
+        constraint_type = constraint['type']
+
+        if constraint_type == 'total_range':
+            values = self.attribute_table['%s_list' % attribute]
+
+            def check(id_list, get_counts):
+                total = sum(values[sound_id] for sound_id in id_list)
+                return not (constraint['min'] <= total >= constraint['max'])
+
+        elif constraint_type == 'min_nb_values':
+            def check(id_list, get_counts):
+                counts = get_counts(attribute)
+                if constraint.get('exclude_none', False):
+                    counts = counts[:-1]
+                return sum(1 for count in counts if count >= constraint['min_count']) >= constraint['min_nb']
+
+        elif constraint_type == 'min_ratio':
+            def check(id_list, get_counts):
+                nb_objects = len(id_list)
+                return all(count == 0 or count / nb_objects > constraint['ratio'] for count in get_counts(attribute))
+
+        else:
+            raise ValueError("Unknown constraint type '%s'" % constraint_type)
+
+        return check
+
+    def validate(self, ids, lengths):
+        batch = _Candidate_Batch(self.attribute_table, ids, lengths)
+        valid = np.ones(len(lengths), dtype=bool)
+
+        for constraint, check in zip(self.constraints, self.checks):
+            passed = check(batch)
+            self.rejections[self.get_constraint_name(constraint)] += int((valid & ~passed).sum())
+            valid &= passed
+
+        return valid
+
+    def validate_id_list(self, id_list):
+        counts = {}
+
+        def get_counts(attribute):
+            if attribute not in counts:
+                codes = self.attribute_table['codes_list'][attribute]
+                attribute_counts = [0] * len(self.attribute_table['values'][attribute])
+                for sound_id in id_list:
+                    attribute_counts[codes[sound_id]] += 1
+                counts[attribute] = attribute_counts
+
+            return counts[attribute]
+
+        for constraint, check in zip(self.constraints, self.scalar_checks):
+            if not check(id_list, get_counts):
+                self.rejections[self.get_constraint_name(constraint)] += 1
+                return False
+
+        return True
+
+
+class _Candidate_Batch:
+    """
+    Lazily computed per attribute reductions of a batch of candidates
+    """
+
+    def __init__(self, attribute_table, ids, lengths):
+        self.attribute_table = attribute_table
+        self.lengths = lengths
+        self.nb_candidates = len(lengths)
+
+        self.mask = ids >= 0
+        self.rows = np.broadcast_to(np.arange(self.nb_candidates)[:, None], ids.shape)[self.mask]
+        self.ids = ids[self.mask]
+
+        self.counts = {}
+
+    def get_counts(self, attribute):
+        """
+        Number of occurrences of each value of {attribute} in each candidate [nb_candidates, nb_values]
+        """
+        if attribute not in self.counts:
+            nb_values = len(self.attribute_table['values'][attribute])
+            codes = self.attribute_table['codes'][attribute][self.ids]
+            counts = np.bincount(self.rows * nb_values + codes, minlength=self.nb_candidates * nb_values)
+            self.counts[attribute] = counts.reshape(self.nb_candidates, nb_values)
+
+        return self.counts[attribute]
+
+    def get_total(self, attribute):
+        return np.bincount(self.rows, weights=self.attribute_table[attribute][self.ids], minlength=self.nb_candidates)
@@ -0,0 +1,72 @@
+# CLEAR Dataset
+# >> Scene events & stems references
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import os
+import json
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.utils import get_array_type
+
+"""
+    Events table of a scene : Onset and offset (in samples) of each elementary sound as placed by the audio producer
+        sound_id    Id of the elementary sound, same as the "id" of the scene objects (Index in the analysed
+                    elementary sounds definition written beside the compact scenes)
+        filename    Filename of the elementary sound
+    The events are also the references of the stems (Isolated track of each sound) : the elementary sounds are placed
+    without gain, a stem is the elementary sound at the onset of its event. The stems are materialised on demand with
+    materialize_stem() instead of being stored as dense audio.
+    The stems are dry, the effects applied to the scene (Background noise, reverberation) are not part of the stems.
+"""
+
+
+def get_scene_events(scene_id, frame_rate, scene_length, sound_ids, filenames, onsets, lengths):
+    return {
+        # Same key as the scenes and questions files
+        'scene_index': scene_id,
+        'frame_rate': frame_rate,
+        'length': int(scene_length),
+        'events': [{
+            'sound_id': sound_id,
+            'filename': filename,
+            'onset': int(onset),
+            'offset': int(onset + length)
+        } for sound_id, filename, onset, length in zip(sound_ids, filenames, onsets, lengths)]
+    }
+
+
+def write_scene_events(filepath, events):
+    with open(filepath, 'w') as f:
+        json.dump(events, f, indent=2)
+
+
+def load_scene_events(filepath):
+    with open(filepath, 'r') as f:
+        return json.load(f)
+
+
+def materialize_stem(events, event_index, elementary_sounds_folder):
+    """
+    Dense audio (numpy array of the length of the scene) of the stem of the event {event_index}
+    The elementary sound is read from {elementary_sounds_folder} using the filename of the event (No elementary sounds
+    definition is needed)
+    """
+    event = events['events'][event_index]
+
+    audio_segment = AudioSegment.from_wav(os.path.join(elementary_sounds_folder, event['filename']))
+    if audio_segment.frame_rate != events['frame_rate']:
+        audio_segment = audio_segment.set_frame_rate(events['frame_rate'])
+
+    samples = np.frombuffer(audio_segment.raw_data, dtype=get_array_type(8 * audio_segment.sample_width))
+
+    dense = np.zeros(events['length'], dtype=np.float32)
+    end = min(event['onset'] + len(samples), events['length'])
+    dense[event['onset']:end] = samples[:end - event['onset']]
+
+    return dense
@@ -0,0 +1,109 @@
+# CLEAR Dataset
+# >> Compact duplicate scenes detection
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+from hashlib import blake2b
+
+import numpy as np
+
+"""
+    A scene is identified by the ordered list of its elementary sound ids. Instead of keeping a string per candidate,
+    the accepted scenes are stored as 64 bits hashes in an open addressing table (numpy uint64 array, linear probing).
+    The memory grows with the number of accepted scenes only (16 bytes per scene at most).
+
+    Two different scenes with the same hash are considered duplicates (Probability ~ n^2 / 2^65, negligible for
+    millions of scenes), the second one is simply discarded. With exact=True, the packed id lists are also kept to
+    resolve those collisions.
+"""
+
+
+def hash_id_list(id_list):
+    digest = blake2b(np.asarray(id_list, dtype=np.int32).tobytes(), digest_size=8).digest()
+
+    # 0 marks the empty slots of the table
+    return int.from_bytes(digest, 'little') or 1
+
+
+class Scene_Hash_Set:
+    """
+    Set of scenes (Ordered id lists)
+      - add() return False if the scene was already in the set
+      - The table is doubled when it is half full
+    """
+
+    def __init__(self, initial_capacity=1024, exact=False):
+        self.table = np.zeros(initial_capacity, dtype=np.uint64)
+        self.mask = initial_capacity - 1
+        self.nb_items = 0
+
+        assert initial_capacity & self.mask == 0, "The capacity must be a power of 2"
+
+        # Packed id lists by hash (Only when exact=True)
+        self.packed_id_lists = {} if exact else None
+
+    def __len__(self):
+        return self.nb_items
+
+    def _find_slot(self, scene_hash):
+        """
+        Index of the slot containing {scene_hash} or of the empty slot where it should be inserted
+        """
+        table = self.table
+        index = scene_hash & self.mask
+
+        # Compared as Python ints, older numpy versions compare uint64 and large ints as floats
+        slot = int(table[index])
+        while slot != 0 and slot != scene_hash:
+            index = (index + 1) & self.mask
+            slot = int(table[index])
+
+        return index
+
+    def _is_same_scene(self, scene_hash, id_list):
+        if self.packed_id_lists is None:
+            return True
+
+        return np.asarray(id_list, dtype=np.int32).tobytes() in self.packed_id_lists[scene_hash]
+
+    def __contains__(self, id_list):
+        scene_hash = hash_id_list(id_list)
+
+        return self.table[self._find_slot(scene_hash)] != 0 and self._is_same_scene(scene_hash, id_list)
+
+    def add(self, id_list):
+        scene_hash = hash_id_list(id_list)
+        index = self._find_slot(scene_hash)
+
+        if self.table[index] != 0:
+            if self._is_same_scene(scene_hash, id_list):
+                return False
+
+            # Collision, the hash is already in the table
+            self.packed_id_lists[scene_hash].add(np.asarray(id_list, dtype=np.int32).tobytes())
+            self.nb_items += 1
+            return True
+
+        self.table[index] = scene_hash
+        self.nb_items += 1
+
+        if self.packed_id_lists is not None:
+            self.packed_id_lists[scene_hash] = {np.asarray(id_list, dtype=np.int32).tobytes()}
+
+        if 2 * self.nb_items > len(self.table):
+            self._grow()
+
+        return True
+
+    def _grow(self):
+        hashes = self.table[self.table != 0]
+
+        self.table = np.zeros(2 * len(self.table), dtype=np.uint64)
+        self.mask = len(self.table) - 1
+
+        for scene_hash in hashes.tolist():
+            self.table[self._find_slot(scene_hash)] = scene_hash
@@ -0,0 +1,277 @@
+# CLEAR Dataset
+# >> Scenes definition files (Streaming writer & readers)
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import os
+import json
+
+"""
+    The scenes of each set are written to their file as soon as they are generated (See Scene_Writer)
+    Formats :
+        json    Same layout as json.dump(..., indent=2, sort_keys=True) : {"info": {...}, "scenes": [...]}
+                With compact=True, no indentation and no spaces after the separators
+        jsonl   First line is {"info": {...}}, then one scene per line. Can be read while it is being written
+
+    Scenes format :
+        full    Each object embed the whole elementary sound definition. The relationships are materialised unless
+                the scenes were generated with --omit_relationships
+        compact Each scene only reference the elementary sounds by id :
+                    {"scene_index", "scene_filename", "silence_before", "sound_ids", "silences_after"}
+                The "generation_index" of the nested sets is kept (See --nested_sets)
+                The analysed elementary sounds definition is written once per version beside the scenes files
+                (See write_elementary_sounds_table()) and referenced in the info section.
+                The readers expand the compact scenes to the full format on access
+"""
+
+compact_separators = (',', ':')
+
+
+def get_elementary_sounds_table_filename(prefix):
+    return '%s_elementary_sounds.json' % prefix
+
+
+def write_elementary_sounds_table(scenes_folder, prefix, definition):
+    """
+    Write the analysed elementary sounds definition (The sound id is the index in the list)
+    """
+    with open(os.path.join(scenes_folder, get_elementary_sounds_table_filename(prefix)), 'w') as f:
+        json.dump(definition, f, separators=compact_separators, sort_keys=True)
+
+
+def load_elementary_sounds_table(scenes_filepath, info):
+    with open(os.path.join(os.path.dirname(scenes_filepath), info['elementary_sounds']), 'r') as f:
+        return json.load(f)
+
+
+def is_compact(info):
+    return info.get('scene_format', 'full') == 'compact'
+
+
+def get_before_after_relationships(nb_objects):
+    """
+    For each object, the indexes of the objects before and after it
+    """
+    # NOTE : The question engine can compute the relations from the objects order (See question_engine.relation_functions)
+    relationships = [
+        {
+            'type': 'before',
+            'indexes': [
+                []
+            ]
+        },
+        {
+            'type': 'after',
+            'indexes': []
+        }
+    ]
+
+    scene_indexes = list(range(0, nb_objects))
+
+    for i in range(0, nb_objects):
+        if i - 1 >= 0:
+            relationships[0]['indexes'].append(relationships[0]['indexes'][i - 1] + [i - 1])
+
+        scene_indexes.remove(i)
+        relationships[1]['indexes'].append(list(scene_indexes))
+
+    return relationships
+
+
+def to_compact_scene(scene):
+    compact_scene = {
+        'scene_index': scene['scene_index'],
+        'scene_filename': scene['scene_filename'],
+        'silence_before': scene['silence_before'],
+        'sound_ids': [scene_object['id'] for scene_object in scene['objects']],
+        'silences_after': [scene_object['silence_after'] for scene_object in scene['objects']]
+    }
+
+    if 'generation_index' in scene:
+        compact_scene['generation_index'] = scene['generation_index']
+
+    return compact_scene
+
+
+def expand_compact_scene(compact_scene, elementary_sounds_table):
+    """
+    Full format scene (Same dict as the one written by the generator with --omit_relationships)
+    """
+    objects = []
+    for sound_id, silence_after in zip(compact_scene['sound_ids'], compact_scene['silences_after']):
+        scene_object = dict(elementary_sounds_table[sound_id])
+        scene_object['silence_after'] = silence_after
+        objects.append(scene_object)
+
+    # The before/after relationships are not materialised, the question engine compute them from the objects order
+    scene = {
+        'scene_index': compact_scene['scene_index'],
+        'scene_filename': compact_scene['scene_filename'],
+        'silence_before': compact_scene['silence_before'],
+        'objects': objects
+    }
+
+    if 'generation_index' in compact_scene:
+        scene['generation_index'] = compact_scene['generation_index']
+
+    return scene
+
+
+class Compact_Scenes:
+    """
+    List of compact scenes, expanded to the full format the first time they are accessed
+    The expanded scenes are kept (The question generation annotate the scenes in place)
+    """
+
+    def __init__(self, compact_scenes, elementary_sounds_table):
+        self.compact_scenes = compact_scenes
+        self.elementary_sounds_table = elementary_sounds_table
+        self.expanded = [None] * len(compact_scenes)
+
+    def __len__(self):
+        return len(self.compact_scenes)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return Compact_Scenes(self.compact_scenes[item], self.elementary_sounds_table)
+
+        if self.expanded[item] is None:
+            self.expanded[item] = expand_compact_scene(self.compact_scenes[item], self.elementary_sounds_table)
+
+        return self.expanded[item]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def get_scenes_filepath(scenes_folder, prefix, set_type):
+    """
+    Path of the scenes definition file of {set_type}. The JSONL file is used if it exists
+    """
+    filepath = os.path.join(scenes_folder, '%s_%s_scenes' % (prefix, set_type))
+
+    return filepath + '.jsonl' if os.path.isfile(filepath + '.jsonl') else filepath + '.json'
+
+
+def iter_scenes(filepath):
+    """
+    Iterate over the scenes of a scenes definition file (json or jsonl)
+    The jsonl files are read line by line. The compact scenes are expanded to the full format
+    """
+    if filepath.endswith('.jsonl'):
+        with open(filepath, 'r') as f:
+            info = json.loads(f.readline())['info']
+            elementary_sounds_table = load_elementary_sounds_table(filepath, info) if is_compact(info) else None
+
+            for line in f:
+                if line.strip():
+                    scene = json.loads(line)
+                    yield expand_compact_scene(scene, elementary_sounds_table) if elementary_sounds_table is not None \
+                        else scene
+    else:
+        scenes, info = load_scenes_file(filepath)
+        yield from scenes
+
+
+def load_scenes_file(filepath):
+    """
+    Load a scenes definition file (json or jsonl)
+    Return the list of scenes and the info section
+    The compact scenes are returned as a Compact_Scenes list, expanded to the full format on access
+    """
+    if filepath.endswith('.jsonl'):
+        with open(filepath, 'r') as f:
+            info = json.loads(f.readline())['info']
+            scenes = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(filepath, 'r') as f:
+            scene_data = json.load(f)
+
+        scenes, info = scene_data['scenes'], scene_data['info']
+
+    if is_compact(info):
+        scenes = Compact_Scenes(scenes, load_elementary_sounds_table(filepath, info))
+
+    return scenes, info
+
+
+class Scene_Writer:
+    """
+    Write the scenes of each set to their own file as they are generated
+      - open() create the file of a set and write its info section
+      - write() append a scene (Full format) to the file of its set
+      - close() terminate the files
+    """
+
+    def __init__(self, scenes_folder, prefix, output_format='json', compact=False, scene_format='full'):
+        assert output_format in ['json', 'jsonl'], "Unknown scenes file format '%s'" % output_format
+        assert scene_format in ['full', 'compact'], "Unknown scene format '%s'" % scene_format
+
+        self.scenes_folder = scenes_folder
+        self.prefix = prefix
+        self.output_format = output_format
+        self.compact = compact
+        self.scene_format = scene_format
+
+        self.files = {}
+        self.nb_written = {}
+
+    def get_filepath(self, set_type):
+        return os.path.join(self.scenes_folder, '%s_%s_scenes.%s' % (self.prefix, set_type, self.output_format))
+
+    def _dumps(self, obj, indent_level=0):
+        if self.compact or self.output_format == 'jsonl':
+            return json.dumps(obj, separators=compact_separators, sort_keys=True)
+
+        # Indent every line except the first one, the object is nested at {indent_level}
+        lines = json.dumps(obj, indent=2, sort_keys=True).split('\n')
+        return '\n'.join(lines[:1] + [' ' * indent_level + line for line in lines[1:]])
+
+    def open(self, set_type, info):
+        f = open(self.get_filepath(set_type), 'w')
+
+        if self.scene_format == 'compact':
+            info = dict(info, scene_format='compact',
+                        elementary_sounds=get_elementary_sounds_table_filename(self.prefix))
+
+        if self.output_format == 'jsonl':
+            f.write(self._dumps({'info': info}) + '\n')
+        elif self.compact:
+            f.write('{"info":%s,"scenes":[' % self._dumps(info))
+        else:
+            f.write('{\n  "info": %s,\n  "scenes": [' % self._dumps(info, 2))
+
+        self.files[set_type] = f
+        self.nb_written[set_type] = 0
+
+    def write(self, set_type, scene):
+        f = self.files[set_type]
+
+        if self.scene_format == 'compact':
+            scene = to_compact_scene(scene)
+
+        if self.output_format == 'jsonl':
+            f.write(self._dumps(scene) + '\n')
+        elif self.compact:
+            f.write((',' if self.nb_written[set_type] > 0 else '') + self._dumps(scene))
+        else:
+            f.write((',' if self.nb_written[set_type] > 0 else '') + '\n    ' + self._dumps(scene, 4))
+
+        self.nb_written[set_type] += 1
+
+    def close(self):
+        for set_type, f in self.files.items():
+            if self.output_format == 'json':
+                if self.compact:
+                    f.write(']}')
+                else:
+                    f.write('\n  ]\n}' if self.nb_written[set_type] > 0 else ']\n}')
+
+            f.close()
+
+        self.files = {}
@@ -0,0 +1,168 @@
+# CLEAR Dataset
+# >> Constructive scene sampler
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+from math import factorial
+
+import numpy as np
+
+"""
+    The rejection sampler of the Scene_generator draw a scene length n uniformly, then an ordered list of n distinct
+    elementary sounds uniformly and discard it if it doesn't satisfy the constraints.
+    The accepted scenes are therefore uniformly distributed over the valid ordered lists, weighted by 1/C(N, n)
+    (N : Number of elementary sounds).
+
+    The constructive sampler produce the same distribution without drawing the lists that violate the family
+    constraints (min_nb_families & min_objects_per_family) :
+        - The number of sound sets satisfying the family constraints is counted by dynamic programming over the
+          families. The number of ways to pick c sounds in a family of size S is C(S, c).
+        - n is drawn proportionally to P(family constraints satisfied | n), the count of each family is drawn
+          backward from the dynamic programming table and the sounds are drawn uniformly within each family.
+        - The sounds are shuffled to get a uniform order.
+    The other constraints (attributes distribution, duration) are verified on the constructed list. When they fail,
+    the whole draw is restarted (Including n) which keep the distribution exact.
+"""
+
+
+def comb(n, k):
+    """
+    Number of ways to choose {k} items among {n} (math.comb is only available from Python 3.8)
+    """
+    if k < 0 or k > n:
+        return 0
+
+    return factorial(n) // (factorial(k) * factorial(n - k))
+
+
+class Constructive_Scene_Sampler:
+
+    def __init__(self, elementary_sounds, min_nb_objects, max_nb_objects, min_nb_families, min_objects_per_family,
+                 min_nb_families_subject_to_min_objects_per_family):
+        self.min_nb_objects = min_nb_objects
+        self.max_nb_objects = max_nb_objects
+        self.min_objects_per_family = min_objects_per_family
+
+        # The number of non empty families and of families meeting the min_objects_per_family constraint are capped
+        # to the required number. Once the requirement is met, the exact number doesn't matter
+        self.nb_non_empty_cap = min_nb_families
+        self.nb_big_cap = min_nb_families_subject_to_min_objects_per_family
+
+        families = sorted(elementary_sounds.families)
+        self.family_ids = [elementary_sounds.catalog.get_ids(instrument=family) for family in families]
+        self.family_sizes = [len(ids) for ids in self.family_ids]
+        self.nb_sounds = sum(self.family_sizes)
+
+        self._build_table()
+
+        # Probability that a scene of length n satisfy the family constraints (Uniform set of n sounds)
+        self.family_valid_probabilities = np.array([
+            self.table[-1][n][self.nb_non_empty_cap][self.nb_big_cap] / comb(self.nb_sounds, n)
+            for n in range(min_nb_objects, max_nb_objects + 1)])
+
+        if self.family_valid_probabilities.sum() == 0:
+            raise ValueError("No scene of %d to %d objects can satisfy the families constraints" % (min_nb_objects,
+                                                                                                   max_nb_objects))
+
+        self.length_probabilities = self.family_valid_probabilities / self.family_valid_probabilities.sum()
+
+        # Probability that a candidate of the rejection sampler satisfy the family constraints
+        # The rejection sampler would draw 1/family_valid_ratio more candidates for the same number of scenes
+        self.family_valid_ratio = self.family_valid_probabilities.mean()
+
+        # Stats
+        self.nb_drawn = 0
+
+    def _cap_state(self, nb_non_empty, nb_big):
+        return min(nb_non_empty, self.nb_non_empty_cap), min(nb_big, self.nb_big_cap)
+
+    def _build_table(self):
+        """
+        table[f][t][non_empty][big] : Number of ways to choose t sounds among the f first families
+        (Exact integers)
+        """
+        max_nb = self.max_nb_objects
+
+        empty_table = lambda: [[[0] * (self.nb_big_cap + 1) for _ in range(self.nb_non_empty_cap + 1)]
+                               for _ in range(max_nb + 1)]
+
+        table = [empty_table()]
+        table[0][0][0][0] = 1
+
+        for family_size in self.family_sizes:
+            previous = table[-1]
+            current = empty_table()
+
+            for t in range(max_nb + 1):
+                for non_empty in range(self.nb_non_empty_cap + 1):
+                    for big in range(self.nb_big_cap + 1):
+                        weight = previous[t][non_empty][big]
+                        if weight == 0:
+                            continue
+
+                        for count in range(min(family_size, max_nb - t) + 1):
+                            new_non_empty, new_big = self._cap_state(non_empty + (count > 0),
+                                                                     big + (count >= self.min_objects_per_family))
+                            current[t + count][new_non_empty][new_big] += weight * comb(family_size, count)
+
+            table.append(current)
+
+        self.table = table
+
+    def _draw_family_counts(self, nb_objects):
+        """
+        Draw the number of sounds of each family, proportionally to the number of sound sets with those counts
+        """
+        counts = [0] * len(self.family_sizes)
+        state = (nb_objects, self.nb_non_empty_cap, self.nb_big_cap)
+
+        for family_index in reversed(range(len(self.family_sizes))):
+            family_size = self.family_sizes[family_index]
+            previous = self.table[family_index]
+            t, non_empty, big = state
+
+            # Every previous state that lead to the current state
+            candidates = []
+            weights = []
+            for count in range(min(family_size, t) + 1):
+                for previous_non_empty in range(self.nb_non_empty_cap + 1):
+                    for previous_big in range(self.nb_big_cap + 1):
+                        reached = self._cap_state(previous_non_empty + (count > 0),
+                                                  previous_big + (count >= self.min_objects_per_family))
+
+                        if reached != (non_empty, big):
+                            continue
+
+                        weight = previous[t - count][previous_non_empty][previous_big] * comb(family_size, count)
+                        if weight > 0:
+                            candidates.append((count, previous_non_empty, previous_big))
+                            weights.append(weight)
+
+            total = sum(weights)
+            chosen = candidates[np.random.choice(len(candidates), p=[weight / total for weight in weights])]
+
+            counts[family_index] = chosen[0]
+            state = (t - chosen[0], chosen[1], chosen[2])
+
+        return counts
+
+    def sample_id_list(self):
+        """
+        Ordered list of elementary sound ids satisfying the family constraints
+        """
+        nb_objects = self.min_nb_objects + np.random.choice(len(self.length_probabilities),
+                                                            p=self.length_probabilities)
+
+        counts = self._draw_family_counts(nb_objects)
+
+        id_list = np.concatenate([np.random.choice(ids, count, replace=False)
+                                  for ids, count in zip(self.family_ids, counts) if count > 0])
+        np.random.shuffle(id_list)
+
+        self.nb_drawn += 1
+
+        return [int(sound_id) for sound_id in id_list]
@@ -0,0 +1,98 @@
+# CLEAR Dataset
+# >> Elementary Sounds Bank (Lazy audio loading)
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import os
+from collections import OrderedDict
+
+from pydub import AudioSegment
+
+
+class Elementary_Sounds_Bank:
+    """
+    Lazy loader for the elementary sounds audio used by the audio producer
+      - Sounds are decoded only when requested (Or preloaded for the sounds referenced by the scenes to produce)
+      - Decoded sounds are kept in a LRU cache bounded by {max_cached_sounds} (0 means no limit)
+      - Memory usage scale with the working set of the scenes instead of the size of the bank
+      - The sounds are looked up in the elementary sounds catalog (See utils/sound_catalog.py)
+    """
+
+    def __init__(self, folder_path, catalog, frame_rate=None, max_cached_sounds=0):
+        self.folderpath = folder_path
+        self.frame_rate = frame_rate
+        self.max_cached_sounds = max_cached_sounds
+
+        self.catalog = catalog
+
+        self.cache = OrderedDict()
+
+        # Stats
+        self.nb_decoded = 0
+        self.nb_evicted = 0
+
+    def __contains__(self, filename):
+        return filename in self.catalog.ids_by_filename
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def get_filenames(self):
+        return list(self.catalog.ids_by_filename)
+
+    def set_frame_rate(self, frame_rate):
+        # The cached sounds were decoded at the previous frame rate
+        self.frame_rate = frame_rate
+        self.cache.clear()
+
+    def _load(self, filename):
+        # Creating the audio segment (Suppose WAV format)
+        audio_segment = AudioSegment.from_wav(os.path.join(self.folderpath, filename))
+
+        if self.frame_rate and audio_segment.frame_rate != self.frame_rate:
+            audio_segment = audio_segment.set_frame_rate(self.frame_rate)
+
+        self.nb_decoded += 1
+
+        return audio_segment
+
+    def get(self, filename):
+        if filename in self.cache:
+            # Mark as most recently used
+            self.cache.move_to_end(filename)
+            return self.cache[filename]
+
+        if filename not in self:
+            raise KeyError(filename)
+
+        audio_segment = self._load(filename)
+        self.cache[filename] = audio_segment
+
+        if 0 < self.max_cached_sounds < len(self.cache):
+            # Evict the least recently used sound
+            self.cache.popitem(last=False)
+            self.nb_evicted += 1
+
+        return audio_segment
+
+    def __getitem__(self, filename):
+        return self.get(filename)
+
+    def preload(self, filenames):
+        """
+        Decode the sounds in {filenames} up to the capacity of the cache
+        When called before forking the worker processes, the decoded sounds are shared by all workers
+        """
+        filenames = sorted(filenames)
+
+        if self.max_cached_sounds > 0:
+            filenames = filenames[:self.max_cached_sounds]
+
+        for filename in filenames:
+            self.get(filename)
+
+        return len(filenames)
@@ -0,0 +1,113 @@
+# CLEAR Dataset
+# >> Columnar elementary sounds catalog
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import numpy as np
+
+from utils.scene_constraints import build_attribute_table
+
+"""
+    The elementary sounds definition is a list of dicts (The sound id is the index in the list).
+    The catalog keep the same information as columns (Structure of arrays) :
+        codes[attribute]            int-coded values of each categorical attribute (numpy array indexed by sound id)
+        values[attribute]           decoded values, None is always the last code
+        ids_by_value[attribute]     ids of the sounds having each value (Precomputed, sorted & read-only)
+        numerical columns           duration (ms), nb_samples, ... (numpy arrays indexed by sound id)
+    Lookups by value or by filename are dict accesses. The attribute table used by the scene validator is
+    the one of the catalog (See utils/scene_constraints.py)
+"""
+
+
+class Elementary_Sounds_Catalog:
+    """
+    Structure of arrays view of the elementary sounds definition
+      - get_ids() return the ids of the sounds having some attribute values
+      - get_id() return the id of a sound from its filename
+      - count_values() count the values of an attribute in a list of sound ids
+    """
+
+    def __init__(self, definition, categorical_attributes, attributes_values=None, numerical_attributes=('duration',),
+                 columns=None):
+        self.nb_sounds = len(definition)
+
+        # Only the attributes present in the definition (Ex : The duration is only known once the sounds are analysed)
+        categorical_attributes = [attribute for attribute in categorical_attributes
+                                  if all(attribute in sound for sound in definition)]
+        numerical_attributes = [attribute for attribute in numerical_attributes
+                                if all(attribute in sound for sound in definition)]
+
+        self.table = build_attribute_table(definition, attributes_values or {}, categorical_attributes,
+                                           numerical_attributes)
+
+        for column_name, column in (columns or {}).items():
+            self.table[column_name] = np.array(column, dtype=np.int64)
+
+        self.codes = self.table['codes']
+        self.values = self.table['values']
+        self.value_codes = {attribute: {value: code for code, value in enumerate(values)}
+                            for attribute, values in self.values.items()}
+
+        self.ids_by_value = {}
+        for attribute, codes in self.codes.items():
+            # Sound ids grouped by code (Sorted by id within each group, mergesort is stable)
+            sorted_ids = np.argsort(codes, kind='mergesort')
+            group_ends = np.cumsum(np.bincount(codes, minlength=len(self.values[attribute])))
+            ids_by_code = np.split(sorted_ids, group_ends[:-1])
+
+            # The id arrays are returned by get_ids(), the callers can't modify the index
+            for ids in ids_by_code:
+                ids.flags.writeable = False
+
+            self.ids_by_value[attribute] = {value: ids for value, ids in zip(self.values[attribute], ids_by_code)}
+
+        self.ids_by_filename = {sound['filename']: sound_id for sound_id, sound in enumerate(definition)
+                                if 'filename' in sound}
+
+    def __len__(self):
+        return self.nb_sounds
+
+    def __getitem__(self, column_name):
+        return self.table[column_name]
+
+    def get_id(self, filename):
+        return self.ids_by_filename[filename]
+
+    def get_ids(self, **attributes):
+        """
+        Ids of the sounds having all the given attribute values (Ex : get_ids(instrument='cello', loudness='loud'))
+        Sorted & read-only array. With multiple attributes, the precomputed id arrays are intersected (Smallest first)
+        """
+        id_arrays = []
+        for attribute, value in attributes.items():
+            if value not in self.value_codes[attribute]:
+                return np.zeros(0, dtype=np.int64)
+
+            id_arrays.append(self.ids_by_value[attribute][value])
+
+        if not id_arrays:
+            ids = np.arange(self.nb_sounds)
+            ids.flags.writeable = False
+            return ids
+
+        id_arrays.sort(key=len)
+
+        ids = id_arrays[0]
+        for other_ids in id_arrays[1:]:
+            ids = np.intersect1d(ids, other_ids, assume_unique=True)
+            ids.flags.writeable = False
+
+        return ids
+
+    def count_values(self, attribute, sound_ids):
+        """
+        Number of sounds of {sound_ids} having each value of {attribute} (Including the values with 0 sounds)
+        """
+        counts = np.bincount(self.codes[attribute][np.asarray(sound_ids, dtype=np.int64)],
+                             minlength=len(self.values[attribute]))
+
+        return {value: int(count) for value, count in zip(self.values[attribute], counts)}
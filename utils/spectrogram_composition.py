@@ -0,0 +1,155 @@
+# CLEAR Dataset
+# >> Spectrogram composition from the elementary sounds STFT
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import numpy as np
+from pydub.utils import get_array_type, get_min_max_value, db_to_float
+
+"""
+    Without reverberation, a scene is a sum of elementary sounds at known offsets plus background noise.
+    When every sound starts on a multiple of the hop size, each frame of the scene STFT is the sum of frames of the
+    elementary sounds STFT. The scene spectrogram can then be composed without rendering the audio :
+        - The complex STFT of each elementary sound is computed once (For every frame that overlap the sound)
+        - The silences of the scenes are snapped to a multiple of the hop size (See utils/render_records.py) and the
+          length of each sound is padded to a multiple of the hop size
+        - The frames of the sounds are added at their offset and the background noise is drawn directly in the STFT
+          domain (Complex gaussian with the same power as the uniform white noise of the time domain rendering)
+
+    Without noise, the result is the same as computing the spectrogram of the aligned scene with matplotlib.mlab.
+    The noise is statistically equivalent but is not the same realisation as the one of the time domain rendering,
+    the correlation between overlapping frames is not modeled.
+"""
+
+
+class Spectrogram_Composer:
+
+    def __init__(self, sounds_bank, window_length, window_overlap):
+        self.sounds_bank = sounds_bank
+        self.window_length = window_length
+        self.hop_length = window_length - window_overlap
+        self.window = np.hanning(window_length)
+
+        # Number of frames that overlap a given hop
+        self.nb_overlapping_frames = int(np.ceil(window_length / self.hop_length))
+
+        self.sounds_stft = {}
+
+        self.frame_rate = None
+        self.sample_width = None
+
+    def get_sound_stft(self, filename):
+        """
+        Complex STFT of the elementary sound, including the frames that partially overlap the sound
+        The first frame start (nb_overlapping_frames - 1) hops before the sound
+        Return the STFT, the padded length of the sound (Multiple of the hop size) and its length
+        """
+        if filename not in self.sounds_stft:
+            audio_segment = self.sounds_bank[filename]
+
+            if self.frame_rate is None:
+                self.frame_rate = audio_segment.frame_rate
+                self.sample_width = audio_segment.sample_width
+
+            assert audio_segment.frame_rate == self.frame_rate and audio_segment.sample_width == self.sample_width \
+                and audio_segment.channels == 1, "All elementary sounds must be mono with the same format"
+
+            samples = np.frombuffer(audio_segment.raw_data, dtype=get_array_type(8 * self.sample_width))
+
+            nb_hops = int(np.ceil(len(samples) / self.hop_length))
+            left_padding = (self.nb_overlapping_frames - 1) * self.hop_length
+            nb_frames = self.nb_overlapping_frames - 1 + nb_hops
+
+            padded = np.zeros((nb_frames - 1) * self.hop_length + self.window_length, dtype=np.float64)
+            padded[left_padding:left_padding + len(samples)] = samples
+
+            frame_starts = np.arange(nb_frames) * self.hop_length
+            frames = padded[frame_starts[:, None] + np.arange(self.window_length)]
+            stft = np.fft.rfft(frames * self.window, axis=1).T.astype(np.complex64)
+
+            self.sounds_stft[filename] = (stft, nb_hops * self.hop_length, len(samples))
+
+        return self.sounds_stft[filename]
+
+    def get_placements(self, record):
+        """
+        Onset (in samples, multiple of the hop size) and length of each sound of the scene. Also return the length of
+        the scene
+        """
+        offset = record['aligned_silence_before']
+        onsets = []
+        lengths = []
+        for filename, silence_after in zip(record['sounds'], record['aligned_silences_after']):
+            stft, padded_length, length = self.get_sound_stft(filename)
+            onsets.append(offset)
+            lengths.append(length)
+            offset += padded_length + silence_after
+
+        return onsets, lengths, offset
+
+    def compose(self, record, noise_gain=None, seed=None):
+        """
+        Compose the power spectral density of the scene described by the render {record}
+        The record must contain the silences snapped to the hop size
+        Same scaling as matplotlib.mlab.specgram() (See AudioSceneProducer.computeSpectrogram())
+        Return (Pxx, freqs, bins, scene_length)
+        """
+        sounds = [self.get_sound_stft(filename) for filename in record['sounds']]
+        onsets, lengths, scene_length = self.get_placements(record)
+        sound_offsets = [onset // self.hop_length for onset in onsets]
+
+        padded_scene_length = max(scene_length, self.window_length)
+        nb_frames = (padded_scene_length - self.window_length) // self.hop_length + 1
+        nb_freqs = self.window_length // 2 + 1
+
+        scene_stft = np.zeros((nb_freqs, nb_frames), dtype=np.complex128)
+
+        for (stft, padded_length, length), sound_offset in zip(sounds, sound_offsets):
+            first_frame = sound_offset - (self.nb_overlapping_frames - 1)
+
+            # Frames outside of the scene are dropped
+            start = max(first_frame, 0)
+            end = min(first_frame + stft.shape[1], nb_frames)
+
+            if end > start:
+                scene_stft[:, start:end] += stft[:, start - first_frame:end - first_frame]
+
+        if noise_gain is not None:
+            scene_stft += self.draw_noise_stft(scene_stft.shape, noise_gain, seed)
+
+        Pxx = scene_stft.real ** 2 + scene_stft.imag ** 2
+
+        # One sided density : Scale everything except the DC component (and the NFFT/2 component if NFFT is even)
+        Pxx[1:-1 if self.window_length % 2 == 0 else None] *= 2.
+        Pxx /= self.frame_rate * (self.window ** 2).sum()
+
+        freqs = np.arange(nb_freqs) * self.frame_rate / self.window_length
+        bins = np.arange(self.window_length / 2, padded_scene_length - self.window_length / 2 + 1,
+                         self.hop_length) / self.frame_rate
+
+        return Pxx, freqs, bins, scene_length
+
+    def draw_noise_stft(self, shape, noise_gain, seed):
+        """
+        STFT frames of the background noise (See utils.audio_processing.generate_random_noise())
+        The uniform noise in [-A, A] have a variance of A^2/3, its windowed fourier coefficients are approximated by
+        complex gaussians of variance A^2/3 * sum(window^2)
+        """
+        min_value, max_value = get_min_max_value(8 * self.sample_width)
+        amplitude = max_value * db_to_float(noise_gain)
+        variance = amplitude ** 2 / 3 * (self.window ** 2).sum()
+
+        random_state = np.random.RandomState(seed)
+        noise = random_state.standard_normal(shape) + 1j * random_state.standard_normal(shape)
+        noise *= np.sqrt(variance / 2)
+
+        # DC and Nyquist components of a real signal are real
+        noise[0] = np.sqrt(2) * noise[0].real
+        if self.window_length % 2 == 0:
+            noise[-1] = np.sqrt(2) * noise[-1].real
+
+        return noise
@@ -0,0 +1,92 @@
+# CLEAR Dataset
+# >> Spectrogram frequency reduction (Band limiting & log-frequency binning)
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import numpy as np
+
+# Frame rates considered when lowering the rendering frame rate. pydub create silences at 11025 Hz, lower frame
+# rates would be upsampled when assembling the scenes
+standard_frame_rates = [11025, 16000, 22050, 32000, 44100, 48000]
+
+
+def get_band_limited_frame_rate(fmax, frame_rate):
+    """
+    Lowest standard frame rate that can represent frequencies up to {fmax}
+    Return {frame_rate} if it is already lower
+    """
+    for standard_frame_rate in standard_frame_rates:
+        if standard_frame_rate >= 2 * fmax:
+            return min(standard_frame_rate, frame_rate)
+
+    return frame_rate
+
+
+def crop_frequencies(Pxx, freqs, fmin, fmax):
+    """
+    Keep the frequency bins in the [fmin, fmax] interval
+    """
+    in_band = (freqs >= fmin) & (freqs <= fmax)
+
+    return Pxx[in_band], freqs[in_band]
+
+
+_log_frequency_weights = {}
+
+
+def get_log_frequency_weights(freqs, fmin, fmax, nb_bins):
+    """
+    Weights matrix [nb_bins, len(freqs)] averaging the linear frequency bins in log spaced bands between fmin and fmax
+    Bands that doesn't contain any linear bin (Low frequencies) are interpolated from the closest linear bins
+    Return the weights and the center frequency of each band
+    """
+    key = (len(freqs), freqs[0], freqs[-1], fmin, fmax, nb_bins)
+
+    if key not in _log_frequency_weights:
+        # 0 Hz can't be represented on a log scale, start at the first non zero bin
+        low_freq = max(fmin, freqs[freqs > 0][0])
+        edges = np.geomspace(low_freq, fmax, nb_bins + 1)
+        centers = np.sqrt(edges[:-1] * edges[1:])
+
+        weights = np.zeros((nb_bins, len(freqs)), dtype=np.float64)
+        for band_index, (low, high) in enumerate(zip(edges[:-1], edges[1:])):
+            in_band = np.nonzero((freqs >= low) & (freqs < high))[0]
+
+            if len(in_band) > 0:
+                weights[band_index, in_band] = 1 / len(in_band)
+            else:
+                # Linear interpolation at the center of the band
+                upper = min(max(np.searchsorted(freqs, centers[band_index]), 1), len(freqs) - 1)
+                lower = upper - 1
+                ratio = (centers[band_index] - freqs[lower]) / (freqs[upper] - freqs[lower])
+                weights[band_index, lower] = 1 - ratio
+                weights[band_index, upper] = ratio
+
+        _log_frequency_weights[key] = (weights, centers)
+
+    return _log_frequency_weights[key]
+
+
+def log_frequency_binning(Pxx, freqs, fmin, fmax, nb_bins):
+    weights, centers = get_log_frequency_weights(freqs, fmin, fmax, nb_bins)
+
+    return weights @ Pxx, centers
+
+
+def reduce_spectrogram(Pxx, freqs, fmin=0, fmax=None, nb_log_bins=0):
+    """
+    Restrict the spectrogram to [fmin, fmax] and optionally rebin the frequencies on a log scale
+    {fmax} None means up to the highest frequency of the spectrogram
+    Return the reduced Pxx and the frequency of each row
+    """
+    if nb_log_bins > 0:
+        return log_frequency_binning(Pxx, freqs, fmin, fmax if fmax is not None else freqs[-1], nb_log_bins)
+
+    if fmin > 0 or fmax is not None:
+        return crop_frequencies(Pxx, freqs, fmin, fmax if fmax is not None else freqs[-1])
+
+    return Pxx, freqs
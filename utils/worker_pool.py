@@ -0,0 +1,303 @@
+# CLEAR Dataset
+# >> Worker Pool with memory governor
+#
+# Author :      Jerome Abdelnour
+# Year :        2018-2019
+# Affiliations: Universite de Sherbrooke - Electrical and Computer Engineering faculty
+#               KTH Stockholm Royal Institute of Technology
+#               IGLU - CHIST-ERA
+
+import os
+import sys
+import gc
+import resource
+from multiprocessing import Process, Queue, RawArray
+from queue import Empty, Full
+
+
+def get_process_rss():
+    """
+    Resident set size of the current process (in bytes)
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, ValueError, IndexError):
+        # Not on linux, fallback on the peak resident set size
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class Recycling_Worker_Pool:
+    """
+    Pool of worker processes consuming tasks from a bounded queue
+      - Each worker keep track of its resident memory (RSS) and of the number of tasks it completed
+      - A worker is gracefully recycled (Replaced by a new process) once it exceed {max_tasks_per_worker} tasks or
+        {max_rss_mb} MB of resident memory. This bound the memory leaks (Ex : matplotlib) without having to force a
+        garbage collection after every task
+      - Each worker write its state (The number of the task it is processing or one of the worker states below) in
+        shared memory. When a worker crash (Ex : killed because of its memory usage), its replacement process the same
+        task first ({max_task_retries} times). The tasks that still fail are reported in the summary (lost_tasks)
+      - When a worker crash after it could have consumed a stop signal, another stop signal is queued. The tasks that
+        are still pending at the end of the run (Ex : worker crashed right after dequeuing a task) are lost
+      - {task_report_fct} is called by the worker after each task, its result (Ex : statistics accumulated since the
+        previous call) is given to {merge_report_fct} in the main process. Only the report of the task being
+        processed is lost when a worker crash
+      - The workers report their stats when exiting, a summary is printed at the end of the run
+    """
+
+    # Worker states (The task number when processing a task)
+    IDLE = -1
+    FETCHING = -2
+    STOPPED = -3
+    RECYCLING = -4
+
+    def __init__(self, task_fct, nb_process, max_tasks_per_worker=0, max_rss_mb=0, queue_size=1000,
+                 task_report_fct=None, merge_report_fct=None, max_task_retries=1):
+        self.task_fct = task_fct
+        self.task_report_fct = task_report_fct
+        self.merge_report_fct = merge_report_fct
+        self.nb_process = nb_process
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.max_task_retries = max_task_retries
+
+        self.task_queue = Queue(maxsize=queue_size)
+        self.status_queue = Queue()
+
+        # State of each worker slot (Task number or worker state)
+        self.current_tasks = RawArray('q', nb_process)
+
+        # Number of the last task completed by each worker slot (Its acknowledgment can be lost if the worker crash)
+        self.completed_tasks = RawArray('q', nb_process)
+
+        # Tasks queued but not completed yet : {task_number: (task, nb_attempts)}
+        self.pending_tasks = {}
+        self.nb_queued_tasks = 0
+        self.nb_completed_tasks = 0
+
+        self.workers = {}
+        self.nb_spawned = 0
+        self.worker_reports = []
+        self.nb_crashed = 0
+        self.nb_retried_tasks = 0
+        self.lost_tasks = []
+
+    def _worker_loop(self, slot, first_task=None):
+        nb_tasks = 0
+        peak_rss = get_process_rss()
+        exit_reason = 'done'
+
+        while True:
+            if first_task is not None:
+                queued_task = first_task
+                first_task = None
+            else:
+                # The dequeued item is unknown if the worker crash before publishing it
+                self.current_tasks[slot] = self.FETCHING
+                queued_task = self.task_queue.get()
+
+            if queued_task is None:
+                # No more tasks
+                self.current_tasks[slot] = self.STOPPED
+                break
+
+            task_number, task = queued_task
+            self.current_tasks[slot] = task_number
+
+            self.task_fct(task)
+            self.completed_tasks[slot] = task_number
+            nb_tasks += 1
+
+            self.status_queue.put({
+                'slot': slot,
+                'task_number': task_number,
+                'report': self.task_report_fct() if self.task_report_fct is not None else None
+            })
+
+            # The task is acknowledged, it won't be processed again if the worker crash
+            self.current_tasks[slot] = self.IDLE
+
+            rss = get_process_rss()
+
+            if 0 < self.max_rss < rss:
+                # Try to release memory before deciding to recycle the worker
+                gc.collect()
+                rss = get_process_rss()
+
+            peak_rss = max(peak_rss, rss)
+
+            if 0 < self.max_tasks_per_worker <= nb_tasks:
+                exit_reason = 'max_tasks'
+                self.current_tasks[slot] = self.RECYCLING
+                break
+
+            if 0 < self.max_rss < rss:
+                exit_reason = 'max_rss'
+                self.current_tasks[slot] = self.RECYCLING
+                break
+
+        self.status_queue.put({
+            'slot': slot,
+            'pid': os.getpid(),
+            'nb_tasks': nb_tasks,
+            'rss': get_process_rss(),
+            'peak_rss': peak_rss,
+            'reason': exit_reason
+        })
+
+    def _spawn_worker(self, slot, first_task=None):
+        self.current_tasks[slot] = self.IDLE
+        self.completed_tasks[slot] = -1
+
+        process = Process(target=self._worker_loop, args=(slot, first_task))
+        process.start()
+        self.workers[slot] = process
+        self.nb_spawned += 1
+
+    def _add_pending_task(self, task, nb_attempts=0):
+        task_number = self.nb_queued_tasks
+        self.pending_tasks[task_number] = (task, nb_attempts)
+        self.nb_queued_tasks += 1
+
+        return task_number, task
+
+    def _handle_crashed_worker(self, slot, process, stop_signals_queued):
+        """
+        Replace a crashed worker. Return True if its stop signal must be queued again
+        """
+        print("[ERROR] Worker process %d crashed (Exit code %d). Replacing it." % (process.pid, process.exitcode),
+              file=sys.stderr)
+        self.nb_crashed += 1
+
+        retry_task = None
+        task_number = self.current_tasks[slot]
+
+        completed_task_number = self.completed_tasks[slot]
+        if completed_task_number in self.pending_tasks:
+            # Completed but not acknowledged, only the report of the task is lost
+            self.pending_tasks.pop(completed_task_number)
+            self.nb_completed_tasks += 1
+
+        # The worker consumed its stop signal or could have consumed one (Only queued once all the tasks are queued)
+        stop_signal_lost = task_number == self.STOPPED or (task_number == self.FETCHING and stop_signals_queued)
+
+        if task_number in self.pending_tasks:
+            task, nb_attempts = self.pending_tasks.pop(task_number)
+
+            if nb_attempts < self.max_task_retries:
+                print("[ERROR] Task %s will be processed again" % str(task), file=sys.stderr)
+                retry_task = self._add_pending_task(task, nb_attempts + 1)
+                self.nb_retried_tasks += 1
+            else:
+                print("[ERROR] Task %s is lost" % str(task), file=sys.stderr)
+                self.lost_tasks.append(task)
+
+        # The replacement consume the stop signal of the crashed worker once the retried task is done
+        self._spawn_worker(slot, first_task=retry_task)
+
+        return stop_signal_lost
+
+    def run(self, tasks):
+        tasks = iter(tasks)
+
+        for slot in range(self.nb_process):
+            self._spawn_worker(slot)
+
+        all_tasks_queued = False
+        pending_task = None
+        nb_sentinels_to_queue = self.nb_process
+        nb_finished_workers = 0
+
+        while nb_finished_workers < self.nb_process:
+            # Fill up the task queue
+            try:
+                while not all_tasks_queued:
+                    if pending_task is None:
+                        pending_task = next(tasks, None)
+
+                        if pending_task is None:
+                            all_tasks_queued = True
+                            print("Done filling worker processes queue", flush=True)
+                            break
+
+                    self.task_queue.put_nowait((self.nb_queued_tasks, pending_task))
+                    self._add_pending_task(pending_task)
+                    pending_task = None
+
+                # One stop signal per worker. Recycled workers don't consume it, their replacement will
+                while all_tasks_queued and nb_sentinels_to_queue > 0:
+                    self.task_queue.put_nowait(None)
+                    nb_sentinels_to_queue -= 1
+            except Full:
+                # The remaining tasks will be queued on the next iteration
+                pass
+
+            # Retrieve workers status
+            try:
+                status = self.status_queue.get(timeout=1)
+            except Empty:
+                status = None
+
+            while status is not None:
+                if 'task_number' in status:
+                    # Completed task (Already counted if the worker crashed before this acknowledgment was read)
+                    if self.pending_tasks.pop(status['task_number'], None) is not None:
+                        self.nb_completed_tasks += 1
+
+                    if status['report'] is not None and self.merge_report_fct is not None:
+                        self.merge_report_fct(status['report'])
+                else:
+                    self.worker_reports.append(status)
+                    process = self.workers.get(status['slot'])
+
+                    if process is None or process.pid != status['pid']:
+                        # Late report of a worker that crashed while exiting, it was already replaced
+                        pass
+                    elif status['reason'] == 'done':
+                        process.join()
+                        nb_finished_workers += 1
+                        del self.workers[status['slot']]
+                    else:
+                        # Recycle the worker
+                        process.join()
+                        self._spawn_worker(status['slot'])
+
+                try:
+                    status = self.status_queue.get_nowait()
+                except Empty:
+                    status = None
+
+            # Replace crashed workers
+            for slot, process in list(self.workers.items()):
+                if not process.is_alive() and process.exitcode not in (None, 0):
+                    if self._handle_crashed_worker(slot, process, stop_signals_queued=all_tasks_queued):
+                        nb_sentinels_to_queue += 1
+
+        # Tasks dequeued by a worker that crashed before publishing them
+        for task, _ in self.pending_tasks.values():
+            print("[ERROR] Task %s is lost" % str(task), file=sys.stderr)
+            self.lost_tasks.append(task)
+        self.pending_tasks = {}
+
+        return self.get_summary()
+
+    def get_summary(self):
+        nb_recycled = {
+            'max_tasks': sum(1 for report in self.worker_reports if report['reason'] == 'max_tasks'),
+            'max_rss': sum(1 for report in self.worker_reports if report['reason'] == 'max_rss')
+        }
+
+        nb_tasks = [report['nb_tasks'] for report in self.worker_reports]
+        peak_rss = [report['peak_rss'] for report in self.worker_reports]
+
+        return {
+            'nb_tasks': self.nb_completed_tasks,
+            'nb_workers_spawned': self.nb_spawned,
+            'nb_workers_recycled': nb_recycled,
+            'nb_workers_crashed': self.nb_crashed,
+            'nb_retried_tasks': self.nb_retried_tasks,
+            'lost_tasks': self.lost_tasks,
+            'mean_tasks_per_worker': sum(nb_tasks) / len(nb_tasks) if len(nb_tasks) > 0 else 0,
+            'max_peak_rss_mb': max(peak_rss) / (1024 * 1024) if len(peak_rss) > 0 else 0
+        }